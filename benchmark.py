@@ -1,12 +1,32 @@
+import os
 import requests
 import time
 import json
 import boto3
 
+from loadgen import run_load, run_phase, sweep, parse_rates
+from results_store import record_run
+from workloads import WORKLOAD, HttpTarget, run_workload, workload_from_env
+
 AWS_REGION = "us-east-1"
+PROXY_URL = os.getenv("PROXY_URL", "")  # e.g. http://127.0.0.1:5000, skips EC2 discovery
+
+READ_REQUESTS = int(os.getenv("READ_REQUESTS", "1000"))
+WRITE_REQUESTS = int(os.getenv("WRITE_REQUESTS", "1000"))
+
+CLIENTS = int(os.getenv("CLIENTS", "16"))
+WARMUP_REQUESTS = int(os.getenv("WARMUP_REQUESTS", "100"))
 
-READ_REQUESTS = 1000
-WRITE_REQUESTS = 1000
+# "closed" runs fixed request counts per strategy; "sweep" runs the open-loop
+# constant-rate sweep on READ_QUERY (or the WORKLOAD mix) to find where p99
+# latency takes off. WORKLOAD picks a sakila mix from workloads.py; the default
+# "select1" keeps the original separate read and write phases.
+BENCH_MODE = os.getenv("BENCH_MODE", "closed")
+SWEEP_RATES = parse_rates(os.getenv("SWEEP_RATES", "50,100,200,400,800,1600"))
+SWEEP_DURATION = float(os.getenv("SWEEP_DURATION", "10"))
+SWEEP_WARMUP = float(os.getenv("SWEEP_WARMUP", "2"))
+SWEEP_CLIENTS = int(os.getenv("SWEEP_CLIENTS", "64"))
+KNEE_FACTOR = float(os.getenv("KNEE_FACTOR", "3"))
 
 READ_QUERY = "SELECT 1"
 WRITE_QUERY = "INSERT INTO actor (first_name, last_name) VALUES ('Bench', 'Mark')"
@@ -30,68 +50,149 @@ def discover_proxy_ip():
 
     raise RuntimeError("Proxy instance not found")
 
-proxy_ip = discover_proxy_ip()
-BASE_URL = f"http://{proxy_ip}:5000"
+if PROXY_URL:
+    BASE_URL = PROXY_URL.rstrip("/")
+else:
+    proxy_ip = discover_proxy_ip()
+    BASE_URL = f"http://{proxy_ip}:5000"
 
 print("Proxy discovered at:", BASE_URL)
 
 # =============================
 # HTTP HELPERS
 # =============================
-def post_query(query):
-    return requests.post(
+def post_query(query, session=requests):
+    # Bypass the proxy result cache so every strategy actually hits MySQL
+    return session.post(
         f"{BASE_URL}/query",
-        json={"query": query},
+        json={"query": query, "cache": False},
         timeout=5
     )
 
+def status_ok(response):
+    return response.status_code == 200
+
 def get_stats():
     return requests.get(
         f"{BASE_URL}/stats",
         timeout=5
     ).json()
 
+def set_strategy(strategy_name):
+    r = requests.post(
+        f"{BASE_URL}/strategy",
+        json={"strategy": strategy_name},
+        timeout=5
+    )
+    r.raise_for_status()
+
+def reset_stats():
+    requests.post(
+        f"{BASE_URL}/stats/reset",
+        timeout=5
+    )
+
 # =============================
 # BENCHMARK
 # =============================
 def run_benchmark(strategy_name):
     print(f"\n=== Running benchmark for strategy: {strategy_name} ===")
 
-    errors = 0
-    start = time.time()
+    set_strategy(strategy_name)
+
+    # Warm pools and health EWMAs, then reset so /stats only covers measured requests
+    if WARMUP_REQUESTS:
+        run_phase(lambda s: post_query(READ_QUERY, s), status_ok, CLIENTS, WARMUP_REQUESTS)
+    reset_stats()
 
-    # READ
-    for i in range(READ_REQUESTS):
-        r = post_query(READ_QUERY)
-        print(f"read {i}")
-        if r.status_code != 200:
-            errors += 1
+    if WORKLOAD != "select1":
+        return run_mix(strategy_name)
+
+    start = time.time()
 
-    # WRITE
-    for j in range(WRITE_REQUESTS):
-        r = post_query(WRITE_QUERY)
-        print(f"write {j}")
-        if r.status_code != 200:
-            errors += 1
+    read, _ = run_load("read", lambda s: post_query(READ_QUERY, s), status_ok, CLIENTS, READ_REQUESTS)
+    write, _ = run_load("write", lambda s: post_query(WRITE_QUERY, s), status_ok, CLIENTS, WRITE_REQUESTS)
 
     duration = round(time.time() - start, 2)
 
     stats = get_stats()
 
+    total = read["requests"] + write["requests"]
+    mean_ms = (
+        read["latency_ms"]["mean"] * read["requests"] + write["latency_ms"]["mean"] * write["requests"]
+    ) / total if total else 0
+
     result = {
         "strategy": strategy_name,
+        "clients": CLIENTS,
+        "warmup_requests": WARMUP_REQUESTS,
         "read_requests": READ_REQUESTS,
         "write_requests": WRITE_REQUESTS,
         "total_requests": READ_REQUESTS + WRITE_REQUESTS,
-        "errors": errors,
+        "errors": read["errors"] + write["errors"],
         "total_time_sec": duration,
-        "avg_latency_ms": round(duration * 1000 / (READ_REQUESTS + WRITE_REQUESTS), 2),
+        "avg_latency_ms": round(mean_ms, 2),
+        "read": read,
+        "write": write,
         "stats": stats
     }
 
     filename = f"results_{strategy_name}.json"
     with open(filename, "w") as f:
         json.dump(result, f, indent=2)
+    record_run("proxy", result, strategy=strategy_name, workload=WORKLOAD, clients=CLIENTS)
+
+    print(f"Results written to {filename}")
+
+def run_mix(strategy_name):
+    # A sakila mix from workloads.py, READ_REQUESTS + WRITE_REQUESTS operations in total
+    workload = workload_from_env(HttpTarget(BASE_URL))
+    mixed, _ = run_workload(workload, CLIENTS, READ_REQUESTS + WRITE_REQUESTS)
+
+    result = {
+        "strategy": strategy_name,
+        "workload": WORKLOAD,
+        "clients": CLIENTS,
+        "warmup_requests": WARMUP_REQUESTS,
+        "total_requests": mixed["requests"],
+        "errors": mixed["errors"],
+        "total_time_sec": mixed["elapsed_sec"],
+        "avg_latency_ms": mixed["latency_ms"]["mean"],
+        "mixed": mixed,
+        "stats": get_stats()
+    }
+
+    filename = f"results_{WORKLOAD}_{strategy_name}.json"
+    with open(filename, "w") as f:
+        json.dump(result, f, indent=2)
+    record_run("proxy", result, strategy=strategy_name, workload=WORKLOAD, clients=CLIENTS)
+
+    print(f"Results written to {filename}")
+
+def run_sweep(strategy_name):
+    print(f"\n=== Open-loop sweep for strategy: {strategy_name} ===")
+
+    set_strategy(strategy_name)
+    reset_stats()
+
+    if WORKLOAD == "select1":
+        request_fn, ok_fn = lambda s: post_query(READ_QUERY, s), status_ok
+    else:
+        request_fn, ok_fn = workload_from_env(HttpTarget(BASE_URL)).request, bool
+
+    result = sweep(
+        strategy_name, request_fn, ok_fn,
+        SWEEP_RATES, SWEEP_DURATION, SWEEP_CLIENTS, SWEEP_WARMUP, KNEE_FACTOR,
+    )
+    result["strategy"] = strategy_name
+    result["workload"] = WORKLOAD
+    result["query"] = READ_QUERY if WORKLOAD == "select1" else None
+    result["stats"] = get_stats()
+
+    filename = f"results_sweep_{strategy_name}.json" if WORKLOAD == "select1" else f"results_sweep_{WORKLOAD}_{strategy_name}.json"
+    with open(filename, "w") as f:
+        json.dump(result, f, indent=2)
+    record_run("proxy", result, strategy=strategy_name, mode="sweep", workload=WORKLOAD, clients=SWEEP_CLIENTS)
 
     print(f"Results written to {filename}")
 
@@ -99,6 +200,7 @@ def run_benchmark(strategy_name):
 # MAIN
 # =============================
 if __name__ == "__main__":
-    run_benchmark("direct")
-    run_benchmark("random")
-    run_benchmark("custom")
+    run = run_sweep if BENCH_MODE == "sweep" else run_benchmark
+    run("direct")
+    run("random")
+    run("custom")
@@ -4,11 +4,18 @@ import json
 import requests
 import boto3
 
+from loadgen import run_load, sweep, parse_rates
+from results_store import record_run
+from workloads import WORKLOAD, HttpTarget, run_workload, workload_from_env
+
 AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
 GATEKEEPER_PORT = int(os.getenv("GATEKEEPER_PORT", "4000"))
 GATEKEEPER_ROLE = os.getenv("GATEKEEPER_ROLE", "gateway")
 GATEKEEPER_TOKEN = os.getenv("GATEKEEPER_TOKEN", "estelle")
+GATEKEEPER_URL = os.getenv("GATEKEEPER_URL", "")  # e.g. http://127.0.0.1:4000, skips EC2 discovery
 REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "5"))
+# "msgpack" asks for the columnar MessagePack body (gzipped when large) instead of JSON
+RESPONSE_FORMAT = os.getenv("RESPONSE_FORMAT", "json")
 
 PROXY_PORT = int(os.getenv("PROXY_PORT", "5000"))
 PROXY_ROLE = os.getenv("PROXY_ROLE", "proxy")
@@ -19,6 +26,18 @@ READ_REQUESTS = int(os.getenv("READ_REQUESTS", "1000"))
 WRITE_REQUESTS = int(os.getenv("WRITE_REQUESTS", "1000"))
 BLOCKED_REQUESTS = int(os.getenv("BLOCKED_REQUESTS", "30"))
 
+CLIENTS = int(os.getenv("CLIENTS", "16"))
+WARMUP_REQUESTS = int(os.getenv("WARMUP_REQUESTS", "100"))
+
+# "sweep" runs the open-loop constant-rate sweep on READ_QUERY instead
+BENCH_MODE = os.getenv("BENCH_MODE", "closed")
+SWEEP_RATES = parse_rates(os.getenv("SWEEP_RATES", "50,100,200,400,800,1600"))
+SWEEP_DURATION = float(os.getenv("SWEEP_DURATION", "10"))
+SWEEP_WARMUP = float(os.getenv("SWEEP_WARMUP", "2"))
+SWEEP_CLIENTS = int(os.getenv("SWEEP_CLIENTS", "64"))
+KNEE_FACTOR = float(os.getenv("KNEE_FACTOR", "3"))
+SWEEP_RESULTS_FILE = os.getenv("SWEEP_RESULTS_FILE", "results_gatekeeper_sweep.json")
+
 READ_QUERY = os.getenv("READ_QUERY", "SELECT 1")
 WRITE_QUERY = os.getenv(
     "WRITE_QUERY",
@@ -66,8 +85,11 @@ def discover_proxy_ip():
     raise RuntimeError("Proxy instance not found")
 
 
-GATEKEEPER_IP = discover_gatekeeper_ip()
-BASE_URL = f"http://{GATEKEEPER_IP}:{GATEKEEPER_PORT}"
+if GATEKEEPER_URL:
+    BASE_URL = GATEKEEPER_URL.rstrip("/")
+else:
+    GATEKEEPER_IP = discover_gatekeeper_ip()
+    BASE_URL = f"http://{GATEKEEPER_IP}:{GATEKEEPER_PORT}"
 
 print("Gatekeeper discovered at:", BASE_URL)
 
@@ -76,12 +98,14 @@ print("Gatekeeper discovered at:", BASE_URL)
 # HTTP HELPERS
 # =============================
 
-def post_query(query, token):
+def post_query(query, token, session=requests):
     headers = {}
     if token:
         headers["Authorization"] = f"Bearer {token}"
+    if RESPONSE_FORMAT == "msgpack":
+        headers["Accept"] = "application/msgpack"
 
-    return requests.post(
+    return session.post(
         f"{BASE_URL}/query",
         json={"query": query},
         headers=headers,
@@ -135,55 +159,55 @@ def run_benchmark():
     if not GATEKEEPER_TOKEN:
         raise RuntimeError("GATEKEEPER_TOKEN is required to run the benchmark")
 
-    errors = 0
-    latencies_ms = []
     reset_url = None
     reset_error = None
 
     print("\n=== Gatekeeper benchmark ===")
 
-    if RESET_PROXY_STATS:
-        reset_url, reset_error = reset_proxy_stats()
-
     # Unauthorized check
     unauth = post_query(READ_QUERY, token="")
     unauth_status = unauth.status_code
 
+    def phase(name, query, expected_status, total, warmup):
+        return run_load(
+            name,
+            lambda s: post_query(query, GATEKEEPER_TOKEN, s),
+            lambda r: r.status_code == expected_status,
+            CLIENTS, total, warmup_requests=warmup,
+        )
+
+    # Warm up before resetting so proxy stats only cover measured requests
+    if WARMUP_REQUESTS:
+        phase("warmup", READ_QUERY, 200, WARMUP_REQUESTS, 0)
+
+    if RESET_PROXY_STATS:
+        reset_url, reset_error = reset_proxy_stats()
+
     start = time.time()
 
-    # READ
-    for i in range(READ_REQUESTS):
-        req_start = time.time()
-        r = post_query(READ_QUERY, GATEKEEPER_TOKEN)
-        latencies_ms.append(round((time.time() - req_start) * 1000, 2))
-        print(f"read {i}")
-        if r.status_code != 200:
-            errors += 1
-
-    # WRITE
-    for j in range(WRITE_REQUESTS):
-        req_start = time.time()
-        r = post_query(WRITE_QUERY, GATEKEEPER_TOKEN)
-        latencies_ms.append(round((time.time() - req_start) * 1000, 2))
-        print(f"write {j}")
-        if r.status_code != 200:
-            errors += 1
-
-    # BLOCKED
-    for k in range(BLOCKED_REQUESTS):
-        req_start = time.time()
-        r = post_query(BLOCKED_QUERY, GATEKEEPER_TOKEN)
-        latencies_ms.append(round((time.time() - req_start) * 1000, 2))
-        print(f"blocked {k}")
-        if r.status_code != 400:
-            errors += 1
+    # WORKLOAD other than select1 replaces the read and write phases with one sakila mix
+    if WORKLOAD == "select1":
+        read, read_samples = phase("read", READ_QUERY, 200, READ_REQUESTS, 0)
+        write, write_samples = phase("write", WRITE_QUERY, 200, WRITE_REQUESTS, 0)
+        phases = {"read": read, "write": write}
+        samples = read_samples + write_samples
+    else:
+        workload = workload_from_env(HttpTarget(BASE_URL, GATEKEEPER_TOKEN))
+        mixed, samples = run_workload(workload, CLIENTS, READ_REQUESTS + WRITE_REQUESTS)
+        phases = {"mixed": mixed}
+    blocked, blocked_samples = phase("blocked", BLOCKED_QUERY, 400, BLOCKED_REQUESTS, 0)
+    phases["blocked"] = blocked
 
     duration = round(time.time() - start, 2)
 
+    latencies_ms = [round(s[1], 2) for s in samples + blocked_samples]
+    errors = sum(p["errors"] for p in phases.values())
+
     proxy_stats_url, proxy_stats, proxy_stats_error = fetch_proxy_stats()
 
     result = {
         "gatekeeper_url": BASE_URL,
+        "workload": WORKLOAD,
         "proxy_reset_url": reset_url,
         "proxy_reset_error": reset_error,
         "unauthorized_status": unauth_status,
@@ -191,10 +215,13 @@ def run_benchmark():
         "write_requests": WRITE_REQUESTS,
         "blocked_requests": BLOCKED_REQUESTS,
         "total_requests": READ_REQUESTS + WRITE_REQUESTS + BLOCKED_REQUESTS + 1,
+        "clients": CLIENTS,
+        "warmup_requests": WARMUP_REQUESTS,
         "errors": errors,
         "total_time_sec": duration,
         "avg_latency_ms": round(sum(latencies_ms) / len(latencies_ms), 2) if latencies_ms else 0,
         "latency_samples_ms": latencies_ms[:10],
+        **phases,
         "proxy_stats_url": proxy_stats_url,
         "proxy_stats": proxy_stats,
         "proxy_stats_error": proxy_stats_error,
@@ -202,12 +229,53 @@ def run_benchmark():
 
     with open(RESULTS_FILE, "w") as f:
         json.dump(result, f, indent=2)
+    record_run("gatekeeper", result, strategy=(proxy_stats or {}).get("strategy"), workload=WORKLOAD, clients=CLIENTS)
 
     print(f"Results written to {RESULTS_FILE}")
 
 
+def run_sweep():
+    if not GATEKEEPER_TOKEN:
+        raise RuntimeError("GATEKEEPER_TOKEN is required to run the benchmark")
+
+    print("\n=== Gatekeeper open-loop sweep ===")
+
+    reset_url, reset_error = reset_proxy_stats() if RESET_PROXY_STATS else (None, None)
+
+    if WORKLOAD == "select1":
+        request_fn, ok_fn = lambda s: post_query(READ_QUERY, GATEKEEPER_TOKEN, s), lambda r: r.status_code == 200
+    else:
+        request_fn, ok_fn = workload_from_env(HttpTarget(BASE_URL, GATEKEEPER_TOKEN)).request, bool
+
+    result = sweep(
+        "gatekeeper", request_fn, ok_fn,
+        SWEEP_RATES, SWEEP_DURATION, SWEEP_CLIENTS, SWEEP_WARMUP, KNEE_FACTOR,
+    )
+
+    proxy_stats_url, proxy_stats, proxy_stats_error = fetch_proxy_stats()
+    result.update({
+        "gatekeeper_url": BASE_URL,
+        "query": READ_QUERY if WORKLOAD == "select1" else None,
+        "workload": WORKLOAD,
+        "proxy_reset_url": reset_url,
+        "proxy_reset_error": reset_error,
+        "proxy_stats_url": proxy_stats_url,
+        "proxy_stats": proxy_stats,
+        "proxy_stats_error": proxy_stats_error,
+    })
+
+    with open(SWEEP_RESULTS_FILE, "w") as f:
+        json.dump(result, f, indent=2)
+    record_run("gatekeeper", result, strategy=(proxy_stats or {}).get("strategy"), mode="sweep", workload=WORKLOAD, clients=SWEEP_CLIENTS)
+
+    print(f"Results written to {SWEEP_RESULTS_FILE}")
+
+
 # =============================
 # MAIN
 # =============================
 if __name__ == "__main__":
-    run_benchmark()
+    if BENCH_MODE == "sweep":
+        run_sweep()
+    else:
+        run_benchmark()
@@ -0,0 +1,295 @@
+import re
+import threading
+from collections import OrderedDict, namedtuple
+
+# Shared by gatekeeper.py, proxy.py and proxy_async.py: one SQL lexer and
+# classifier, so the firewall judges a statement exactly as the proxy routes
+# it. Comments, literals and variables never count as keywords, versioned
+# /*!...*/ comments are read as the SQL they hold, and a batch of ';'-joined
+# statements is classified statement by statement. Statements are classified
+# once per fingerprint (literals replaced by '?'), so parameterised traffic
+# hits the memo and never reaches the lexer.
+
+FINGERPRINT = re.compile(
+    r"(--(?:[ \t][^\n]*)?(?=\n|$)|#[^\n]*|/\*(?!!)[\s\S]*?\*/)"
+    r"|('(?:[^'\\]|\\[\s\S]|'')*'|\"(?:[^\"\\]|\\[\s\S]|\"\")*\""
+    r"|(?<![\w$])(?:0x[0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)(?![\w$]))"
+    r"|(`(?:[^`]|``)*`|/\*!\d*)"
+)
+SQL_LEXER = re.compile(
+    r"(?P<space>\s+|--(?:[ \t][^\n]*)?(?=\n|$)|#[^\n]*|/\*(?!!)[\s\S]*?\*/|/\*!\d*|\*/)"
+    r"|(?P<string>'(?:[^'\\]|\\[\s\S]|'')*'|\"(?:[^\"\\]|\\[\s\S]|\"\")*\")"
+    r"|(?P<ident>`(?:[^`]|``)*`)"
+    r"|(?P<var>@@?(?:[\w$.]+|`[^`]*`|'[^']*')?)"
+    r"|(?P<number>0x[0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)"
+    r"|(?P<word>[A-Za-z_$][\w$]*)"
+    r"|(?P<op>:=|\S)"
+)
+
+READ_VERBS = {"select", "show", "explain", "describe", "desc", "table", "values"}
+# Writes that touch no table data and so never invalidate the result cache
+SESSION_VERBS = {"set", "use", "begin", "start", "commit", "rollback", "savepoint", "release", "do"}
+# Statements that leave state on their connection (variables, locks, an open
+# transaction, a default schema...): the connection is closed afterwards
+# rather than handed to the next request
+SESSION_STATE_VERBS = SESSION_VERBS | {"lock", "unlock", "flush", "prepare", "execute", "deallocate", "handler", "xa"}
+SESSION_STATE_FUNCTIONS = {"get_lock", "release_lock", "release_all_locks"}
+SIDE_EFFECT_FUNCTIONS = {
+    "get_lock", "release_lock", "release_all_locks", "is_free_lock", "is_used_lock",
+    "last_insert_id", "nextval", "setval", "master_pos_wait", "source_pos_wait",
+    "wait_for_executed_gtid_set", "load_file",
+}
+NON_DETERMINISTIC_FUNCTIONS = {
+    "now", "rand", "uuid", "uuid_short", "sysdate", "curdate", "curtime", "current_timestamp",
+    "current_date", "current_time", "current_user", "localtime", "localtimestamp",
+    "unix_timestamp", "utc_date", "utc_time", "utc_timestamp", "connection_id",
+    "found_rows", "row_count", "sleep", "benchmark", "database", "user",
+}
+# Keywords that end a table reference, so they are never taken for an alias
+TABLE_REF_STOP = {
+    "as", "where", "join", "inner", "left", "right", "outer", "cross", "natural", "straight_join",
+    "on", "using", "group", "order", "limit", "having", "window", "union", "except", "intersect",
+    "for", "lock", "into", "set", "values", "value", "select", "partition", "use", "force",
+    "ignore", "procedure", "from", "where", "returning", "with", "duplicate", "default",
+    "if", "not", "exists", "like", "full", "low_priority", "quick", "delayed", "high_priority",
+    "outfile", "dumpfile",
+}
+# Words that put a table name right after TABLE / TABLES
+TABLE_KEYWORD_VERBS = {
+    "truncate", "alter", "drop", "create", "temporary", "lock", "rename",
+    "optimize", "analyze", "check", "repair", "checksum",
+}
+
+SqlInfo = namedtuple("SqlInfo", "read verb tables write_tables cacheable session")
+
+
+def fingerprint(sql):
+    def repl(m):
+        if m.group(1) is not None:
+            return " "
+        if m.group(2) is not None:
+            return "?"
+        return m.group(3)
+
+    return FINGERPRINT.sub(repl, sql)
+
+
+def lex(sql):
+    tokens = []
+    for m in SQL_LEXER.finditer(sql):
+        kind = m.lastgroup
+        if kind == "space":
+            continue
+        value = m.group()
+        if kind == "word":
+            value = value.lower()
+        elif kind == "ident":
+            value = value[1:-1].replace("``", "`").lower()
+        tokens.append((kind, value))
+    return tokens
+
+
+def split_statements(tokens):
+    statements = [[]]
+    for tok in tokens:
+        if tok == ("op", ";"):
+            statements.append([])
+        else:
+            statements[-1].append(tok)
+    return [s for s in statements if s]
+
+
+def skip_parens(tokens, i):
+    # tokens[i] is "(": returns the index just past its matching ")"
+    depth = 0
+    while i < len(tokens):
+        if tokens[i] == ("op", "("):
+            depth += 1
+        elif tokens[i] == ("op", ")"):
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    return i
+
+
+def is_name(tok, allow_keywords=False):
+    kind, value = tok
+    return kind == "ident" or (kind == "word" and (allow_keywords or value not in TABLE_REF_STOP))
+
+
+def read_table_ref(tokens, i, tables):
+    # name or db.name, plus an optional alias; returns the index after it
+    if i >= len(tokens) or not is_name(tokens[i]):
+        return i
+    name = tokens[i][1]
+    i += 1
+    if i + 1 < len(tokens) and tokens[i] == ("op", ".") and is_name(tokens[i + 1], True):
+        name = tokens[i + 1][1]
+        i += 2
+    if name != "dual":
+        tables.add(name)
+    if i < len(tokens) and tokens[i] == ("word", "as"):
+        i += 1
+    if i < len(tokens) and is_name(tokens[i]):
+        i += 1
+    return i
+
+
+def read_table_list(tokens, i, tables):
+    while True:
+        i = read_table_ref(tokens, i, tables)
+        if i < len(tokens) and tokens[i] == ("op", ","):
+            i += 1
+            continue
+        return i
+
+
+def classify_statement(tokens):
+    i = 0
+    while i < len(tokens) and tokens[i] == ("op", "("):
+        i += 1
+    verb = tokens[i][1] if i < len(tokens) and tokens[i][0] == "word" else ""
+    ctes = set()
+
+    if verb == "with":
+        i += 1
+        if i < len(tokens) and tokens[i] == ("word", "recursive"):
+            i += 1
+        while i < len(tokens) and is_name(tokens[i], True):
+            ctes.add(tokens[i][1])
+            i += 1
+            if i < len(tokens) and tokens[i] == ("op", "("):
+                i = skip_parens(tokens, i)
+            if i < len(tokens) and tokens[i] == ("word", "as"):
+                i += 1
+            if i < len(tokens) and tokens[i] == ("op", "("):
+                i = skip_parens(tokens, i)
+            if i < len(tokens) and tokens[i] == ("op", ","):
+                i += 1
+                continue
+            break
+        while i < len(tokens) and tokens[i] == ("op", "("):
+            i += 1
+        verb = tokens[i][1] if i < len(tokens) and tokens[i][0] == "word" else ""
+
+    read = verb in READ_VERBS
+    cacheable = verb in ("select", "table", "values")
+    session = verb in SESSION_STATE_VERBS or (
+        verb == "create" and i + 1 < len(tokens) and tokens[i + 1] == ("word", "temporary")
+    )
+    tables = set()
+    n = len(tokens)
+
+    if verb in ("describe", "desc", "explain") and i + 1 < n and is_name(tokens[i + 1]):
+        read_table_ref(tokens, i + 1, tables)
+
+    j = 0
+    while j < n:
+        kind, value = tokens[j]
+        nxt = tokens[j + 1] if j + 1 < n else (None, None)
+        if kind == "var" or (kind == "op" and value == ":="):
+            cacheable = False
+            if kind == "var" and nxt == ("op", ":="):
+                session = True                # SELECT @v := ...
+        elif kind != "word":
+            pass
+        elif nxt == ("op", "(") and value in SIDE_EFFECT_FUNCTIONS:
+            read = cacheable = False
+            session = session or value in SESSION_STATE_FUNCTIONS
+        elif value in NON_DETERMINISTIC_FUNCTIONS and (nxt == ("op", "(") or value.startswith(("current_", "local", "utc_"))):
+            cacheable = False
+        elif value == "for" and nxt[1] in ("update", "share"):
+            read = cacheable = False          # locking read
+        elif value == "lock" and nxt == ("word", "in"):
+            read = cacheable = False          # LOCK IN SHARE MODE
+        elif value == "into":
+            if verb in ("select", "values", "table"):
+                read = cacheable = False      # SELECT ... INTO @var / OUTFILE
+                session = session or nxt[0] == "var"
+            k = j + 1
+            if nxt == ("word", "table"):      # LOAD DATA ... INTO TABLE t
+                k += 1
+            read_table_ref(tokens, k, tables)
+        elif value == "from" and nxt != ("op", "("):
+            read_table_list(tokens, j + 1, tables)
+        elif value in ("join", "straight_join") and nxt != ("op", "("):
+            read_table_ref(tokens, j + 1, tables)
+        elif value == "update" and (j == 0 or tokens[j - 1][1] not in ("for", "key")):
+            k = j + 1
+            while k < n and tokens[k][1] in ("low_priority", "ignore"):
+                k += 1
+            read_table_list(tokens, k, tables)
+        elif value in ("table", "tables") and (j == i or (j > 0 and tokens[j - 1][1] in TABLE_KEYWORD_VERBS)):
+            k = j + 1
+            while k < n and tokens[k][1] in ("if", "not", "exists"):
+                k += 1
+            read_table_list(tokens, k, tables)
+        elif value in ("insert", "replace", "truncate") and j == i:
+            k = j + 1
+            while k < n and tokens[k][1] in ("low_priority", "delayed", "high_priority", "ignore"):
+                k += 1
+            if k < n and tokens[k][1] not in ("into", "table"):
+                read_table_ref(tokens, k, tables)
+        j += 1
+
+    tables -= ctes
+    if read:
+        write_tables = frozenset()
+    elif verb in SESSION_VERBS:
+        write_tables = frozenset()
+    else:
+        write_tables = frozenset(tables) or None
+    return SqlInfo(read, verb, frozenset(tables), write_tables, cacheable, session)
+
+
+def classify_uncached(sql):
+    statements = [classify_statement(s) for s in split_statements(lex(sql))]
+    if not statements:
+        return SqlInfo(False, "", frozenset(), None, False, False)
+    if len(statements) == 1:
+        return statements[0]
+    tables = frozenset().union(*(s.tables for s in statements))
+    read = all(s.read for s in statements)
+    if read:
+        write_tables = frozenset()
+    elif any(s.write_tables is None for s in statements):
+        write_tables = None
+    else:
+        write_tables = frozenset().union(*(s.write_tables for s in statements))
+    return SqlInfo(read, statements[0].verb, tables, write_tables, False, any(s.session for s in statements))
+
+
+class ClassifierCache:
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def classify(self, sql):
+        key = fingerprint(sql)
+        with self.lock:
+            info = self.entries.get(key)
+            if info is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return info
+            self.misses += 1
+        info = classify_uncached(key)
+        with self.lock:
+            self.entries[key] = info
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return info
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "max_size": self.max_size,
+                    "hits": self.hits, "misses": self.misses}
+
+    def reset_stats(self):
+        with self.lock:
+            self.hits = 0
+            self.misses = 0
@@ -0,0 +1,321 @@
+import json
+import math
+import os
+import statistics
+import sys
+
+from results_store import METRIC_DIRECTIONS, RESULTS_STORE, load_runs, series_key
+
+try:
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+except ImportError:
+    plt = None
+
+# Compares stored benchmark runs (results_store.py) between two commits and
+# regenerates the charts from the whole store.
+#
+#   python compare.py                      # latest commit vs the one before it
+#   python compare.py <baseline> [<candidate>]
+#
+# A metric counts as a regression when its median moves the wrong way by more
+# than COMPARE_THRESHOLD percent and, when both sides have at least two runs,
+# Welch's t-test says the difference is unlikely to be noise. Exits with 1 if
+# anything regressed so CI can gate on it.
+
+COMPARE_THRESHOLD = float(os.getenv("COMPARE_THRESHOLD", "5"))  # percent
+COMPARE_ALPHA = float(os.getenv("COMPARE_ALPHA", "0.05"))
+ERROR_RATE_THRESHOLD = float(os.getenv("ERROR_RATE_THRESHOLD", "0.01"))  # absolute
+CHARTS_DIR = os.getenv("CHARTS_DIR", "charts")
+COMPARISON_FILE = os.getenv("COMPARISON_FILE", "comparison.json")
+
+CHART_METRICS = ("throughput_rps", "p50", "p99")
+
+# =========================
+# STATISTICS
+# =========================
+def incomplete_beta(a, b, x):
+    # Regularized incomplete beta I_x(a, b) by continued fraction (Numerical Recipes)
+    if x <= 0:
+        return 0.0
+    if x >= 1:
+        return 1.0
+    front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) + a * math.log(x) + b * math.log(1 - x))
+    if x > (a + 1) / (a + b + 2):
+        return 1.0 - incomplete_beta(b, a, 1 - x)
+
+    tiny = 1e-30
+    c, d = 1.0, 1.0 - (a + b) * x / (a + 1)
+    d = 1.0 / (d if abs(d) > tiny else tiny)
+    h = d
+    for m in range(1, 200):
+        m2 = 2 * m
+        for numerator in (
+            m * (b - m) * x / ((a + m2 - 1) * (a + m2)),
+            -(a + m) * (a + b + m) * x / ((a + m2) * (a + m2 + 1)),
+        ):
+            d = 1.0 + numerator * d
+            d = 1.0 / (d if abs(d) > tiny else tiny)
+            c = 1.0 + numerator / c
+            c = c if abs(c) > tiny else tiny
+            h *= d * c
+        if abs(d * c - 1.0) < 1e-12:
+            break
+    return front * h / a
+
+
+def welch_p_value(baseline, candidate):
+    """Two-sided p-value of Welch's t-test, None when either side has < 2 runs."""
+    if len(baseline) < 2 or len(candidate) < 2:
+        return None
+    var_b, var_c = statistics.variance(baseline), statistics.variance(candidate)
+    se_b, se_c = var_b / len(baseline), var_c / len(candidate)
+    diff = statistics.mean(candidate) - statistics.mean(baseline)
+    if se_b + se_c == 0:
+        return 0.0 if diff else 1.0
+    t = diff / math.sqrt(se_b + se_c)
+    df = (se_b + se_c) ** 2 / (
+        (se_b ** 2 / (len(baseline) - 1) if se_b else 0) + (se_c ** 2 / (len(candidate) - 1) if se_c else 0)
+    )
+    return incomplete_beta(df / 2, 0.5, df / (df + t * t))
+
+
+def metric_direction(metric):
+    return METRIC_DIRECTIONS.get(metric.rsplit(".", 1)[-1])
+
+
+def compare_metric(metric, baseline, candidate):
+    higher_is_better = metric_direction(metric)
+    base, cand = statistics.median(baseline), statistics.median(candidate)
+    p_value = welch_p_value(baseline, candidate)
+
+    if metric.endswith(".error_rate"):
+        delta = cand - base
+        worse, better = delta > ERROR_RATE_THRESHOLD, delta < -ERROR_RATE_THRESHOLD
+        change_pct = None
+    else:
+        if base:
+            change_pct = (cand - base) / abs(base) * 100
+        else:
+            change_pct = 0.0 if cand == base else math.copysign(math.inf, cand - base)
+        signed = change_pct if higher_is_better else -change_pct
+        worse, better = signed < -COMPARE_THRESHOLD, signed > COMPARE_THRESHOLD
+
+    significant = p_value is None or p_value < COMPARE_ALPHA
+    if worse:
+        verdict = "regression" if significant else "noise"
+    elif better:
+        verdict = "improvement" if significant else "noise"
+    else:
+        verdict = "ok"
+
+    return {
+        "metric": metric,
+        "baseline": round(base, 3),
+        "candidate": round(cand, 3),
+        "change_pct": round(change_pct, 2) if change_pct is not None and math.isfinite(change_pct) else change_pct,
+        "p_value": round(p_value, 4) if p_value is not None else None,
+        "baseline_runs": len(baseline),
+        "candidate_runs": len(candidate),
+        "verdict": verdict,
+    }
+
+# =========================
+# COMPARISON
+# =========================
+def group_series(runs):
+    series = {}
+    for run in runs:
+        series.setdefault(series_key(run), []).append(run)
+    for entries in series.values():
+        entries.sort(key=lambda r: r["recorded_at"])
+    return series
+
+
+def commit_order(runs):
+    # Commits in the order they were first benchmarked
+    order = []
+    for run in sorted(runs, key=lambda r: r["recorded_at"]):
+        if run["commit"] not in order:
+            order.append(run["commit"])
+    return order
+
+
+def pick_commits(runs, baseline, candidate):
+    order = commit_order(runs)
+    if candidate is None:
+        candidate = order[-1] if order else None
+    else:
+        candidate = next((c for c in order if matches(c, candidate)), candidate)
+    if baseline is None:
+        earlier = order[:order.index(candidate)] if candidate in order else []
+        baseline = earlier[-1] if earlier else None
+    return baseline, candidate
+
+
+def matches(commit, ref):
+    # Prefix match on the sha, but "abc" never matches "abc+dirty"
+    return commit is not None and ref is not None and commit.startswith(ref) and "+" not in commit[len(ref):]
+
+
+def compare(runs, baseline=None, candidate=None):
+    report = {"baseline": None, "candidate": None, "threshold_pct": COMPARE_THRESHOLD,
+              "alpha": COMPARE_ALPHA, "series": []}
+    for key, entries in sorted(group_series(runs).items(), key=lambda kv: [str(k) for k in kv[0]]):
+        base_commit, cand_commit = pick_commits(entries, baseline, candidate)
+        base_runs = [r for r in entries if matches(r["commit"], base_commit)]
+        cand_runs = [r for r in entries if matches(r["commit"], cand_commit)]
+        if not base_runs or not cand_runs or base_commit == cand_commit:
+            continue
+        report["baseline"] = report["baseline"] or base_commit
+        report["candidate"] = report["candidate"] or cand_commit
+
+        metrics = []
+        names = sorted(set(cand_runs[-1]["metrics"]) & set(base_runs[-1]["metrics"]))
+        for metric in names:
+            # Per-rate sweep points move with the rate list; the knee is what matters
+            if metric.startswith("sweep@") or metric_direction(metric) is None:
+                continue
+            base_values = [r["metrics"][metric] for r in base_runs if metric in r["metrics"]]
+            cand_values = [r["metrics"][metric] for r in cand_runs if metric in r["metrics"]]
+            if base_values and cand_values:
+                metrics.append(compare_metric(metric, base_values, cand_values))
+
+        report["series"].append({
+            "environment": key[0], "benchmark": key[1], "mode": key[2],
+            "workload": key[3], "strategy": key[4], "clients": key[5],
+            "baseline": base_commit, "candidate": cand_commit,
+            "metrics": metrics,
+        })
+    return report
+
+
+def print_report(report):
+    print(f"Baseline {report['baseline']} -> candidate {report['candidate']} "
+          f"(threshold {report['threshold_pct']}%, alpha {report['alpha']})")
+    for series in report["series"]:
+        print(f"\n{series['environment']} / {series['benchmark']} / {series['mode']} / "
+              f"{series['workload']} / {series['strategy']} / clients={series['clients']}")
+        for m in series["metrics"]:
+            change = "-" if m["change_pct"] is None else f"{m['change_pct']:+.1f}%"
+            p_value = "-" if m["p_value"] is None else f"{m['p_value']:.3f}"
+            flag = {"regression": "  <-- REGRESSION", "improvement": "  (improved)"}.get(m["verdict"], "")
+            print(f"  {m['metric']:<28} {m['baseline']:>12} -> {m['candidate']:<12} {change:>9}  "
+                  f"p={p_value:<6} n={m['baseline_runs']}/{m['candidate_runs']}{flag}")
+
+# =========================
+# CHARTS
+# =========================
+def chart_name(key, suffix):
+    parts = [str(k) for k in key if k is not None]
+    return os.path.join(CHARTS_DIR, "_".join(parts).replace("/", "-").replace(" ", "") + f"_{suffix}.png")
+
+
+def plot_charts(runs):
+    if plt is None:
+        print("matplotlib not installed, skipping charts")
+        return []
+    os.makedirs(CHARTS_DIR, exist_ok=True)
+
+    # One chart per benchmark/workload: metric trend across commits, one line per strategy
+    charts = {}
+    for run in runs:
+        key = (run["environment"], run["benchmark"], run["mode"], run["workload"])
+        charts.setdefault(key, []).append(run)
+
+    written = []
+    for key, entries in charts.items():
+        commits = commit_order(entries)
+        metrics = sorted({m for r in entries for m in r["metrics"]
+                          if not m.startswith("sweep@") and m.rsplit(".", 1)[-1] in CHART_METRICS + ("knee_rps",)})
+        if not metrics:
+            continue
+        fig, axes = plt.subplots(len(metrics), 1, figsize=(10, 2.6 * len(metrics)), squeeze=False)
+        for ax, metric in zip(axes[:, 0], metrics):
+            for strategy in sorted({r.get("strategy") or "-" for r in entries}):
+                points = []
+                for i, commit in enumerate(commits):
+                    values = [r["metrics"][metric] for r in entries
+                              if r["commit"] == commit and (r.get("strategy") or "-") == strategy and metric in r["metrics"]]
+                    if values:
+                        points.append((i, statistics.median(values)))
+                if points:
+                    ax.plot([p[0] for p in points], [p[1] for p in points], marker="o", label=strategy)
+            ax.set_title(metric)
+            ax.set_xticks(range(len(commits)))
+            ax.set_xticklabels([c or "?" for c in commits], rotation=30, fontsize=8)
+            ax.grid(alpha=0.3)
+        axes[0, 0].legend(loc="best", fontsize=8)
+        fig.suptitle(" / ".join(str(k) for k in key))
+        fig.tight_layout()
+        path = chart_name(key, "trend")
+        fig.savefig(path)
+        plt.close(fig)
+        written.append(path)
+
+        # Latest commit: p50/p99 per phase side by side for every strategy
+        latest = [r for r in entries if r["commit"] == commits[-1]]
+        phases = sorted({m.split(".")[0] for r in latest for m in r["metrics"]
+                         if not m.startswith("sweep") and m.endswith(".p99")})
+        strategies = sorted({r.get("strategy") or "-" for r in latest})
+        if not phases:
+            continue
+        fig, ax = plt.subplots(figsize=(10, 4))
+        width = 0.8 / (len(strategies) * 2)
+        for s_index, strategy in enumerate(strategies):
+            for q_index, quantile in enumerate(("p50", "p99")):
+                heights = []
+                for phase in phases:
+                    values = [r["metrics"].get(f"{phase}.{quantile}") for r in latest
+                              if (r.get("strategy") or "-") == strategy]
+                    values = [v for v in values if v is not None]
+                    heights.append(statistics.median(values) if values else 0)
+                offset = (s_index * 2 + q_index) * width
+                ax.bar([i + offset for i in range(len(phases))], heights, width, label=f"{strategy} {quantile}")
+        ax.set_xticks([i + 0.4 - width / 2 for i in range(len(phases))])
+        ax.set_xticklabels(phases)
+        ax.set_ylabel("latency (ms)")
+        ax.set_title(f"{' / '.join(str(k) for k in key)} @ {commits[-1]}")
+        ax.legend(fontsize=8)
+        fig.tight_layout()
+        path = chart_name(key, "latest")
+        fig.savefig(path)
+        plt.close(fig)
+        written.append(path)
+
+    for path in written:
+        print("Chart written to", path)
+    return written
+
+# =========================
+# MAIN
+# =========================
+def main(argv):
+    runs = load_runs()
+    if not runs:
+        print(f"No runs in {RESULTS_STORE}")
+        return 0
+
+    baseline = argv[1] if len(argv) > 1 else None
+    candidate = argv[2] if len(argv) > 2 else None
+
+    report = compare(runs, baseline, candidate)
+    print_report(report)
+    with open(COMPARISON_FILE, "w") as f:
+        json.dump(report, f, indent=2)
+
+    plot_charts(runs)
+
+    regressions = [
+        (s["benchmark"], s["strategy"], m["metric"])
+        for s in report["series"] for m in s["metrics"] if m["verdict"] == "regression"
+    ]
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) past {COMPARE_THRESHOLD}%")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -9,6 +9,8 @@ KEY_NAME = "cloud_key"
 SECURITY_GROUP_ID = "sg-062f74efe31647b57"
 PROXY_PORT = 5000
 GATEKEEPER_PORT = 4000
+PROXY_SERVER = "proxy.py"  # or "proxy_async.py" for the asyncio server
+PROXY_PROCESSES = "auto"  # proxy.py worker processes, one per vCPU
 
 ec2 = boto3.resource("ec2", region_name=REGION)
 ec2_client = boto3.client("ec2", region_name=REGION)
@@ -104,7 +106,7 @@ print("DB HOSTS:", db_hosts)
 proxy_user_data = f"""#!/bin/bash
 apt update -y
 apt install -y python3-pip
-pip3 install flask pymysql requests boto3
+pip3 install flask pymysql requests boto3 aiohttp aiomysql msgpack orjson
 
 cat <<EOF > /home/ubuntu/db_hosts.json
 {json.dumps(db_hosts, indent=2)}
@@ -117,8 +119,14 @@ cat <<EOF > /home/ubuntu/mysql_instance_ids.txt
 EOF
 
 curl -L -o /home/ubuntu/proxy.py https://raw.githubusercontent.com/estellezeus/finalCloudLab/main/proxy.py
+curl -L -o /home/ubuntu/metrics.py https://raw.githubusercontent.com/estellezeus/finalCloudLab/main/metrics.py
+curl -L -o /home/ubuntu/tracing.py https://raw.githubusercontent.com/estellezeus/finalCloudLab/main/tracing.py
+curl -L -o /home/ubuntu/prefork.py https://raw.githubusercontent.com/estellezeus/finalCloudLab/main/prefork.py
+curl -L -o /home/ubuntu/proxy_async.py https://raw.githubusercontent.com/estellezeus/finalCloudLab/main/proxy_async.py
+curl -L -o /home/ubuntu/wire.py https://raw.githubusercontent.com/estellezeus/finalCloudLab/main/wire.py
+curl -L -o /home/ubuntu/classifier.py https://raw.githubusercontent.com/estellezeus/finalCloudLab/main/classifier.py
 sleep 30
-python3 /home/ubuntu/proxy.py &
+cd /home/ubuntu && PROXY_PROCESSES={PROXY_PROCESSES} python3 /home/ubuntu/{PROXY_SERVER} &
 """
 
 proxy = ec2.create_instances(
@@ -148,14 +156,20 @@ proxy.reload()
 gatekeeper_user_data = f"""#!/bin/bash
 apt update -y
 apt install -y python3-pip
-pip3 install flask requests boto3
+pip3 install flask requests boto3 msgpack orjson
 
 curl -L -o /home/ubuntu/gatekeeper.py https://raw.githubusercontent.com/estellezeus/finalCloudLab/main/gatekeeper.py
+curl -L -o /home/ubuntu/metrics.py https://raw.githubusercontent.com/estellezeus/finalCloudLab/main/metrics.py
+curl -L -o /home/ubuntu/tracing.py https://raw.githubusercontent.com/estellezeus/finalCloudLab/main/tracing.py
+curl -L -o /home/ubuntu/wire.py https://raw.githubusercontent.com/estellezeus/finalCloudLab/main/wire.py
+curl -L -o /home/ubuntu/classifier.py https://raw.githubusercontent.com/estellezeus/finalCloudLab/main/classifier.py
+curl -L -o /home/ubuntu/firewall.json https://raw.githubusercontent.com/estellezeus/finalCloudLab/main/firewall.json
 
 cat <<EOF >/home/ubuntu/gatekeeper.env
 GATEKEEPER_TOKEN=estelle
 PROXY_URL=http://{proxy.private_ip_address}:{PROXY_PORT}/query
 AWS_REGION={REGION}
+FIREWALL_CONFIG=/home/ubuntu/firewall.json
 EOF
 
 echo 'source /home/ubuntu/gatekeeper.env' >> /home/ubuntu/.bashrc
@@ -1,20 +1,48 @@
+import json
 import os
-import re
+import threading
 import time
 import boto3
 import requests
-from flask import Flask, request, jsonify
+from collections import OrderedDict
+from flask import Flask, Response, g, request, jsonify
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from classifier import classify_statement, fingerprint, lex, split_statements
+from metrics import Metrics, PROMETHEUS_CONTENT_TYPE
+from tracing import (
+    DEADLINE_HEADER, REQUEST_ID_HEADER, TraceBuffer, annotate, begin_trace, current_trace, end_trace, parse_server_timing, span,
+)
+from wire import MSGPACK_TYPE, install_json, wants_msgpack
 
 AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
 PROXY_URL = os.getenv("PROXY_URL")  # Optional override, e.g. http://<proxy-ip>:5000/query
+PROXY_URLS = os.getenv("PROXY_URLS", PROXY_URL or "")  # Comma-separated, load balanced
+PROXY_PORT = int(os.getenv("PROXY_PORT", "5000"))
+GATEKEEPER_PORT = int(os.getenv("GATEKEEPER_PORT", "4000"))
+PROXY_POOL_SIZE = int(os.getenv("PROXY_POOL_SIZE", "32"))
+PROXY_RETRIES = int(os.getenv("PROXY_RETRIES", "2"))
+PROXY_COOLDOWN = float(os.getenv("PROXY_COOLDOWN", "5"))
+DISCOVERY_TTL = float(os.getenv("DISCOVERY_TTL", "60"))
+DISCOVERY_BACKOFF = min(DISCOVERY_TTL, float(os.getenv("DISCOVERY_BACKOFF", "5")))  # after a failed describe_instances
 GATEKEEPER_TOKEN = os.getenv("GATEKEEPER_TOKEN", "")
 REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "5"))
+# The proxy's budget is this much shorter than ours so its 504 arrives before we give up
+DEADLINE_MARGIN_MS = float(os.getenv("DEADLINE_MARGIN_MS", "50"))
+FIREWALL_CONFIG = os.getenv("FIREWALL_CONFIG", "")  # JSON policy file, watched for changes
+FIREWALL_RELOAD_INTERVAL = float(os.getenv("FIREWALL_RELOAD_INTERVAL", "2"))
+FIREWALL_CACHE_SIZE = int(os.getenv("FIREWALL_CACHE_SIZE", "4096"))
 
 ec2 = boto3.client("ec2", region_name=AWS_REGION)
 app = Flask(__name__)
+install_json(app)
+METRICS = Metrics()
+
+STATUS_OUTCOMES = {400: "bad_request", 401: "unauthorized", 429: "shed", 502: "proxy_unreachable", 504: "deadline"}
 
 
-def discover_proxy_url():
+def discover_proxy_urls():
     response = ec2.describe_instances(
         Filters=[
             {"Name": "tag:Role", "Values": ["proxy"]},
@@ -22,13 +50,156 @@ def discover_proxy_url():
         ]
     )
 
+    urls = []
     for reservation in response.get("Reservations", []):
         for instance in reservation.get("Instances", []):
             ip = instance.get("PrivateIpAddress") or instance.get("PublicIpAddress")
             if ip:
-                return f"http://{ip}:5000/query"
+                urls.append(f"http://{ip}:{PROXY_PORT}")
+
+    if not urls:
+        raise RuntimeError("Proxy instance not found")
+    return sorted(urls)
+
+
+def base_url(url):
+    # Accept both http://host:port and the older http://host:port/query form
+    url = url.strip().rstrip("/")
+    return url[:-len("/query")] if url.endswith("/query") else url
+
+
+class ProxyEndpoints:
+    """Round-robin over proxy base URLs, either static (PROXY_URLS) or
+    discovered through EC2 and cached for DISCOVERY_TTL seconds."""
+
+    def __init__(self, static_urls):
+        self.static = bool(static_urls)
+        self.urls = [base_url(u) for u in static_urls]
+        self.expires_at = float("inf") if self.static else 0.0
+        self.down_until = {}
+        self.index = 0
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        try:
+            urls = discover_proxy_urls()
+        except Exception:
+            # Requests hold off retrying until the backoff passes
+            with self.lock:
+                self.expires_at = time.time() + DISCOVERY_BACKOFF
+            raise
+        with self.lock:
+            self.urls = urls
+            self.expires_at = time.time() + DISCOVERY_TTL
+
+    def refresh_loop(self):
+        # Refresh ahead of expiry so requests never wait on describe_instances
+        while True:
+            time.sleep(DISCOVERY_TTL / 2)
+            try:
+                self.refresh()
+            except Exception as exc:
+                print(f"Proxy discovery failed, keeping {self.urls}: {exc}")
+
+    def next(self, exclude=()):
+        # One request claims an expired cache and calls describe_instances;
+        # the rest keep using the cached urls, or fail fast if there are none
+        now = time.time()
+        with self.lock:
+            due = not self.static and now >= self.expires_at
+            if due:
+                self.expires_at = now + DISCOVERY_BACKOFF
+            cached = bool(self.urls)
+        if due:
+            try:
+                self.refresh()
+            except Exception as exc:
+                if not cached:
+                    raise
+                print(f"Proxy discovery failed, keeping {self.urls}: {exc}")
+        elif not cached:
+            raise RuntimeError("Proxy discovery failed recently, retrying shortly")
+        now = time.time()
+        with self.lock:
+            candidates = [u for u in self.urls if u not in exclude]
+            if not candidates:
+                return None
+            healthy = [u for u in candidates if self.down_until.get(u, 0) <= now] or candidates
+            self.index = (self.index + 1) % len(healthy)
+            return healthy[self.index]
+
+    def mark_down(self, url):
+        with self.lock:
+            self.down_until[url] = time.time() + PROXY_COOLDOWN
+
+    def stats(self):
+        now = time.time()
+        with self.lock:
+            return {
+                "static": self.static,
+                "urls": list(self.urls),
+                "down": [u for u, until in self.down_until.items() if until > now],
+            }
+
+
+PROXIES = ProxyEndpoints([u for u in PROXY_URLS.split(",") if u.strip()])
 
-    raise RuntimeError("Proxy instance not found")
+
+def make_session():
+    # Keep-alive connections to the proxies; connect errors are retried by
+    # urllib3 since nothing has been sent yet, the rest is handled in forward()
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=PROXY_POOL_SIZE,
+        max_retries=Retry(total=PROXY_RETRIES, connect=PROXY_RETRIES, read=0, status=0, redirect=0),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+session = make_session()
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+def forward(path, payload, idempotent, stream=False, extra_headers=None):
+    # POSTs to the next proxy; idempotent requests move on to another proxy on failure
+    # Every attempt gets what is left of REQUEST_TIMEOUT, and the proxy is told
+    # the same budget so it can shed work it could not finish in time
+    trace = current_trace()
+    headers = {REQUEST_ID_HEADER: trace.request_id} if trace else {}
+    headers.update(extra_headers or {})
+    deadline = g.get("start", time.time()) + REQUEST_TIMEOUT
+    tried = []
+    last_exc = RuntimeError("No proxy endpoint available")
+    while True:
+        url = PROXIES.next(exclude=tried)
+        if url is None:
+            raise last_exc
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"request exceeded its {REQUEST_TIMEOUT}s budget")
+        headers[DEADLINE_HEADER] = str(max(1, int(remaining * 1000 - DEADLINE_MARGIN_MS)))
+        try:
+            return session.post(url + path, json=payload, headers=headers, timeout=remaining, stream=stream)
+        except requests.exceptions.ReadTimeout as exc:
+            # The proxy is up but still busy; closing the connection makes it kill the query
+            raise DeadlineExceeded(f"no answer within the {REQUEST_TIMEOUT}s budget") from exc
+        except requests.exceptions.RequestException as exc:
+            PROXIES.mark_down(url)
+            tried.append(url)
+            last_exc = exc
+            if not idempotent or len(tried) > PROXY_RETRIES:
+                raise
+
+
+def session_fields(data):
+    # Read-your-writes token and opt-in, relayed as-is; the proxy validates them
+    return {key: data[key] for key in ("consistency", "session_token") if data.get(key)}
 
 
 def authorized(req):
@@ -38,53 +209,442 @@ def authorized(req):
     return GATEKEEPER_TOKEN and token == GATEKEEPER_TOKEN
 
 
-DENY_PATTERNS = [
-    r"\bdrop\b",
-    r"\btruncate\b",
-    r"delete\s+from",
-    r"\bshutdown\b",
-    r"\bkill\b",
-    r"\balter\b",
-]
+# Firewall: rules are compiled into a verb -> rules table, every statement is tokenized
+# once by classifier.py, the proxy's own lexer (comments, literals and variables
+# never match a rule), and verdicts are memoized per fingerprint so repeated
+# statement shapes skip the lexer.
+DEFAULT_POLICY = {
+    "default": "allow",
+    "rules": [
+        {
+            "action": "deny",
+            "statements": ["drop", "truncate", "delete", "shutdown", "kill", "alter", "prepare", "execute"],
+        },
+    ],
+}
+
+
+def rule_names(rule, key, index):
+    # "*" or absent -> None, otherwise a list of names -> lowercased set. A bare
+    # string would otherwise be iterated letter by letter and never match.
+    names = rule.get(key, "*")
+    if names == "*":
+        return None
+    if not isinstance(names, list) or not all(isinstance(n, str) for n in names):
+        raise ValueError(f"rule {index}: {key} must be '*' or a list of strings")
+    return {n.lower() for n in names}
+
+
+class Firewall:
+    def __init__(self, policy, cache_size=FIREWALL_CACHE_SIZE):
+        self.policy = policy
+        self.default = policy.get("default", "allow")
+        if self.default not in ("allow", "deny"):
+            raise ValueError("default must be 'allow' or 'deny'")
+        self.cache_size = cache_size
+        self.verdicts = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.compile(policy.get("rules", []))
+
+    def compile(self, rules):
+        # verb -> ordered [(tables or None, action, rule index)]; "*" rules are
+        # merged into every verb's list at their original position
+        compiled = []
+        verbs = set()
+        for index, rule in enumerate(rules):
+            action = rule.get("action")
+            if action not in ("allow", "deny"):
+                raise ValueError(f"rule {index}: action must be 'allow' or 'deny'")
+            statements = rule_names(rule, "statements", index)
+            statements = {"*"} if statements is None else statements
+            tables = rule_names(rule, "tables", index)
+            compiled.append((statements, tables, action, index))
+            verbs |= statements - {"*"}
+
+        self.wildcard = [(t, a, i) for s, t, a, i in compiled if "*" in s]
+        self.by_verb = {
+            verb: [(t, a, i) for s, t, a, i in compiled if verb in s or "*" in s]
+            for verb in verbs
+        }
+
+    def evaluate(self, sql):
+        # (allowed, reason, read_only); each statement is read the way the proxy classifies it
+        statements = [classify_statement(tokens) for tokens in split_statements(lex(sql))]
+        read_only = bool(statements) and all(info.read for info in statements)
+        for info in statements:
+            verb, tables = info.verb, info.tables
+            for rule_tables, action, index in self.by_verb.get(verb, self.wildcard):
+                if rule_tables is None or rule_tables & tables:
+                    if action == "deny":
+                        return False, f"{verb.upper()} denied by rule {index}", read_only
+                    break
+            else:
+                if self.default == "deny":
+                    return False, f"{verb.upper()} denied by default policy", read_only
+        return True, None, read_only
+
+    def check(self, sql):
+        key = fingerprint(sql)
+        with self.lock:
+            verdict = self.verdicts.get(key)
+            if verdict is not None:
+                self.verdicts.move_to_end(key)
+                self.hits += 1
+                return verdict
+            self.misses += 1
+        verdict = self.evaluate(key)
+        with self.lock:
+            self.verdicts[key] = verdict
+            if len(self.verdicts) > self.cache_size:
+                self.verdicts.popitem(last=False)
+        return verdict
+
+    def stats(self):
+        with self.lock:
+            return {
+                "default": self.default,
+                "rules": len(self.policy.get("rules", [])),
+                "cached_verdicts": len(self.verdicts),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+def firewall_mtime():
+    try:
+        return os.stat(FIREWALL_CONFIG).st_mtime
+    except OSError:
+        return None
+
+
+def load_firewall():
+    if FIREWALL_CONFIG and os.path.exists(FIREWALL_CONFIG):
+        with open(FIREWALL_CONFIG) as f:
+            return Firewall(json.load(f))
+    return Firewall(DEFAULT_POLICY)
+
+
+# stat before loading so an edit that lands mid-load is picked up next tick
+FIREWALL_MTIME = firewall_mtime() if FIREWALL_CONFIG else None
+FIREWALL = load_firewall()
+
+
+def reload_firewall():
+    global FIREWALL
+    FIREWALL = load_firewall()
+    print("Firewall policy loaded:", FIREWALL.stats())
+
+
+def firewall_watch_loop():
+    # Compare against the mtime of the policy actually applied, so a file that
+    # only appears after startup is loaded on its first sighting.
+    last_mtime = FIREWALL_MTIME
+    while True:
+        time.sleep(FIREWALL_RELOAD_INTERVAL)
+        mtime = firewall_mtime()
+        if mtime is None or mtime == last_mtime:
+            continue
+        try:
+            reload_firewall()
+        except Exception as exc:
+            print(f"Firewall reload failed, keeping previous policy: {exc}")
+        last_mtime = mtime
+
+
+METRICS.describe("requests_total", "Gatekeeper requests by route and outcome")
+METRICS.describe("request_latency_ms", "Gatekeeper request handling time")
+METRICS.describe("proxy_latency_ms", "Time spent waiting on the proxy")
+METRICS.gauge(
+    "firewall_verdict_cache",
+    lambda: {(("stat", k),): v for k, v in FIREWALL.stats().items() if isinstance(v, int)},
+    "Firewall verdict cache counters",
+)
+
+
+def check_query(query: str):
+    return FIREWALL.check(query)
 
 
 def is_safe_query(query: str) -> bool:
-    lowered = query.strip().lower()
-    return not any(re.search(pat, lowered) for pat in DENY_PATTERNS)
+    return check_query(query)[0]
+
+
+def relay_stream(resp, duration):
+    # Pass the proxy's NDJSON through chunk by chunk without decoding it
+    def generate():
+        try:
+            for chunk in resp.iter_content(chunk_size=None):
+                yield chunk
+        finally:
+            resp.close()
+
+    return Response(
+        generate(),
+        status=resp.status_code,
+        mimetype="application/x-ndjson",
+        headers={"X-Proxy-Duration-Ms": str(duration)},
+    )
+
+
+def negotiated_headers():
+    # A client that takes MessagePack gets the proxy's body as is, so the proxy
+    # must see what the client accepts, compression included
+    accept = request.headers.get("Accept")
+    if not wants_msgpack(accept):
+        return None
+    return {"Accept": accept, "Accept-Encoding": request.headers.get("Accept-Encoding", "identity")}
+
+
+def relay_packed(resp, duration):
+    # Byte for byte, still compressed; what the JSON wrapper carries goes in headers
+    try:
+        body = resp.raw.read(decode_content=False)
+    finally:
+        resp.close()
+    headers = {"X-Proxy-Duration-Ms": str(duration)}
+    for name in ("Content-Encoding", "Vary", "Retry-After"):
+        if name in resp.headers:
+            headers[name] = resp.headers[name]
+    return Response(body, status=resp.status_code, content_type=MSGPACK_TYPE, headers=headers)
+
+
+def proxy_reply(resp, duration, data):
+    content_type = resp.headers.get("Content-Type", "")
+    if content_type.startswith(MSGPACK_TYPE):
+        return relay_packed(resp, duration)
+    if not content_type.startswith("application/json"):
+        return timed_response(
+            {"duration_ms": duration, "proxy_status": resp.status_code, "proxy_response": resp.text},
+            resp.status_code,
+            data,
+            resp,
+        )
+    # The proxy's JSON goes into the wrapper without being decoded and encoded
+    # again; keys in the same sorted order jsonify would write
+    body = resp.content.rstrip()
+    timing = g.trace.breakdown() if data.get("timing") else None
+    headers = {"Retry-After": resp.headers["Retry-After"]} if "Retry-After" in resp.headers else None
+    dumps = app.json.dumps
+    with span("serialize"):
+        parts = [b'{"duration_ms":', dumps(duration).encode(), b',"proxy_response":', body,
+                 b',"proxy_status":', str(resp.status_code).encode()]
+        if timing is not None:
+            parts += [b',"timing_ms":', dumps(timing).encode()]
+        parts.append(b"}\n")
+        return Response(b"".join(parts), status=resp.status_code, mimetype="application/json", headers=headers)
+
+
+TRACES = TraceBuffer()
+
+
+def merge_proxy_timing(resp):
+    # Fold the proxy's Server-Timing into this trace as proxy.<stage>; what is
+    # left of "forward" is HTTP, network and queueing between the two hops
+    trace = current_trace()
+    stages = parse_server_timing(resp.headers.get("Server-Timing"))
+    proxy_total = stages.pop("total", None)
+    if trace is None or proxy_total is None:
+        return
+    trace.merge("proxy", stages)
+    trace.add("proxy.other", max(0.0, proxy_total - sum(stages.values())))
+    trace.add("forward", -proxy_total)
+
+
+def timed_response(body, status, data, resp):
+    if data.get("timing"):
+        body["timing_ms"] = g.trace.breakdown()
+    # Let clients back off when the proxy shed the request
+    headers = {"Retry-After": resp.headers["Retry-After"]} if "Retry-After" in resp.headers else None
+    with span("serialize"):
+        return jsonify(body), status, headers
+
+
+@app.before_request
+def start_timer():
+    g.start = time.time()
+    g.trace = begin_trace(request.headers.get(REQUEST_ID_HEADER), request.path)
+
+
+@app.after_request
+def observe_request(response):
+    start = g.get("start")
+    status = response.status_code
+    outcome = g.get("outcome") or STATUS_OUTCOMES.get(status) or ("ok" if status < 400 else "proxy_error")
+    if start is not None and request.url_rule is not None:
+        labels = (("route", request.url_rule.rule), ("outcome", outcome))
+        METRICS.inc("requests_total", labels)
+        METRICS.observe("request_latency_ms", (time.time() - start) * 1000, labels)
+    trace = g.get("trace")
+    if trace is not None:
+        response.headers["Server-Timing"] = trace.server_timing()
+        response.headers[REQUEST_ID_HEADER] = trace.request_id
+        if request.url_rule is not None and request.url_rule.rule.startswith("/query"):
+            annotate(status=status, outcome=outcome)
+            TRACES.offer(trace, force=g.get("trace_forced", False))
+    return response
+
+
+@app.teardown_request
+def finish_trace(exc):
+    end_trace()
 
 
 @app.route("/query", methods=["POST"])
 def handle_query():
-    if not authorized(request):
+    with span("auth"):
+        ok = authorized(request)
+    if not ok:
         return jsonify({"error": "Unauthorized"}), 401
 
-    data = request.get_json(silent=True) or {}
+    with span("parse"):
+        data = request.get_json(silent=True) or {}
     query = data.get("query", "")
+    g.trace_forced = bool(data.get("timing"))
 
     if not query:
         return jsonify({"error": "No SQL query provided"}), 400
 
-    if not is_safe_query(query):
-        return jsonify({"error": "Query rejected by gatekeeper"}), 400
+    with span("firewall"):
+        allowed, reason, read_only = check_query(query)
+    if not allowed:
+        g.outcome = "rejected"
+        return jsonify({"error": "Query rejected by gatekeeper", "reason": reason}), 400
 
-    target_url = PROXY_URL or discover_proxy_url()
+    payload = {"query": query}
+    if "cache" in data:
+        payload["cache"] = bool(data["cache"])
+    stream = bool(data.get("stream"))
+    if stream:
+        payload["stream"] = True
+    if g.trace_forced:
+        payload["timing"] = True
+    payload.update(session_fields(data))
+    negotiated = negotiated_headers()
 
     try:
         start = time.time()
-        resp = requests.post(target_url, json={"query": query}, timeout=REQUEST_TIMEOUT)
+        with span("forward"):
+            resp = forward("/query", payload, read_only, stream=stream or negotiated is not None,
+                           extra_headers=negotiated)
         duration = round((time.time() - start) * 1000, 2)
+        METRICS.observe("proxy_latency_ms", duration, (("route", "/query"),))
+    except DeadlineExceeded as exc:
+        return jsonify({"error": str(exc)}), 504
     except Exception as exc:
         return jsonify({"error": f"Failed to reach proxy: {exc}"}), 502
+    merge_proxy_timing(resp)
 
-    return jsonify(
-        {
-            "duration_ms": duration,
-            "proxy_status": resp.status_code,
-            "proxy_response": resp.json() if resp.headers.get("Content-Type", "").startswith("application/json") else resp.text,
-        }
-    ), resp.status_code
+    if stream and resp.headers.get("Content-Type", "").startswith("application/x-ndjson"):
+        return relay_stream(resp, duration)
+
+    return proxy_reply(resp, duration, data)
+
+
+@app.route("/query/batch", methods=["POST"])
+def handle_batch():
+    with span("auth"):
+        ok = authorized(request)
+    if not ok:
+        return jsonify({"error": "Unauthorized"}), 401
+
+    with span("parse"):
+        data = request.get_json(silent=True) or {}
+    queries = data.get("queries")
+    g.trace_forced = bool(data.get("timing"))
+
+    if not isinstance(queries, list) or not queries:
+        return jsonify({"error": "No SQL queries provided"}), 400
+
+    with span("firewall"):
+        verdicts = [check_query(q) if isinstance(q, str) and q else (False, None, False) for q in queries]
+    rejected = [i for i, v in enumerate(verdicts) if not v[0]]
+    if rejected:
+        g.outcome = "rejected"
+        return jsonify({"error": "Batch rejected by gatekeeper", "rejected_indexes": rejected}), 400
+
+    payload = {"queries": queries, "mode": data.get("mode", "pipeline"), **session_fields(data)}
+    if g.trace_forced:
+        payload["timing"] = True
+    negotiated = negotiated_headers()
+
+    try:
+        start = time.time()
+        with span("forward"):
+            resp = forward("/query/batch", payload, all(v[2] for v in verdicts), stream=negotiated is not None,
+                           extra_headers=negotiated)
+        duration = round((time.time() - start) * 1000, 2)
+        METRICS.observe("proxy_latency_ms", duration, (("route", "/query/batch"),))
+    except DeadlineExceeded as exc:
+        return jsonify({"error": str(exc)}), 504
+    except Exception as exc:
+        return jsonify({"error": f"Failed to reach proxy: {exc}"}), 502
+    merge_proxy_timing(resp)
+
+    return proxy_reply(resp, duration, data)
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    if not authorized(request):
+        return jsonify({"error": "Unauthorized"}), 401
+    return Response(METRICS.prometheus("gatekeeper_"), content_type=PROMETHEUS_CONTENT_TYPE)
+
+
+@app.route("/stats/reset", methods=["POST"])
+def reset_stats():
+    if not authorized(request):
+        return jsonify({"error": "Unauthorized"}), 401
+    METRICS.reset()
+    TRACES.clear()
+    return jsonify({"status": "ok"})
+
+
+@app.route("/traces", methods=["GET"])
+def traces():
+    if not authorized(request):
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify({
+        **TRACES.stats(),
+        "traces": TRACES.recent(
+            limit=request.args.get("limit", 50, type=int),
+            min_ms=request.args.get("min_ms", 0.0, type=float),
+            request_id=request.args.get("request_id"),
+            name=request.args.get("name"),
+        ),
+    })
+
+
+@app.route("/proxies", methods=["GET"])
+def proxies_status():
+    if not authorized(request):
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify(PROXIES.stats())
+
+
+@app.route("/firewall", methods=["GET"])
+def firewall_status():
+    if not authorized(request):
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify({"config": FIREWALL_CONFIG or None, "policy": FIREWALL.policy, "stats": FIREWALL.stats()})
+
+
+@app.route("/firewall/reload", methods=["POST"])
+def firewall_reload():
+    if not authorized(request):
+        return jsonify({"error": "Unauthorized"}), 401
+    try:
+        reload_firewall()
+    except Exception as exc:
+        return jsonify({"error": f"Reload failed: {exc}"}), 400
+    return jsonify({"status": "ok", "stats": FIREWALL.stats()})
 
 
 if __name__ == "__main__":
     print("Starting gatekeeper...")
-    app.run(host="0.0.0.0", port=4000)
+    if FIREWALL_CONFIG:
+        threading.Thread(target=firewall_watch_loop, daemon=True).start()
+    if not PROXIES.static:
+        threading.Thread(target=PROXIES.refresh_loop, daemon=True).start()
+    app.run(host="0.0.0.0", port=GATEKEEPER_PORT, threaded=True)
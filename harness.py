@@ -0,0 +1,176 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+import requests
+
+from mysql_standin import start_standins
+
+# Runs the whole benchmark offline: MySQL stand-ins in this process, proxy and
+# gatekeeper as local subprocesses, then benchmark.py / benchmark_gatekeeper.py
+# pointed at them through PROXY_URL / GATEKEEPER_URL instead of EC2 discovery.
+# Results land in HARNESS_RESULTS_DIR next to a harness.json describing the
+# setup; each run is also appended to the results store (RESULTS_STORE, by
+# default benchmark_runs.jsonl in that directory) for compare.py.
+#
+#   HARNESS_WORKERS=3 STANDIN_WORKER_LATENCY_MS=1,1,20 python harness.py
+
+# =========================
+# CONFIG
+# =========================
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+HARNESS_WORKERS = int(os.getenv("HARNESS_WORKERS", "2"))
+HARNESS_RESULTS_DIR = os.path.abspath(os.getenv("HARNESS_RESULTS_DIR", "results_offline"))
+HARNESS_BENCHMARKS = [b.strip() for b in os.getenv("HARNESS_BENCHMARKS", "proxy,gatekeeper").split(",") if b.strip()]
+HARNESS_STARTUP_TIMEOUT = float(os.getenv("HARNESS_STARTUP_TIMEOUT", "30"))
+HARNESS_PROXY_PORT = int(os.getenv("HARNESS_PROXY_PORT", "15000"))
+HARNESS_GATEKEEPER_PORT = int(os.getenv("HARNESS_GATEKEEPER_PORT", "14000"))
+PROXY_SERVER = os.getenv("PROXY_SERVER", "proxy.py")  # or proxy_async.py
+GATEKEEPER_TOKEN = os.getenv("GATEKEEPER_TOKEN", "estelle")
+
+STANDIN_BASE_PORT = int(os.getenv("STANDIN_BASE_PORT", "0"))
+STANDIN_LATENCY_MS = float(os.getenv("STANDIN_LATENCY_MS", "1"))
+STANDIN_WORKER_LATENCY_MS = [float(v) for v in os.getenv("STANDIN_WORKER_LATENCY_MS", "").split(",") if v.strip()]
+STANDIN_JITTER_MS = float(os.getenv("STANDIN_JITTER_MS", "0"))
+STANDIN_ERROR_RATE = float(os.getenv("STANDIN_ERROR_RATE", "0"))
+STANDIN_DROP_RATE = float(os.getenv("STANDIN_DROP_RATE", "0"))
+STANDIN_CONCURRENCY = int(os.getenv("STANDIN_CONCURRENCY", "0"))
+STANDIN_REPLICA_LAG_MS = [float(v) for v in os.getenv("STANDIN_REPLICA_LAG_MS", "").split(",") if v.strip()]
+
+BENCHMARK_SCRIPTS = {
+    "proxy": "benchmark.py",
+    "gatekeeper": "benchmark_gatekeeper.py",
+    "compare": "compare.py",
+}
+
+# =========================
+# PROCESSES
+# =========================
+def spawn(script, env, log_name):
+    log = open(os.path.join(HARNESS_RESULTS_DIR, log_name), "w")
+    return subprocess.Popen(
+        [sys.executable, os.path.join(REPO_DIR, script)],
+        cwd=REPO_DIR,
+        env={**os.environ, **env},
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+
+
+def wait_ready(name, process, url):
+    # Any HTTP answer means the server is listening
+    deadline = time.time() + HARNESS_STARTUP_TIMEOUT
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{name} exited with {process.returncode}, see its log in {HARNESS_RESULTS_DIR}")
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"{name} not ready after {HARNESS_STARTUP_TIMEOUT}s")
+
+
+def stop(process):
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def run_benchmark(name, env):
+    script = BENCHMARK_SCRIPTS[name]
+    print(f"\n=== {script} ===")
+    started = time.time()
+    completed = subprocess.run(
+        [sys.executable, os.path.join(REPO_DIR, script)],
+        cwd=HARNESS_RESULTS_DIR,
+        env={**os.environ, **env},
+    )
+    return {"script": script, "returncode": completed.returncode, "duration_sec": round(time.time() - started, 2)}
+
+# =========================
+# MAIN
+# =========================
+def main():
+    os.makedirs(HARNESS_RESULTS_DIR, exist_ok=True)
+
+    standins = start_standins(
+        workers=HARNESS_WORKERS,
+        base_port=STANDIN_BASE_PORT,
+        latency_ms=STANDIN_LATENCY_MS,
+        worker_latency_ms=STANDIN_WORKER_LATENCY_MS,
+        jitter_ms=STANDIN_JITTER_MS,
+        error_rate=STANDIN_ERROR_RATE,
+        drop_rate=STANDIN_DROP_RATE,
+        concurrency=STANDIN_CONCURRENCY,
+        replica_lag_ms=STANDIN_REPLICA_LAG_MS,
+    )
+    instances_file = os.path.join(HARNESS_RESULTS_DIR, "mysql_instance_ids.txt")
+    with open(instances_file, "w") as f:
+        f.write("\n".join(s.address for s in standins) + "\n")
+    for s in standins:
+        print(f"Stand-in {s.name} at {s.address} ({s.latency_ms} ms)")
+
+    proxy_url = f"http://127.0.0.1:{HARNESS_PROXY_PORT}"
+    gatekeeper_url = f"http://127.0.0.1:{HARNESS_GATEKEEPER_PORT}"
+    processes = []
+    runs = {}
+    try:
+        proxy = spawn(PROXY_SERVER, {"INSTANCES_FILE": instances_file, "PROXY_PORT": str(HARNESS_PROXY_PORT)}, "proxy.log")
+        processes.append(proxy)
+        wait_ready("proxy", proxy, f"{proxy_url}/stats")
+
+        gatekeeper = spawn("gatekeeper.py", {
+            "PROXY_URLS": proxy_url,
+            "GATEKEEPER_PORT": str(HARNESS_GATEKEEPER_PORT),
+            "GATEKEEPER_TOKEN": GATEKEEPER_TOKEN,
+            "FIREWALL_CONFIG": os.path.join(REPO_DIR, "firewall.json"),
+        }, "gatekeeper.log")
+        processes.append(gatekeeper)
+        wait_ready("gatekeeper", gatekeeper, f"{gatekeeper_url}/query")
+
+        bench_env = {
+            "PROXY_URL": proxy_url,
+            "GATEKEEPER_URL": gatekeeper_url,
+            "GATEKEEPER_TOKEN": GATEKEEPER_TOKEN,
+            "PROXY_STATS_URL": f"{proxy_url}/stats",
+            "PYTHONPATH": REPO_DIR,
+            "BENCH_ENV": os.getenv("BENCH_ENV", "offline"),
+        }
+        for name in HARNESS_BENCHMARKS:
+            runs[name] = run_benchmark(name, bench_env)
+    finally:
+        for process in reversed(processes):
+            stop(process)
+        for s in standins:
+            s.stop()
+
+    # Compare against earlier runs in the store and redraw the charts
+    runs["compare"] = run_benchmark("compare", {"PYTHONPATH": REPO_DIR})
+
+    summary = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "proxy_server": PROXY_SERVER,
+        "standins": [
+            {**s.stats(), "latency_ms": s.latency_ms, "jitter_ms": s.jitter_ms,
+             "error_rate": s.error_rate, "drop_rate": s.drop_rate}
+            for s in standins
+        ],
+        "benchmarks": runs,
+    }
+    with open(os.path.join(HARNESS_RESULTS_DIR, "harness.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    print(f"\nResults written to {HARNESS_RESULTS_DIR}")
+
+    return 1 if any(r["returncode"] for r in runs.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
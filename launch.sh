@@ -18,6 +18,9 @@ sleep 10
 echo "==== Benchmarking the gatekeeper ===="
 python benchmark_gatekeeper.py
 
+echo "==== Comparing with previous runs ===="
+python compare.py
+
 sleep 10
 
 echo "==== Cleaning up ===="
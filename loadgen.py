@@ -0,0 +1,326 @@
+import itertools
+import math
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Load generator shared by benchmark.py and benchmark_gatekeeper.py.
+# Closed loop: N client threads, each with its own keep-alive session, run a
+# warm-up phase and then a measured phase; every request's latency is kept so
+# percentiles are exact rather than derived from total time.
+# Open loop (further down): requests follow a fixed schedule at a target rate.
+
+PERCENTILES = (50, 90, 95, 99, 99.9)
+
+
+def make_session(pool_size=1):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    rank = max(0, math.ceil(p / 100 * len(sorted_values)) - 1)
+    return sorted_values[rank]
+
+
+def summarize(samples, elapsed):
+    """samples: [(start_offset_sec, latency_ms, ok), ...] -> latency/throughput report."""
+    latencies = sorted(s[1] for s in samples)
+    errors = sum(1 for s in samples if not s[2])
+    count = len(samples)
+    summary = {
+        "requests": count,
+        "errors": errors,
+        "elapsed_sec": round(elapsed, 3),
+        "throughput_rps": round(count / elapsed, 2) if elapsed > 0 else None,
+        "latency_ms": {
+            "min": round(latencies[0], 3) if latencies else None,
+            "mean": round(sum(latencies) / count, 3) if count else None,
+            "max": round(latencies[-1], 3) if latencies else None,
+        },
+    }
+    for p in PERCENTILES:
+        value = percentile(latencies, p)
+        summary["latency_ms"][f"p{p:g}"] = round(value, 3) if value is not None else None
+    summary["timeline"] = timeline(samples)
+    return summary
+
+
+def timeline(samples, interval=1.0):
+    # Completed requests and p99 per interval, keyed by when each request finished
+    buckets = {}
+    for start, latency_ms, ok in samples:
+        second = int((start + latency_ms / 1000) // interval)
+        buckets.setdefault(second, []).append((latency_ms, ok))
+    out = []
+    for second in sorted(buckets):
+        entries = buckets[second]
+        latencies = sorted(e[0] for e in entries)
+        out.append({
+            "t": round(second * interval, 3),
+            "rps": round(len(entries) / interval, 2),
+            "errors": sum(1 for e in entries if not e[1]),
+            "p99_ms": round(percentile(latencies, 99), 3),
+        })
+    return out
+
+
+def run_phase(request_fn, ok_fn, clients, requests_total=None, duration=None):
+    # request_fn(session) performs one request; ok_fn(response) says if it succeeded
+    if requests_total is None and duration is None:
+        raise ValueError("run_phase needs requests_total or duration")
+
+    counter = itertools.count()
+    samples = []
+    samples_lock = threading.Lock()
+    phase_start = time.perf_counter()
+    deadline = phase_start + duration if duration is not None else None
+
+    def client():
+        session = make_session()
+        local = []
+        try:
+            while True:
+                if requests_total is not None and next(counter) >= requests_total:
+                    break
+                if deadline is not None and time.perf_counter() >= deadline:
+                    break
+                start = time.perf_counter()
+                try:
+                    ok = ok_fn(request_fn(session))
+                except requests.RequestException:
+                    ok = False
+                local.append((start - phase_start, (time.perf_counter() - start) * 1000, ok))
+        finally:
+            session.close()
+            with samples_lock:
+                samples.extend(local)
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    return samples, time.perf_counter() - phase_start
+
+
+def run_load(name, request_fn, ok_fn, clients, requests_total=None, duration=None,
+             warmup_requests=0, warmup_duration=None):
+    """Warm-up (discarded) then measurement; returns the measured summary."""
+    if warmup_requests or warmup_duration:
+        run_phase(request_fn, ok_fn, clients, warmup_requests or None, warmup_duration)
+
+    samples, elapsed = run_phase(request_fn, ok_fn, clients, requests_total, duration)
+    summary = summarize(samples, elapsed)
+    summary["clients"] = clients
+
+    lat = summary["latency_ms"]
+    print(
+        f"{name}: {summary['requests']} req, {summary['errors']} errors, "
+        f"{summary['throughput_rps']} req/s, p50 {lat['p50']} ms, p99 {lat['p99']} ms, max {lat['max']} ms"
+    )
+    return summary, samples
+
+
+# Closed-loop clients wait for each response before sending the next request,
+# so a stalled server is simply sent less traffic and the stall never shows up
+# in the percentiles (coordinated omission). The open-loop runner issues
+# request i at start + i / rate no matter what, and measures latency from that
+# intended send time, so time spent queued behind a slow request is counted.
+
+class Histogram:
+    """HdrHistogram-style log-linear buckets over microseconds: each power of
+    two is split into 2**sub_bucket_bits linear steps, so any recorded value is
+    within 1 / 2**(sub_bucket_bits - 1) of its bucket bound at every magnitude."""
+
+    def __init__(self, sub_bucket_bits=7):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.sub_bucket_count = 1 << sub_bucket_bits
+        self.counts = {}
+        self.total = 0
+        self.sum_us = 0
+        self.min_us = None
+        self.max_us = 0
+
+    def bucket(self, us):
+        if us < self.sub_bucket_count:
+            return 0, us
+        shift = us.bit_length() - self.sub_bucket_bits
+        return shift, us >> shift
+
+    def record(self, value_ms, count=1):
+        us = max(0, int(value_ms * 1000))
+        key = self.bucket(us)
+        self.counts[key] = self.counts.get(key, 0) + count
+        self.total += count
+        self.sum_us += us * count
+        self.min_us = us if self.min_us is None else min(self.min_us, us)
+        self.max_us = max(self.max_us, us)
+
+    def merge(self, other):
+        for key, n in other.counts.items():
+            self.counts[key] = self.counts.get(key, 0) + n
+        self.total += other.total
+        self.sum_us += other.sum_us
+        if other.min_us is not None:
+            self.min_us = other.min_us if self.min_us is None else min(self.min_us, other.min_us)
+        self.max_us = max(self.max_us, other.max_us)
+
+    def value_at(self, p):
+        # Highest value equivalent to the p-th percentile's bucket, capped at max
+        if not self.total:
+            return None
+        rank = max(1, math.ceil(p / 100 * self.total))
+        seen = 0
+        for shift, sub in sorted(self.counts):
+            seen += self.counts[(shift, sub)]
+            if seen >= rank:
+                upper = ((sub + 1) << shift) - 1
+                return round(min(upper, self.max_us) / 1000, 3)
+        return round(self.max_us / 1000, 3)
+
+    def to_dict(self, percentiles=(50, 75, 90, 99, 99.9, 99.99)):
+        out = {
+            "count": self.total,
+            "min": round(self.min_us / 1000, 3) if self.min_us is not None else None,
+            "mean": round(self.sum_us / self.total / 1000, 3) if self.total else None,
+            "max": round(self.max_us / 1000, 3) if self.total else None,
+        }
+        for p in percentiles:
+            out[f"p{p:g}"] = self.value_at(p)
+        return out
+
+
+def run_open_loop(request_fn, ok_fn, rate, duration, clients):
+    """Send at `rate` req/s for `duration` seconds using up to `clients` requests
+    in flight. Returns corrected and service-time histograms plus raw samples."""
+    interval = 1.0 / rate
+    planned = int(rate * duration)
+    counter = itertools.count()
+    lock = threading.Lock()
+    corrected = Histogram()
+    service = Histogram()
+    samples = []
+    state = {"max_lag_ms": 0.0}
+    phase_start = time.perf_counter()
+
+    def client():
+        session = make_session()
+        local_corrected = Histogram()
+        local_service = Histogram()
+        local = []
+        max_lag = 0.0
+        try:
+            while True:
+                i = next(counter)
+                if i >= planned:
+                    break
+                intended = phase_start + i * interval
+                now = time.perf_counter()
+                if intended > now:
+                    time.sleep(intended - now)
+                sent = time.perf_counter()
+                max_lag = max(max_lag, (sent - intended) * 1000)
+                try:
+                    ok = ok_fn(request_fn(session))
+                except requests.RequestException:
+                    ok = False
+                done = time.perf_counter()
+                latency_ms = (done - intended) * 1000
+                local_corrected.record(latency_ms)
+                local_service.record((done - sent) * 1000)
+                local.append((intended - phase_start, latency_ms, ok))
+        finally:
+            session.close()
+            with lock:
+                corrected.merge(local_corrected)
+                service.merge(local_service)
+                samples.extend(local)
+                state["max_lag_ms"] = max(state["max_lag_ms"], max_lag)
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    return corrected, service, samples, time.perf_counter() - phase_start, state["max_lag_ms"]
+
+
+def run_rate(name, request_fn, ok_fn, rate, duration, clients, warmup_duration=0):
+    if warmup_duration:
+        run_open_loop(request_fn, ok_fn, rate, warmup_duration, clients)
+
+    corrected, service, samples, elapsed, max_lag_ms = run_open_loop(request_fn, ok_fn, rate, duration, clients)
+    errors = sum(1 for s in samples if not s[2])
+    summary = {
+        "target_rps": rate,
+        "achieved_rps": round(len(samples) / elapsed, 2) if elapsed > 0 else None,
+        "requests": len(samples),
+        "errors": errors,
+        "elapsed_sec": round(elapsed, 3),
+        "clients": clients,
+        # Send lag is how far behind schedule requests left the client; it grows
+        # once every client is busy, and that wait is part of latency_ms
+        "max_send_lag_ms": round(max_lag_ms, 3),
+        "latency_ms": corrected.to_dict(),
+        "service_time_ms": service.to_dict(),
+        "timeline": timeline(samples),
+    }
+
+    lat = summary["latency_ms"]
+    print(
+        f"{name} @ {rate} req/s: {summary['achieved_rps']} req/s achieved, {errors} errors, "
+        f"p50 {lat['p50']} ms, p99 {lat['p99']} ms, p99.9 {lat['p99.9']} ms, "
+        f"uncorrected p99 {summary['service_time_ms']['p99']} ms"
+    )
+    return summary
+
+
+def is_saturated(summary, baseline_p99, knee_factor, max_error_rate):
+    p99 = summary["latency_ms"]["p99"]
+    requests_sent = summary["requests"] or 1
+    return (
+        summary["achieved_rps"] < 0.95 * summary["target_rps"]
+        or summary["errors"] / requests_sent > max_error_rate
+        or (baseline_p99 and p99 is not None and p99 > knee_factor * baseline_p99)
+    )
+
+
+def sweep(name, request_fn, ok_fn, rates, duration, clients, warmup_duration=0,
+          knee_factor=3.0, max_error_rate=0.01):
+    """Run each rate in ascending order until the service saturates. The knee is
+    the highest rate whose p99 stays within knee_factor of the lowest rate's p99
+    while keeping up with the schedule and staying under max_error_rate errors."""
+    runs = []
+    knee = None
+    baseline_p99 = None
+    for rate in sorted(rates):
+        summary = run_rate(name, request_fn, ok_fn, rate, duration, clients, warmup_duration)
+        runs.append(summary)
+        if baseline_p99 is None:
+            baseline_p99 = summary["latency_ms"]["p99"]
+        if is_saturated(summary, baseline_p99, knee_factor, max_error_rate):
+            break
+        knee = rate
+
+    print(f"{name}: knee at {knee} req/s" if knee else f"{name}: saturated at the lowest rate")
+    return {
+        "knee_rps": knee,
+        "knee_factor": knee_factor,
+        "max_error_rate": max_error_rate,
+        "baseline_p99_ms": baseline_p99,
+        "runs": runs,
+    }
+
+
+def parse_rates(value):
+    return [float(r) for r in value.split(",") if r.strip()]
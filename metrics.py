@@ -0,0 +1,207 @@
+import itertools
+import threading
+from bisect import bisect_left
+
+# Shared by proxy.py and gatekeeper.py: counters and fixed-bucket latency
+# histograms spread over a few lock-striped shards, rendered as Prometheus text.
+
+LATENCY_BUCKETS_MS = (0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Shard:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}  # key -> [bucket counts..., +Inf count, sum]
+
+    def clear(self):
+        self.counters = {}
+        self.histograms = {}
+
+
+class Metrics:
+    """Each thread sticks to one shard, so concurrent writers rarely share a lock.
+    Keys are (name, labels) where labels is a tuple of (label, value) pairs."""
+
+    def __init__(self, shards=16, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self.shards = [Shard() for _ in range(shards)]
+        self.next_shard = itertools.count()
+        self.local = threading.local()
+        self.gauges = {}  # name -> callable returning {labels: value}
+        self.help = {}
+        # Multi-process mode: returns every process's local_snapshot()
+        self.collect = None
+
+    def _shard(self):
+        shard = getattr(self.local, "shard", None)
+        if shard is None:
+            shard = self.local.shard = self.shards[next(self.next_shard) % len(self.shards)]
+        return shard
+
+    def inc(self, name, labels=(), value=1):
+        shard = self._shard()
+        key = (name, labels)
+        with shard.lock:
+            shard.counters[key] = shard.counters.get(key, 0) + value
+
+    def observe(self, name, value_ms, labels=()):
+        shard = self._shard()
+        key = (name, labels)
+        index = bisect_left(self.buckets, value_ms)
+        with shard.lock:
+            hist = shard.histograms.get(key)
+            if hist is None:
+                hist = shard.histograms[key] = [0] * (len(self.buckets) + 2)
+            hist[index] += 1
+            hist[-1] += value_ms
+
+    def gauge(self, name, fn, help_text=None):
+        self.gauges[name] = fn
+        if help_text:
+            self.help[name] = help_text
+
+    def describe(self, name, help_text):
+        self.help[name] = help_text
+
+    def _locked(self):
+        # All shard locks, always taken in the same order
+        for shard in self.shards:
+            shard.lock.acquire()
+
+    def _unlocked(self):
+        for shard in reversed(self.shards):
+            shard.lock.release()
+
+    def snapshot(self):
+        if self.collect is None:
+            return self.local_snapshot()
+        return merge_snapshots(self.collect())
+
+    def local_snapshot(self):
+        counters = {}
+        histograms = {}
+        self._locked()
+        try:
+            for shard in self.shards:
+                for key, value in shard.counters.items():
+                    counters[key] = counters.get(key, 0) + value
+                for key, hist in shard.histograms.items():
+                    total = histograms.get(key)
+                    if total is None:
+                        histograms[key] = list(hist)
+                    else:
+                        for i, v in enumerate(hist):
+                            total[i] += v
+        finally:
+            self._unlocked()
+        return counters, histograms
+
+    def reset(self):
+        self._locked()
+        try:
+            for shard in self.shards:
+                shard.clear()
+        finally:
+            self._unlocked()
+
+    def quantile(self, hist, q):
+        # Linear interpolation inside the bucket holding the q-th observation
+        count = sum(hist[:-1])
+        if count == 0:
+            return None
+        rank = q * count
+        seen = 0
+        for i, n in enumerate(hist[:-1]):
+            if seen + n >= rank and n:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                if i >= len(self.buckets):
+                    return float(self.buckets[-1])
+                upper = self.buckets[i]
+                return round(lower + (upper - lower) * (rank - seen) / n, 3)
+            seen += n
+        return float(self.buckets[-1])
+
+    def summary(self, name, quantiles=(0.5, 0.9, 0.99)):
+        # {labels: {"count", "avg", "p50", ...}} for one histogram
+        _, histograms = self.snapshot()
+        out = {}
+        for (hname, labels), hist in histograms.items():
+            if hname != name:
+                continue
+            count = sum(hist[:-1])
+            entry = {"count": count, "avg": round(hist[-1] / count, 3) if count else None}
+            for q in quantiles:
+                entry[f"p{q * 100:g}"] = self.quantile(hist, q)
+            out[labels] = entry
+        return out
+
+    def prometheus(self, prefix=""):
+        counters, histograms = self.snapshot()
+        lines = []
+
+        def emit_header(name, kind):
+            if name in self.help:
+                lines.append(f"# HELP {prefix}{name} {self.help[name]}")
+            lines.append(f"# TYPE {prefix}{name} {kind}")
+
+        for name in sorted({n for n, _ in counters}):
+            emit_header(name, "counter")
+            for (n, labels), value in sorted(counters.items()):
+                if n == name:
+                    lines.append(f"{prefix}{name}{format_labels(labels)} {value}")
+
+        for name in sorted({n for n, _ in histograms}):
+            emit_header(name, "histogram")
+            for (n, labels), hist in sorted(histograms.items()):
+                if n != name:
+                    continue
+                cumulative = 0
+                for bound, n_obs in zip(self.buckets, hist):
+                    cumulative += n_obs
+                    lines.append(f"{prefix}{name}_bucket{format_labels(labels + (('le', bound),))} {cumulative}")
+                cumulative += hist[len(self.buckets)]
+                lines.append(f"{prefix}{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {cumulative}")
+                lines.append(f"{prefix}{name}_sum{format_labels(labels)} {round(hist[-1], 3)}")
+                lines.append(f"{prefix}{name}_count{format_labels(labels)} {cumulative}")
+
+        for name, fn in sorted(self.gauges.items()):
+            try:
+                values = fn()
+            except Exception:
+                continue
+            emit_header(name, "gauge")
+            for labels, value in sorted(values.items()):
+                if value is not None:
+                    lines.append(f"{prefix}{name}{format_labels(labels)} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+def merge_snapshots(snapshots):
+    counters = {}
+    histograms = {}
+    for part_counters, part_histograms in snapshots:
+        for key, value in part_counters.items():
+            counters[key] = counters.get(key, 0) + value
+        for key, hist in part_histograms.items():
+            total = histograms.get(key)
+            if total is None:
+                histograms[key] = list(hist)
+            else:
+                for i, v in enumerate(hist):
+                    total[i] += v
+    return counters, histograms
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels:
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
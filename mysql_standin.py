@@ -0,0 +1,522 @@
+import bisect
+import itertools
+import os
+import random
+import re
+import socket
+import socketserver
+import struct
+import threading
+import time
+import uuid
+
+# Minimal MySQL wire-protocol server for benchmarking without a cluster.
+# Speaks just enough of the text protocol for PyMySQL and aiomysql: handshake
+# (any credentials accepted), COM_QUERY, COM_PING, COM_INIT_DB and COM_QUIT.
+# Reads return synthetic rows, writes return an OK packet, and every query can
+# be delayed, failed or dropped to imitate a slow or flaky backend. The delay
+# honours /*+ MAX_EXECUTION_TIME(ms) */ and can be cut short by KILL QUERY.
+# Workers replay the manager's writes replica_lag_ms late, as GTIDs, and answer
+# @@gtid_executed, WAIT_FOR_EXECUTED_GTID_SET() and SHOW REPLICA STATUS
+# accordingly; STOP REPLICA / START REPLICA pause and resume the replay.
+
+STANDIN_HOST = os.getenv("STANDIN_HOST", "127.0.0.1")
+STANDIN_ROWS = int(os.getenv("STANDIN_ROWS", "10"))
+SERVER_VERSION = "8.0.36-standin"
+
+CLIENT_CAPABILITIES = (
+    0x00000001    # LONG_PASSWORD
+    | 0x00000002  # FOUND_ROWS
+    | 0x00000004  # LONG_FLAG
+    | 0x00000008  # CONNECT_WITH_DB
+    | 0x00000200  # PROTOCOL_41
+    | 0x00002000  # TRANSACTIONS
+    | 0x00008000  # SECURE_CONNECTION
+    | 0x00020000  # MULTI_RESULTS
+    | 0x00080000  # PLUGIN_AUTH
+    | 0x00200000  # PLUGIN_AUTH_LENENC_CLIENT_DATA
+)
+SERVER_STATUS_IN_TRANS = 0x0001
+SERVER_STATUS_AUTOCOMMIT = 0x0002
+
+COM_QUIT = 0x01
+COM_INIT_DB = 0x02
+COM_QUERY = 0x03
+COM_PING = 0x0e
+
+TYPE_LONGLONG = 8
+TYPE_VAR_STRING = 253
+CHARSET_BINARY = 63
+CHARSET_UTF8MB4 = 45
+
+RESULT_VERBS = {"select", "show", "with", "describe", "desc", "explain"}
+WRITE_VERBS = {"insert", "update", "delete", "replace"}
+SESSION_VERBS = {"set", "do", "rollback"}  # connection housekeeping, answered without delay
+
+ER_QUERY_INTERRUPTED = 1317
+ER_QUERY_TIMEOUT = 3024
+ER_NO_SUCH_THREAD = 1094
+
+LIMIT = re.compile(r"\blimit\s+(?:\d+\s*,\s*)?(\d+)", re.I)
+FROM = re.compile(r"\bfrom\b", re.I)
+INT_LITERAL = re.compile(r"^-?\d+$")
+STRING_LITERAL = re.compile(r"^'((?:[^'\\]|\\.)*)'$")
+OPTIMIZER_HINT = re.compile(r"/\*\+(.*?)\*/", re.S)
+MAX_EXECUTION_TIME = re.compile(r"max_execution_time\s*\(\s*(\d+)\s*\)", re.I)
+SLEEP = re.compile(r"\bsleep\s*\(\s*(\d+(?:\.\d*)?)\s*\)", re.I)
+KILL = re.compile(r"^kill\s+(?:(query|connection)\s+)?(\d+)$", re.I)
+GTID_EXECUTED = re.compile(r"^select\s+@@(?:global\.)?gtid_executed(?:\s+as\s+(\w+))?$", re.I)
+REPLICA_STATUS = re.compile(r"^show\s+(replica|slave)\s+status$", re.I)
+REPLICATION_CONTROL = re.compile(r"^(start|stop)\s+(?:replica|slave)$", re.I)
+WAIT_FOR_GTIDS = re.compile(
+    r"^select\s+wait_for_executed_gtid_set\s*\(\s*'([^']*)'\s*(?:,\s*([\d.]+(?:e[-+]?\d+)?)\s*)?\)(?:\s+as\s+(\w+))?$", re.I
+)
+
+
+class QueryError(Exception):
+    def __init__(self, code, message, state="HY000"):
+        super().__init__(message)
+        self.code = code
+        self.state = state
+
+
+def lenenc_int(n):
+    if n < 251:
+        return bytes([n])
+    if n < 1 << 16:
+        return b"\xfc" + struct.pack("<H", n)
+    if n < 1 << 24:
+        return b"\xfd" + struct.pack("<I", n)[:3]
+    return b"\xfe" + struct.pack("<Q", n)
+
+
+def lenenc_str(value):
+    if isinstance(value, str):
+        value = value.encode()
+    return lenenc_int(len(value)) + value
+
+
+def column_definition(name, column_type):
+    charset = CHARSET_BINARY if column_type == TYPE_LONGLONG else CHARSET_UTF8MB4
+    return (
+        lenenc_str("def") + lenenc_str("sakila") + lenenc_str("standin") + lenenc_str("standin")
+        + lenenc_str(name) + lenenc_str(name) + lenenc_int(0x0c)
+        + struct.pack("<HIBHB", charset, 255, column_type, 0, 0) + b"\x00\x00"
+    )
+
+
+def literal_result(select_list):
+    # SELECT 1 / SELECT 'x', @@version: echo literals, stringify anything else
+    columns, row = [], []
+    for item in split_select_list(select_list):
+        if INT_LITERAL.match(item):
+            columns.append((item, TYPE_LONGLONG))
+            row.append(int(item))
+            continue
+        match = STRING_LITERAL.match(item)
+        columns.append((match.group(1) if match else item, TYPE_VAR_STRING))
+        row.append(match.group(1) if match else item)
+    return columns, [row]
+
+
+def split_select_list(select_list):
+    items, depth, quote, current = [], 0, None, []
+    for ch in select_list:
+        if quote:
+            quote = None if ch == quote else quote
+        elif ch in "'\"`":
+            quote = ch
+        elif ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        elif ch == "," and depth == 0:
+            items.append("".join(current).strip())
+            current = []
+            continue
+        current.append(ch)
+    items.append("".join(current).strip())
+    return [i for i in items if i]
+
+
+def synthetic_result(sql, rows):
+    match = LIMIT.search(sql)
+    count = min(rows, int(match.group(1))) if match else rows
+    columns = [("id", TYPE_LONGLONG), ("name", TYPE_VAR_STRING), ("last_update", TYPE_VAR_STRING)]
+    stamp = time.strftime("%Y-%m-%d %H:%M:%S")
+    return columns, [[i + 1, f"row-{i + 1}", stamp] for i in range(count)]
+
+
+class StandinServer(socketserver.ThreadingTCPServer):
+    """One fake MySQL backend. latency_ms/jitter_ms delay every query,
+    error_rate answers with a lock-wait error, drop_rate closes the connection
+    mid-query (the client sees error 2013), and concurrency caps how many
+    queries are "executing" at once so the backend can saturate. KILL QUERY
+    interrupts a session's delay with error 1317, KILL CONNECTION also closes
+    it, and a MAX_EXECUTION_TIME hint shorter than the delay ends in 3024.
+    SLEEP(seconds) anywhere in a query adds to its delay, for skewed costs.
+    A server with a `source` is its replica: it has applied the source's
+    writes that committed at least replica_lag_ms ago."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, name, port=0, host=STANDIN_HOST, latency_ms=0.0, jitter_ms=0.0,
+                 error_rate=0.0, drop_rate=0.0, concurrency=0, rows=STANDIN_ROWS,
+                 source=None, replica_lag_ms=0.0):
+        super().__init__((host, port), StandinHandler)
+        self.name = name
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.rows = rows
+        self.slots = threading.BoundedSemaphore(concurrency) if concurrency else None
+        self.connection_ids = itertools.count(1)
+        self.insert_ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.sessions = {}  # connection id -> handler
+        self.source = source
+        self.replica_lag_ms = replica_lag_ms
+        self.server_uuid = str(uuid.uuid4())
+        self.commit_times = []  # one per write, in GTID order (sources only)
+        self.stopped_at = None  # transactions applied when STOP REPLICA ran
+        self.counters = {"connections": 0, "queries": 0, "reads": 0, "writes": 0, "errors": 0, "drops": 0,
+                         "kills": 0, "interrupted": 0, "timeouts": 0}
+        self.thread = None
+
+    @property
+    def address(self):
+        host, port = self.server_address[:2]
+        return f"{host}:{port}"
+
+    def count(self, key):
+        with self.lock:
+            self.counters[key] += 1
+
+    def stats(self):
+        with self.lock:
+            return {"name": self.name, "address": self.address, **self.counters}
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def delay(self, interrupt, limit_ms=None, extra_ms=0.0):
+        delay_ms = self.latency_ms
+        if self.jitter_ms:
+            delay_ms = max(0.0, random.gauss(delay_ms, self.jitter_ms))
+        delay_ms += extra_ms
+        timed_out = limit_ms is not None and limit_ms < delay_ms
+        if timed_out:
+            delay_ms = limit_ms
+        if delay_ms and interrupt.wait(delay_ms / 1000):
+            self.count("interrupted")
+            raise QueryError(ER_QUERY_INTERRUPTED, "Query execution was interrupted", "70100")
+        if timed_out:
+            self.count("timeouts")
+            raise QueryError(ER_QUERY_TIMEOUT, "Query execution was interrupted, maximum statement execution time exceeded")
+
+    def record_commit(self):
+        with self.lock:
+            self.commit_times.append(time.time())
+
+    def executed(self):
+        # Transactions applied here: all of them on a source, the ones old enough on a replica
+        if self.source is None:
+            return len(self.commit_times)
+        if self.stopped_at is not None:
+            return self.stopped_at
+        return bisect.bisect_right(self.source.commit_times, time.time() - self.replica_lag_ms / 1000)
+
+    def control_replication(self, action):
+        if self.source is not None:
+            if action == "stop" and self.stopped_at is None:
+                self.stopped_at = self.executed()
+            elif action == "start":
+                self.stopped_at = None
+        return 0
+
+    def replica_status(self, legacy):
+        # One row on a replica, none on the manager; legacy = SHOW SLAVE STATUS names
+        names = (("Slave_IO_Running", "Slave_SQL_Running", "Seconds_Behind_Master") if legacy
+                 else ("Replica_IO_Running", "Replica_SQL_Running", "Seconds_Behind_Source"))
+        columns = [(n, TYPE_VAR_STRING) for n in names[:2]] + [(names[2], TYPE_LONGLONG)]
+        columns += [("Retrieved_Gtid_Set", TYPE_VAR_STRING), ("Executed_Gtid_Set", TYPE_VAR_STRING)]
+        if self.source is None:
+            return columns, []
+        running = "No" if self.stopped_at is not None else "Yes"
+        applied = self.executed()
+        behind = None
+        if self.stopped_at is None:
+            pending = self.source.commit_times[applied:applied + 1]
+            behind = int(time.time() - pending[0]) if pending else 0
+        retrieved = len(self.source.commit_times)
+        retrieved_set = f"{self.source.server_uuid}:1-{retrieved}" if retrieved else ""
+        return columns, [[running, running, behind, retrieved_set, self.gtid_executed()]]
+
+    def gtid_executed(self):
+        origin = self.source or self
+        count = self.executed()
+        return f"{origin.server_uuid}:1-{count}" if count else ""
+
+    def wait_for_gtids(self, gtid_set, timeout, interrupt):
+        # 0 once every GTID of the source's in gtid_set is applied, 1 on timeout
+        origin = self.source or self
+        needed = 0
+        for member in gtid_set.split(","):
+            source_uuid, *intervals = member.strip().split(":")
+            if source_uuid.lower() == origin.server_uuid:
+                needed = max([needed] + [int(i.split("-")[-1]) for i in intervals])
+        deadline = time.time() + timeout
+        while self.executed() < needed:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return 1
+            # Wake when the next missing commit becomes visible
+            due = origin.commit_times[min(self.executed(), len(origin.commit_times) - 1)] + self.replica_lag_ms / 1000
+            if interrupt.wait(max(0.0005, min(remaining, due - time.time()))):
+                self.count("interrupted")
+                raise QueryError(ER_QUERY_INTERRUPTED, "Query execution was interrupted", "70100")
+        return 0
+
+    def kill(self, sql):
+        match = KILL.match(sql)
+        with self.lock:
+            session = self.sessions.get(int(match.group(2))) if match else None
+        if session is None:
+            raise QueryError(ER_NO_SUCH_THREAD, f"Unknown thread id: {match.group(2) if match else '?'}")
+        self.count("kills")
+        session.interrupt.set()
+        if (match.group(1) or "connection").lower() == "connection":
+            try:
+                session.request.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        return 0
+
+    def execute(self, sql, interrupt=None):
+        """Returns (columns, rows) for result sets or an int of affected rows."""
+        interrupt = interrupt or threading.Event()
+        hints = " ".join(OPTIMIZER_HINT.findall(sql))
+        limit = MAX_EXECUTION_TIME.search(hints)
+        sql = OPTIMIZER_HINT.sub(" ", sql)
+        stripped = sql.strip().rstrip(";").strip()
+        verb = stripped.split(None, 1)[0].lower() if stripped else ""
+        if verb == "kill":
+            return self.kill(stripped)
+        if verb in SESSION_VERBS:
+            return 0
+
+        if self.slots:
+            self.slots.acquire()
+        try:
+            # Like MySQL, MAX_EXECUTION_TIME only applies to SELECT
+            self.delay(interrupt, int(limit.group(1)) if limit and verb == "select" else None,
+                       sum(float(s) for s in SLEEP.findall(stripped)) * 1000)
+        finally:
+            if self.slots:
+                self.slots.release()
+
+        if self.error_rate and random.random() < self.error_rate:
+            raise QueryError(1205, "Lock wait timeout exceeded; try restarting transaction")
+
+        match = REPLICA_STATUS.match(stripped)
+        if match:
+            return self.replica_status(match.group(1).lower() == "slave")
+        match = REPLICATION_CONTROL.match(stripped)
+        if match:
+            return self.control_replication(match.group(1).lower())
+        match = GTID_EXECUTED.match(stripped)
+        if match:
+            return [(match.group(1) or "@@GLOBAL.gtid_executed", TYPE_VAR_STRING)], [[self.gtid_executed()]]
+        match = WAIT_FOR_GTIDS.match(stripped)
+        if match:
+            timed_out = self.wait_for_gtids(match.group(1), float(match.group(2) or 3600), interrupt)
+            return [(match.group(3) or "WAIT_FOR_EXECUTED_GTID_SET", TYPE_LONGLONG)], [[timed_out]]
+
+        if verb in RESULT_VERBS:
+            self.count("reads")
+            if verb == "select" and not FROM.search(stripped):
+                return literal_result(stripped[len("select"):])
+            return synthetic_result(stripped, self.rows)
+        if verb in WRITE_VERBS:
+            self.count("writes")
+            if self.source is None:
+                self.record_commit()
+            return 1
+        return 0
+
+
+class StandinHandler(socketserver.BaseRequestHandler):
+    def setup(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.rfile = self.request.makefile("rb")
+        self.seq = 0
+        self.status = SERVER_STATUS_AUTOCOMMIT
+        self.last_insert_id = 0
+        self.connection_id = None
+        self.interrupt = threading.Event()
+
+    def finish(self):
+        with self.server.lock:
+            self.server.sessions.pop(self.connection_id, None)
+        self.rfile.close()
+
+    def read_packet(self):
+        header = self.rfile.read(4)
+        if len(header) < 4:
+            return None
+        length = header[0] | header[1] << 8 | header[2] << 16
+        self.seq = (header[3] + 1) & 0xff
+        return self.rfile.read(length)
+
+    def packet(self, payload):
+        data = struct.pack("<I", len(payload))[:3] + bytes([self.seq]) + payload
+        self.seq = (self.seq + 1) & 0xff
+        return data
+
+    def send(self, *payloads):
+        self.request.sendall(b"".join(self.packet(p) for p in payloads))
+
+    def ok(self, affected=0, insert_id=0):
+        return b"\x00" + lenenc_int(affected) + lenenc_int(insert_id) + struct.pack("<HH", self.status, 0)
+
+    def eof(self):
+        return b"\xfe" + struct.pack("<HH", 0, self.status)
+
+    def error(self, code, message, state="HY000"):
+        return b"\xff" + struct.pack("<H", code) + b"#" + state.encode() + message.encode()
+
+    def handshake(self):
+        scramble = os.urandom(20)
+        self.connection_id = next(self.server.connection_ids)
+        with self.server.lock:
+            self.server.sessions[self.connection_id] = self
+        payload = (
+            b"\x0a" + SERVER_VERSION.encode() + b"\x00"
+            + struct.pack("<I", self.connection_id)
+            + scramble[:8] + b"\x00"
+            + struct.pack("<HBHH", CLIENT_CAPABILITIES & 0xffff, CHARSET_UTF8MB4, self.status,
+                          CLIENT_CAPABILITIES >> 16)
+            + bytes([21]) + b"\x00" * 10
+            + scramble[8:] + b"\x00"
+            + b"mysql_native_password\x00"
+        )
+        self.seq = 0
+        self.send(payload)
+        if self.read_packet() is None:
+            return False
+        self.send(self.ok())
+        return True
+
+    def result_set(self, columns, rows):
+        payloads = [lenenc_int(len(columns))]
+        payloads += [column_definition(name, column_type) for name, column_type in columns]
+        payloads.append(self.eof())
+        for row in rows:
+            payloads.append(b"".join(
+                b"\xfb" if value is None else lenenc_str(str(value)) for value in row
+            ))
+        payloads.append(self.eof())
+        self.send(*payloads)
+
+    def track_session(self, sql):
+        statement = sql.strip().lower()
+        if statement.startswith(("begin", "start transaction")):
+            self.status |= SERVER_STATUS_IN_TRANS
+        elif statement.startswith(("commit", "rollback")):
+            self.status &= ~SERVER_STATUS_IN_TRANS
+        elif statement.replace(" ", "").startswith("setautocommit="):
+            if statement.rstrip(";").endswith(("1", "on", "true")):
+                self.status |= SERVER_STATUS_AUTOCOMMIT
+            else:
+                self.status &= ~SERVER_STATUS_AUTOCOMMIT
+
+    def query(self, sql):
+        server = self.server
+        server.count("queries")
+        if server.drop_rate and random.random() < server.drop_rate:
+            server.count("drops")
+            return False
+        # A KILL QUERY that arrives between statements has nothing to stop
+        self.interrupt.clear()
+        try:
+            result = server.execute(sql, self.interrupt)
+        except QueryError as e:
+            server.count("errors")
+            self.send(self.error(e.code, str(e), e.state))
+            return True
+        self.track_session(sql)
+        if isinstance(result, tuple):
+            self.result_set(*result)
+        else:
+            insert_id = 0
+            if result and sql.lstrip()[:6].lower() in ("insert", "replac"):
+                insert_id = self.last_insert_id = next(server.insert_ids)
+            self.send(self.ok(result, insert_id))
+        return True
+
+    def handle(self):
+        self.server.count("connections")
+        try:
+            if not self.handshake():
+                return
+            while True:
+                payload = self.read_packet()
+                if not payload:
+                    return
+                command, body = payload[0], payload[1:]
+                if command == COM_QUIT:
+                    return
+                if command == COM_QUERY:
+                    if not self.query(body.decode("utf-8", "replace")):
+                        return
+                elif command in (COM_PING, COM_INIT_DB):
+                    self.send(self.ok())
+                else:
+                    self.send(self.error(1047, "Unknown command", "08S01"))
+        except (ConnectionError, OSError):
+            pass
+
+
+def start_standins(workers=2, base_port=0, latency_ms=0.0, worker_latency_ms=(), replica_lag_ms=(), **options):
+    """Manager plus `workers` stand-ins on consecutive ports (or ephemeral ports
+    when base_port is 0). worker_latency_ms overrides latency per worker and
+    replica_lag_ms sets how far each worker trails the manager."""
+    manager = StandinServer("manager", base_port, latency_ms=latency_ms, **options)
+    servers = [manager]
+    for i in range(workers):
+        latency = worker_latency_ms[i] if i < len(worker_latency_ms) else latency_ms
+        lag = replica_lag_ms[i] if i < len(replica_lag_ms) else 0.0
+        port = base_port + i + 1 if base_port else 0
+        servers.append(StandinServer(f"worker-{i + 1}", port, latency_ms=latency, source=manager,
+                                     replica_lag_ms=lag, **options))
+    return [s.start() for s in servers]
+
+
+if __name__ == "__main__":
+    servers = start_standins(
+        workers=int(os.getenv("STANDIN_WORKERS", "2")),
+        base_port=int(os.getenv("STANDIN_BASE_PORT", "13306")),
+        latency_ms=float(os.getenv("STANDIN_LATENCY_MS", "1")),
+        worker_latency_ms=[float(v) for v in os.getenv("STANDIN_WORKER_LATENCY_MS", "").split(",") if v.strip()],
+        jitter_ms=float(os.getenv("STANDIN_JITTER_MS", "0")),
+        error_rate=float(os.getenv("STANDIN_ERROR_RATE", "0")),
+        drop_rate=float(os.getenv("STANDIN_DROP_RATE", "0")),
+        concurrency=int(os.getenv("STANDIN_CONCURRENCY", "0")),
+        replica_lag_ms=[float(v) for v in os.getenv("STANDIN_REPLICA_LAG_MS", "").split(",") if v.strip()],
+    )
+    for server in servers:
+        print(server.name, server.address)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        for server in servers:
+            server.stop()
@@ -0,0 +1,255 @@
+import math
+import multiprocessing
+import os
+import pickle
+import signal
+import socket
+import threading
+import time
+import zlib
+
+# Used by proxy.py when PROXY_PROCESSES > 1: the master binds the port once,
+# forks N workers that all accept on it, and respawns any that die. State the
+# workers must agree on lives in shared memory created before the fork; stats
+# that stay per process are gathered on demand through a StatsExchange.
+
+STATS_SLOT_BYTES = int(os.getenv("STATS_SLOT_BYTES", str(1024 * 1024)))
+STATS_TIMEOUT = float(os.getenv("STATS_TIMEOUT", "1"))
+STATS_POLL_INTERVAL = 0.005
+RESPAWN_BACKOFF = 1.0  # seconds before restarting a worker that died right after start
+
+# fork, not spawn: workers inherit the app, the listening socket and the shared memory
+CTX = multiprocessing.get_context("fork")
+
+
+def cpu_count():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def shared_lock():
+    return CTX.Lock()
+
+
+def shared_array(typecode, size_or_values):
+    return CTX.RawArray(typecode, size_or_values)
+
+
+class SharedValue:
+    """One number in shared memory. Reads are plain loads; use incr() or hold
+    `lock` for read-modify-write."""
+
+    def __init__(self, typecode="q", value=0, lock=None):
+        self.cell = CTX.RawValue(typecode, value)
+        self.lock = lock or shared_lock()
+
+    @property
+    def value(self):
+        return self.cell.value
+
+    @value.setter
+    def value(self, value):
+        self.cell.value = value
+
+    def incr(self, by=1):
+        with self.lock:
+            self.cell.value += by
+            return self.cell.value
+
+
+class SharedField:
+    """Attribute stored in the owner's `cells` shared array of doubles. None
+    is stored as NaN; `choices` maps a small set of strings to their index."""
+
+    def __init__(self, index, kind=float, choices=None):
+        self.index = index
+        self.kind = kind
+        self.choices = choices
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        value = obj.cells[self.index]
+        if math.isnan(value):
+            return None
+        return self.choices[int(value)] if self.choices else self.kind(value)
+
+    def __set__(self, obj, value):
+        if value is None:
+            value = math.nan
+        elif self.choices:
+            value = self.choices.index(value)
+        obj.cells[self.index] = value
+
+
+class SharedGenerations:
+    """Write generations keyed by name, hashed into a fixed array of counters.
+    Two names may share a bucket; a shared bucket only costs a spurious
+    invalidation, never a stale read. Each bucket also keeps the time of its
+    last bump, starting from creation."""
+
+    def __init__(self, buckets=4096):
+        self.counters = CTX.RawArray("Q", buckets)
+        self.global_generation = CTX.RawValue("Q", 0)
+        self.bumped_at = CTX.RawArray("d", [time.time()] * buckets)
+        self.global_bumped_at = CTX.RawValue("d", time.time())
+        self.lock = shared_lock()
+
+    def bucket(self, name):
+        # crc32 rather than hash(): the same in every process, whatever PYTHONHASHSEED
+        return zlib.crc32(name.encode()) % len(self.counters)
+
+    def get(self, name):
+        return self.counters[self.bucket(name)]
+
+    def bump(self, names):
+        now = time.time()
+        with self.lock:
+            if names is None:
+                self.global_generation.value += 1
+                self.global_bumped_at.value = now
+                return
+            for name in names:
+                bucket = self.bucket(name)
+                self.counters[bucket] += 1
+                self.bumped_at[bucket] = now
+
+    def last_bump(self, names):
+        # Time of the last bump covering any of names
+        return max([self.global_bumped_at.value] + [self.bumped_at[self.bucket(name)] for name in names])
+
+    def snapshot(self, names):
+        return self.global_generation.value, {name: self.get(name) for name in names}
+
+    def current(self, snapshot):
+        global_gen, gens = snapshot
+        return global_gen == self.global_generation.value and all(
+            self.get(name) == gen for name, gen in gens.items()
+        )
+
+
+class StatsExchange:
+    """Ask every live worker to run a named command and collect the pickled
+    answers from their shared-memory slots. Each worker answers from its own
+    thread (serve), so the asking worker answers too. Both sides poll rather
+    than share a Condition, which would hang for good once a worker died
+    waiting on it."""
+
+    def __init__(self, slots, slot_bytes=STATS_SLOT_BYTES):
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.busy = shared_lock()  # one collection at a time
+        self.generation = CTX.RawValue("Q", 0)
+        self.command = CTX.RawArray("c", 64)
+        self.alive = CTX.RawArray("b", slots)
+        self.answered = CTX.RawArray("Q", slots)  # generation each slot last answered
+        self.lengths = CTX.RawArray("Q", slots)
+        self.buffers = [CTX.RawArray("c", slot_bytes) for _ in range(slots)]
+
+    def start(self, index, handlers):
+        # A collection already in flight skips this slot (length 0) rather
+        # than reading what the previous process left there
+        self.lengths[index] = 0
+        seen = self.answered[index] = self.generation.value
+        self.alive[index] = 1
+        threading.Thread(target=self.serve, args=(index, handlers, seen), daemon=True).start()
+
+    def mark_dead(self, index):
+        self.alive[index] = 0
+
+    def serve(self, index, handlers, seen):
+        while True:
+            if self.generation.value == seen:
+                time.sleep(STATS_POLL_INTERVAL)
+                continue
+            seen = self.generation.value
+            command = self.command.value.decode()
+            try:
+                payload = pickle.dumps({"ok": handlers[command]()})
+            except Exception as e:
+                payload = pickle.dumps({"error": repr(e)})
+            if len(payload) > self.slot_bytes:
+                payload = pickle.dumps({"error": f"{len(payload)} bytes exceeds STATS_SLOT_BYTES"})
+            self.buffers[index][:len(payload)] = payload
+            self.lengths[index] = len(payload)
+            self.answered[index] = seen
+
+    def collect(self, command, timeout=STATS_TIMEOUT):
+        # -> [(index, answer), ...] for the workers that answered in time.
+        # A collector that died holding `busy` only costs the next one a timeout.
+        locked = self.busy.acquire(timeout=timeout)
+        try:
+            self.command.value = command.encode()
+            self.generation.value += 1
+            generation = self.generation.value
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline and any(
+                self.alive[i] and self.answered[i] != generation for i in range(self.slots)
+            ):
+                time.sleep(STATS_POLL_INTERVAL / 5)
+            raw = [(i, bytes(self.buffers[i][:self.lengths[i]])) for i in range(self.slots)
+                   if self.alive[i] and self.answered[i] == generation and self.lengths[i]]
+        finally:
+            if locked:
+                self.busy.release()
+        out = []
+        for index, payload in raw:
+            answer = pickle.loads(payload)
+            if "error" in answer:
+                print(f"Worker {index} failed {command!r}: {answer['error']}")
+                continue
+            out.append((index, answer["ok"]))
+        return out
+
+
+def run_processes(processes, host, port, run_worker, on_exit=None):
+    """Bind once, fork `processes` workers that each call run_worker(index, sock),
+    and keep the set full until SIGTERM/SIGINT."""
+    sock = socket.create_server((host, port), backlog=1024)
+    # Every worker polls the same socket; the ones that lose the race to
+    # accept() must get EAGAIN, not block
+    sock.setblocking(False)
+    children = {}  # pid -> (index, started_at)
+
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            code = 0
+            try:
+                run_worker(index, sock)
+            except BaseException as e:
+                print(f"Worker {index} exiting: {e!r}")
+                code = 1
+            finally:
+                os._exit(code)
+        children[pid] = (index, time.monotonic())
+
+    def stop(signum, frame):
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    print(f"Master {os.getpid()} serving on {host}:{port} with {processes} processes")
+    for index in range(processes):
+        spawn(index)
+
+    while True:
+        pid, status = os.wait()
+        if pid not in children:
+            continue
+        index, started_at = children.pop(pid)
+        if on_exit is not None:
+            on_exit(index)
+        print(f"Worker {index} (pid {pid}) exited with status {status}, restarting")
+        if time.monotonic() - started_at < RESPAWN_BACKOFF:
+            time.sleep(RESPAWN_BACKOFF)
+        spawn(index)
@@ -1,7 +1,27 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 import pymysql
+import json
+import os
+import random
+import re
+import select
+import socket
 import time
 import threading
+import contextvars
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from werkzeug.serving import make_server
+
+from classifier import ClassifierCache
+from metrics import Metrics, PROMETHEUS_CONTENT_TYPE
+from prefork import (
+    SharedField, SharedGenerations, SharedValue, StatsExchange, cpu_count, run_processes, shared_array, shared_lock,
+)
+from tracing import DEADLINE_HEADER, REQUEST_ID_HEADER, TraceBuffer, annotate, begin_trace, end_trace, span
+from wire import install_json, pack, wants_msgpack
 
 # =========================
 # CONFIG
@@ -11,133 +31,2531 @@ MYSQL_PASSWORD = "estelle"
 MYSQL_DB = "sakila"
 MYSQL_PORT = 3306
 
-INSTANCES_FILE = "/home/ubuntu/mysql_instance_ids.txt"
+# One backend per line, manager first: "host" or "host:port", optionally
+# followed by a read weight ("10.0.0.7:3306 2"). Workers default to 1 and the
+# manager to 0, i.e. it only serves reads when no worker can.
+INSTANCES_FILE = os.getenv("INSTANCES_FILE", "/home/ubuntu/mysql_instance_ids.txt")
+DB_HOSTS_FILE = os.getenv("DB_HOSTS_FILE", "/home/ubuntu/db_hosts.json")  # {"master": ..., "workers": [...]}, as deploy.py writes it
+# Workers can join and leave at runtime (both files are watched, see /members);
+# shared state is allocated up front for at most MAX_BACKENDS, manager included
+MAX_BACKENDS = int(os.getenv("MAX_BACKENDS", "16"))
+MEMBERSHIP_INTERVAL = float(os.getenv("MEMBERSHIP_INTERVAL", "0.5"))
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "30"))  # seconds a removed worker gets to finish its queries
+PROXY_PORT = int(os.getenv("PROXY_PORT", "5000"))
+# Pre-fork worker processes; "auto" starts one per CPU. Each keeps its own pools.
+PROXY_PROCESSES = os.getenv("PROXY_PROCESSES", "1")
+PROXY_PROCESSES = cpu_count() if PROXY_PROCESSES == "auto" else int(PROXY_PROCESSES)
+
+POOL_MIN_SIZE = int(os.getenv("POOL_MIN_SIZE", "2"))
+POOL_MAX_SIZE = int(os.getenv("POOL_MAX_SIZE", "20"))
+POOL_IDLE_TIMEOUT = float(os.getenv("POOL_IDLE_TIMEOUT", "300"))
+POOL_CHECKOUT_TIMEOUT = float(os.getenv("POOL_CHECKOUT_TIMEOUT", "3"))
+POOL_PING_AFTER = float(os.getenv("POOL_PING_AFTER", "5"))
+POOL_REAP_INTERVAL = float(os.getenv("POOL_REAP_INTERVAL", "30"))
+
+# Admission control: the pool's checkout queue doubles as the admission queue
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "true").lower() == "true"
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))  # waiters per backend before 429
+ADMISSION_ADAPTIVE = os.getenv("ADMISSION_ADAPTIVE", "true").lower() == "true"
+ADMISSION_MIN_LIMIT = int(os.getenv("ADMISSION_MIN_LIMIT", "2"))
+ADMISSION_TOLERANCE = float(os.getenv("ADMISSION_TOLERANCE", "2.0"))  # recent/baseline service time that counts as congestion
+ADMISSION_BACKOFF = float(os.getenv("ADMISSION_BACKOFF", "0.9"))
+ADMISSION_WINDOW = float(os.getenv("ADMISSION_WINDOW", "5"))  # seconds; the baseline is the lowest recent service time over two windows
+# Budget for requests that arrive without X-Request-Deadline-Ms; matches the gatekeeper's REQUEST_TIMEOUT
+DEFAULT_DEADLINE_MS = float(os.getenv("DEFAULT_DEADLINE_MS", "5000"))
+# Stop abandoned work on MySQL: MAX_EXECUTION_TIME hints on SELECTs, KILL QUERY
+# once the deadline passes or the client hangs up
+QUERY_TIME_LIMITS = os.getenv("QUERY_TIME_LIMITS", "true").lower() == "true"
+WATCHDOG_INTERVAL = float(os.getenv("WATCHDOG_INTERVAL", "0.05"))
+
+STRATEGY = os.getenv("PROXY_STRATEGY", "roundrobin")  # roundrobin | direct | random | custom | least | p2c
+LATENCY_EWMA_ALPHA = float(os.getenv("LATENCY_EWMA_ALPHA", "0.3"))
+FASTEST_TOLERANCE = float(os.getenv("FASTEST_TOLERANCE", "1.25"))  # custom: workers within this factor of the best score share reads
+
+# Read-your-writes: writes return the manager's GTID set as a session token,
+# reads carrying it wait up to SESSION_WAIT_MS for a replica to apply it
+SESSION_CONSISTENCY = os.getenv("SESSION_CONSISTENCY", "false").lower() == "true"  # token on every write, not only when asked
+SESSION_WAIT_MS = float(os.getenv("SESSION_WAIT_MS", "50"))
+
+# Replication lag: a replica whose threads stopped or that is more than
+# REPLICA_LAG_BUDGET seconds behind leaves read routing until it is back
+# under REPLICA_LAG_RECOVER
+REPLICA_MONITOR = os.getenv("REPLICA_MONITOR", "true").lower() == "true"
+REPLICA_LAG_INTERVAL = float(os.getenv("REPLICA_LAG_INTERVAL", "1"))
+REPLICA_LAG_BUDGET = float(os.getenv("REPLICA_LAG_BUDGET", "5"))
+REPLICA_LAG_RECOVER = float(os.getenv("REPLICA_LAG_RECOVER", "2"))
+REPLICA_GTID_GAP_BUDGET = int(os.getenv("REPLICA_GTID_GAP_BUDGET", "0"))  # transactions; 0 = not checked
+
+HEALTH_CHECK_INTERVAL = float(os.getenv("HEALTH_CHECK_INTERVAL", "1"))
+HEALTH_CHECK_TIMEOUT = float(os.getenv("HEALTH_CHECK_TIMEOUT", "1"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "3"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "10"))
+READ_RETRIES = int(os.getenv("READ_RETRIES", "2"))
+
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "true").lower() == "true"
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+CACHE_TTL = float(os.getenv("CACHE_TTL", "30"))
+
+STREAM_BATCH_ROWS = int(os.getenv("STREAM_BATCH_ROWS", "500"))
+
+BATCH_MAX_STATEMENTS = int(os.getenv("BATCH_MAX_STATEMENTS", "1000"))
+BATCH_PARALLELISM = int(os.getenv("BATCH_PARALLELISM", "8"))
+BATCH_MODES = ("parallel", "transaction", "pipeline")
+
+CLASSIFIER_CACHE_SIZE = int(os.getenv("CLASSIFIER_CACHE_SIZE", "4096"))
 
 app = Flask(__name__)
+install_json(app)
 
 # =========================
 # LOAD INSTANCES
 # =========================
-with open(INSTANCES_FILE) as f:
-    ips = [line.strip() for line in f if line.strip()]
+def parse_instance(line):
+    host, *rest = line.split()
+    weight = float(rest[0].removeprefix("weight=")) if rest else None
+    if weight is not None and weight < 0:
+        raise ValueError(f"Negative weight for {host}")
+    return host, weight
+
+
+def read_instances(path):
+    # -> [(host, weight), ...], manager first, weights defaulted
+    with open(path) as f:
+        instances = [parse_instance(line) for line in f if line.strip()]
+    if not instances:
+        raise ValueError(f"{path} lists no backends")
+    return [(host, (0.0 if i == 0 else 1.0) if weight is None else weight)
+            for i, (host, weight) in enumerate(instances)]
+
 
-MANAGER_IP = ips[0]
-WORKER_IPS = ips[1:]
+instances = read_instances(INSTANCES_FILE)
+MANAGER_IP = instances[0][0]
+WORKER_IPS = [ip for ip, _ in instances[1:]]
 
 print("Manager:", MANAGER_IP)
 print("Workers:", WORKER_IPS)
 
-worker_index = 0
-worker_lock = threading.Lock()
-
 # =========================
 # STATS (proxy only)
 # =========================
-STATS = {
-    "proxy": {
-        "READ": 0,
-        "WRITE": 0
-    },
-    "manager": {
-        "READ": 0,
-        "WRITE": 0
-    },
-    "workers": {
-        ip: {"READ": 0, "WRITE": 0} for ip in WORKER_IPS
+# Sharded counters and latency histograms; /stats keeps its READ/WRITE layout
+METRICS = Metrics()
+
+
+def count_query(qtype):
+    METRICS.inc("queries_total", (("type", qtype),))
+
+
+def stats_snapshot():
+    stats = {
+        "proxy": {"READ": 0, "WRITE": 0},
+        "manager": {"READ": 0, "WRITE": 0},
+        "workers": {ip: {"READ": 0, "WRITE": 0} for ip in WORKER_IPS},
     }
-}
+    counters, _ = METRICS.snapshot()
+    for (name, labels), value in counters.items():
+        labels = dict(labels)
+        if name == "queries_total":
+            stats["proxy"][labels["type"]] += value
+        elif name == "backend_queries_total":
+            if labels["backend"] == MANAGER_IP:
+                stats["manager"][labels["type"]] += value
+            elif labels["backend"] in stats["workers"]:
+                stats["workers"][labels["backend"]][labels["type"]] += value
+    return stats
+
+
+def latency_summary():
+    # {backend: {type: {count, avg, p50, p90, p99}}} in milliseconds
+    out = {}
+    for labels, entry in METRICS.summary("backend_query_latency_ms").items():
+        labels = dict(labels)
+        out.setdefault(labels["backend"], {})[labels["type"]] = entry
+    return out
 
 # =========================
 # HELPERS
 # =========================
 def is_read_query(query: str) -> bool:
-    return query.strip().lower().startswith("select")
+    return classify(query).read
 
-def get_next_worker():
-    global worker_index
-    with worker_lock:
-        ip = WORKER_IPS[worker_index]
-        worker_index = (worker_index + 1) % len(WORKER_IPS)
-    return ip
+def backend_address(ip):
+    host, _, port = ip.partition(":")
+    return host, int(port) if port else MYSQL_PORT
 
 def connect(ip):
+    # autocommit so a pooled read connection never keeps an old snapshot open
+    host, port = backend_address(ip)
     return pymysql.connect(
-        host=ip,
+        host=host,
         user=MYSQL_USER,
         password=MYSQL_PASSWORD,
         database=MYSQL_DB,
-        port=MYSQL_PORT,
+        port=port,
         connect_timeout=3,
+        autocommit=True,
         cursorclass=pymysql.cursors.DictCursor
     )
 
+# =========================
+# CONNECTION POOLS
+# =========================
+class PoolTimeout(Exception):
+    pass
+
+
+class Overloaded(Exception):
+    """Request shed before reaching MySQL: 429 when the backend's queue is
+    full, 503 when it cannot be served within its deadline."""
+
+    def __init__(self, message, status, reason, retry_after=1):
+        super().__init__(message)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+# Absolute deadline (time.time()) of the request being served, None outside one
+DEADLINE = contextvars.ContextVar("deadline", default=None)
+# Socket of the client being served, to notice it hanging up mid-query
+CLIENT = contextvars.ContextVar("client", default=None)
+
+
+def request_context():
+    return {var: var.get() for var in (DEADLINE, CLIENT)}
+
+
+def run_in(context, fn, *args):
+    # Executor threads do not inherit the request's context
+    tokens = [(var, var.set(value)) for var, value in context.items()]
+    try:
+        return fn(*args)
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+class ConnectionPool:
+    """Thread-safe pool of MySQL connections to a single backend.
+
+    Checkouts are also admission control: at most `limit` connections are in
+    use (adapted to the backend's service time, AIMD style, between
+    ADMISSION_MIN_LIMIT and max_size), at most ADMISSION_MAX_QUEUE callers
+    wait, and a caller whose deadline cannot be met is rejected up front
+    instead of holding a thread until it times out."""
+
+    def __init__(self, ip, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE,
+                 idle_timeout=POOL_IDLE_TIMEOUT):
+        self.ip = ip
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.idle = deque()  # (conn, last_used), most recently used on the right
+        self.size = 0        # open connections, idle + checked out
+        self.cond = threading.Condition()
+        self.limit = float(max_size)
+        self.waiting = 0
+        self.checked_out = {}  # id(conn) -> (checkout time, in use at checkout) for admitted checkouts
+        self.service_ewma_ms = None  # recent service time (checkout to checkin)
+        self.baseline_ms = None      # uncongested service time
+        self.window_min_ms = None
+        self.prev_window_min_ms = None
+        self.window_start = time.time()
+        self.last_decrease = 0.0
+        self.retired = False
+        self.counters = self._new_counters()
+
+    @staticmethod
+    def _new_counters():
+        return {
+            "checkouts": 0,
+            "created": 0,
+            "reused": 0,
+            "closed": 0,
+            "session": 0,  # closed because a statement left session state on them
+            "evicted": 0,
+            "dead": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "connect_errors": 0,
+            "shed_queue_full": 0,
+            "shed_deadline": 0,
+        }
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def in_use(self):
+        return self.size - len(self.idle)
+
+    def _admissible(self):
+        return self.in_use() < min(self.max_size, int(self.limit))
+
+    def _estimated_wait_ms(self):
+        # Time for the callers ahead of us to drain at the current limit
+        if self.service_ewma_ms is None:
+            return 0.0
+        return (self.waiting + 1) * self.service_ewma_ms / max(1.0, self.limit)
+
+    def _shed(self, counter, message, status):
+        self.counters[counter] += 1
+        retry_after = max(1, round((self.service_ewma_ms or 1000) * (self.waiting + 1) / max(1.0, self.limit) / 1000))
+        METRICS.inc("admission_shed_total", (("backend", self.ip), ("reason", counter[5:])))
+        raise Overloaded(message, status, counter[5:], retry_after)
+
+    def _admit(self, deadline):
+        # Called with self.cond held, until a slot frees up or the caller is shed
+        if self._admissible():
+            return
+        if self.waiting >= ADMISSION_MAX_QUEUE:
+            self._shed("shed_queue_full", f"{self.ip} has {self.waiting} queued requests", 429)
+        if time.time() + self._estimated_wait_ms() / 1000 > deadline:
+            self._shed("shed_deadline", f"{self.ip} cannot serve the request within its deadline", 503)
+        self.counters["waits"] += 1
+        self.waiting += 1
+        try:
+            while not self._admissible():
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    # Hand on a wake-up this caller may have consumed
+                    self.cond.notify()
+                    self._shed("shed_deadline", f"deadline expired waiting for {self.ip}", 503)
+                self.cond.wait(remaining)
+        finally:
+            self.waiting -= 1
+
+    def _checkin(self, conn):
+        # Called with self.cond held; feeds admitted checkouts into the limit
+        entry = self.checked_out.pop(id(conn), None)
+        if entry is None:
+            return
+        started, in_use = entry
+        ms = (time.time() - started) * 1000
+        prev = self.service_ewma_ms
+        self.service_ewma_ms = recent = ms if prev is None else LATENCY_EWMA_ALPHA * ms + (1 - LATENCY_EWMA_ALPHA) * prev
+        # Backing off regularly brings the backend back to uncongested, so the
+        # lowest recent value of the last two windows is its unloaded service
+        # time; a workload that really got slower replaces it within two windows
+        now = time.time()
+        if now - self.window_start > ADMISSION_WINDOW:
+            self.prev_window_min_ms = self.window_min_ms
+            self.window_min_ms = None
+            self.window_start = now
+        self.window_min_ms = recent if self.window_min_ms is None else min(self.window_min_ms, recent)
+        self.baseline_ms = min(v for v in (self.prev_window_min_ms, self.window_min_ms) if v is not None)
+        if not ADMISSION_ADAPTIVE:
+            return
+        if recent > self.baseline_ms * ADMISSION_TOLERANCE:
+            # Congested: back off, at most once per recent service time
+            if now - self.last_decrease > recent / 1000:
+                self.limit = max(ADMISSION_MIN_LIMIT, self.limit * ADMISSION_BACKOFF)
+                self.last_decrease = now
+        elif in_use >= int(self.limit) - 1:
+            # The limit was what held us back; grow by about one per `limit` completions
+            self.limit = min(float(self.max_size), self.limit + 1 / self.limit)
+
+    def acquire(self, timeout=POOL_CHECKOUT_TIMEOUT, admit=True, sample=True):
+        # admit=False skips admission control (health checks); sample=False keeps
+        # client-paced checkouts (streams) out of the service time
+        deadline = DEADLINE.get() if admit and ADMISSION_CONTROL else None
+        wait_until = time.time() + timeout
+        while True:
+            conn = None
+            last_used = None
+            with self.cond:
+                if deadline is not None:
+                    self._admit(deadline)
+                in_use = self.in_use()
+                while True:
+                    now = time.time()
+                    while self.idle:
+                        conn, last_used = self.idle.pop()
+                        if now - last_used <= self.idle_timeout:
+                            break
+                        self._close(conn)
+                        self.size -= 1
+                        self.counters["evicted"] += 1
+                        conn = None
+                    if conn is not None or self.size < self.max_size:
+                        break
+                    remaining = wait_until - now
+                    if remaining <= 0:
+                        self.counters["timeouts"] += 1
+                        raise PoolTimeout(f"no free connection to {self.ip} after {timeout}s")
+                    self.counters["waits"] += 1
+                    self.cond.wait(remaining)
+                if conn is None:
+                    self.size += 1
+                self.counters["checkouts"] += 1
+            tracked = deadline is not None and sample
+
+            if conn is None:
+                try:
+                    with span("connect"):
+                        conn = connect(self.ip)
+                except Exception:
+                    with self.cond:
+                        self.size -= 1
+                        self.counters["connect_errors"] += 1
+                        self.cond.notify()
+                    raise
+                with self.cond:
+                    self.counters["created"] += 1
+                    if tracked:
+                        self.checked_out[id(conn)] = (time.time(), in_use)
+                return conn
+
+            # Only ping connections that sat idle long enough to have gone stale
+            if time.time() - last_used > POOL_PING_AFTER:
+                try:
+                    conn.ping(reconnect=False)
+                except Exception:
+                    self.discard(conn, "dead")
+                    continue
+            with self.cond:
+                self.counters["reused"] += 1
+                if tracked:
+                    self.checked_out[id(conn)] = (time.time(), in_use)
+            return conn
+
+    def release(self, conn):
+        if self.retired:
+            self.discard(conn)
+            return
+        with self.cond:
+            self._checkin(conn)
+            self.idle.append((conn, time.time()))
+            self.cond.notify()
+
+    def give_back(self, conn, reuse):
+        if reuse:
+            self.release(conn)
+        else:
+            self.discard(conn, "session")
+
+    def discard(self, conn, reason="closed"):
+        self._close(conn)
+        with self.cond:
+            self.checked_out.pop(id(conn), None)
+            self.size -= 1
+            self.counters[reason] += 1
+            self.cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=POOL_CHECKOUT_TIMEOUT, admit=True, reuse=True):
+        # reuse=False closes the connection afterwards: whatever ran on it
+        # left session state the next request must not inherit
+        with span("checkout"):
+            conn = self.acquire(timeout, admit)
+        try:
+            yield conn
+        except (pymysql.err.OperationalError, pymysql.err.InterfaceError):
+            self.discard(conn)
+            raise
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                self.discard(conn)
+            else:
+                self.give_back(conn, reuse)
+            raise
+        except BaseException:
+            # e.g. GeneratorExit: the connection may be mid-result, so drop it
+            self.discard(conn)
+            raise
+        else:
+            self.give_back(conn, reuse)
+
+    def fill(self):
+        # Top the idle set back up to min_size
+        while True:
+            with self.cond:
+                if self.size >= self.min_size:
+                    return
+                self.size += 1
+            try:
+                conn = connect(self.ip)
+            except Exception as e:
+                with self.cond:
+                    self.size -= 1
+                    self.counters["connect_errors"] += 1
+                    self.cond.notify()
+                print(f"Pool {self.ip}: warm-up failed: {e}")
+                return
+            with self.cond:
+                self.counters["created"] += 1
+                self.idle.append((conn, time.time()))
+                self.cond.notify()
+
+    def reap(self):
+        # Close idle connections past idle_timeout, keeping at least min_size open
+        now = time.time()
+        with self.cond:
+            keep = deque()
+            while self.idle:
+                conn, last_used = self.idle.popleft()
+                if now - last_used > self.idle_timeout and self.size > self.min_size:
+                    self._close(conn)
+                    self.size -= 1
+                    self.counters["evicted"] += 1
+                else:
+                    keep.append((conn, last_used))
+            self.idle = keep
+
+    def close_all(self):
+        with self.cond:
+            while self.idle:
+                conn, _ = self.idle.pop()
+                self._close(conn)
+                self.size -= 1
+                self.counters["closed"] += 1
+            self.cond.notify_all()
+
+    def retire(self):
+        # The backend left the membership: close the idle connections now and
+        # the checked-out ones as they come back
+        with self.cond:
+            self.retired = True
+            self.min_size = 0
+        self.close_all()
+
+    def stats(self):
+        with self.cond:
+            return {
+                "size": self.size,
+                "idle": len(self.idle),
+                "in_use": self.size - len(self.idle),
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "limit": round(self.limit, 2),
+                "queued": self.waiting,
+                "service_ms": None if self.service_ewma_ms is None else round(self.service_ewma_ms, 3),
+                "baseline_ms": None if self.baseline_ms is None else round(self.baseline_ms, 3),
+                **self.counters,
+            }
+
+    def reset_stats(self):
+        with self.cond:
+            self.counters = self._new_counters()
+
+
+POOLS = {ip: ConnectionPool(ip) for ip in [MANAGER_IP] + WORKER_IPS}
+
+
+def get_pool(ip):
+    return POOLS[ip]
+
+
+def pool_stats():
+    return {ip: pool.stats() for ip, pool in POOLS.items()}
+
+
+def warm_pools():
+    for pool in POOLS.values():
+        pool.fill()
+
+
+def pool_maintenance_loop():
+    while True:
+        time.sleep(POOL_REAP_INTERVAL)
+        for pool in list(POOLS.values()):
+            pool.reap()
+            pool.fill()
+
+# =========================
+# QUERY DEADLINES
+# =========================
+# Statement stopped by KILL QUERY / MAX_EXECUTION_TIME; the connection is fine
+INTERRUPTED_ERRORS = (1317, 3024)
+SELECT_HEAD = re.compile(r"^(\s*)select\b", re.I)
+
+
+class QueryKilled(Exception):
+    def __init__(self, message, reason):
+        super().__init__(message)
+        self.reason = reason  # deadline | disconnect
+
+
+def is_interrupted(exc):
+    return isinstance(exc, pymysql.err.OperationalError) and bool(exc.args) and exc.args[0] in INTERRUPTED_ERRORS
+
+
+def remaining_ms():
+    deadline = DEADLINE.get()
+    return None if deadline is None else (deadline - time.time()) * 1000
+
+
+def limit_execution(sql):
+    # MySQL itself abandons the SELECT at the deadline, no KILL round trip needed
+    budget = remaining_ms()
+    if not QUERY_TIME_LIMITS or budget is None:
+        return sql
+    if budget <= 0:
+        raise QueryKilled("deadline exceeded before the query was sent", "deadline")
+    if "/*+" in sql:
+        return sql  # only the first hint block after SELECT counts; keep the caller's
+    return SELECT_HEAD.sub(lambda m: f"{m.group(1)}SELECT /*+ MAX_EXECUTION_TIME({int(budget) or 1}) */", sql, count=1)
+
+
+def client_gone(sock):
+    # Readable with nothing to read means the peer closed its end
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b""
+    except (OSError, ValueError):
+        return True
+
+
+class QueryWatchdog:
+    """Kills statements that outlive their request with KILL QUERY, sent on a
+    separate connection per backend, when the deadline passes or the client
+    hangs up. Writes and transactions rely on this; SELECTs usually stop on
+    their MAX_EXECUTION_TIME hint first."""
+
+    def __init__(self, interval=WATCHDOG_INTERVAL):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.running = {}  # id(entry) -> entry
+        self.killers = {}  # ip -> connection used only for KILL
+        self.kill_lock = threading.Lock()
+        self.counters = {"watched": 0, "killed_deadline": 0, "killed_disconnect": 0, "kill_errors": 0}
+
+    @contextmanager
+    def watch(self, ip, conn):
+        deadline, client = DEADLINE.get(), CLIENT.get()
+        if not QUERY_TIME_LIMITS or (deadline is None and client is None):
+            yield None
+            return
+        entry = {"ip": ip, "thread_id": conn.thread_id(), "deadline": deadline, "client": client,
+                 "killed": None, "done": False, "lock": threading.Lock()}
+        with self.lock:
+            self.running[id(entry)] = entry
+            self.counters["watched"] += 1
+        try:
+            yield entry
+        except pymysql.err.OperationalError as e:
+            if entry["killed"] or is_interrupted(e):
+                reason = entry["killed"] or "deadline"
+                raise QueryKilled(f"query killed: {reason}", reason) from e
+            raise
+        finally:
+            # Under the entry lock, so no KILL can be sent once we are done
+            with entry["lock"]:
+                entry["done"] = True
+            with self.lock:
+                self.running.pop(id(entry), None)
+        if entry["killed"]:
+            # The KILL raced with the statement finishing; absorb it here
+            # rather than let it hit whatever runs next on this connection
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute("DO 0")
+            except pymysql.err.OperationalError as e:
+                if not is_interrupted(e):
+                    raise
+
+    def kill(self, entry, reason):
+        with entry["lock"]:
+            if entry["done"] or entry["killed"]:
+                return
+            entry["killed"] = reason
+            if not self.kill_query(entry["ip"], entry["thread_id"], reason):
+                entry["killed"] = None
+
+    def kill_query(self, ip, thread_id, reason):
+        # One retry on a fresh connection in case the cached one went stale
+        with self.kill_lock:
+            for attempt in range(2):
+                conn = self.killers.get(ip)
+                try:
+                    if conn is None:
+                        conn = self.killers[ip] = connect(ip)
+                    with conn.cursor() as cursor:
+                        cursor.execute(f"KILL QUERY {int(thread_id)}")
+                except pymysql.err.OperationalError as e:
+                    if e.args and e.args[0] == 1094:
+                        return False  # unknown thread id: the session is gone
+                    error = e
+                except Exception as e:
+                    error = e
+                else:
+                    break
+                self.killers.pop(ip, None)
+            else:
+                self.count("kill_errors")
+                print(f"KILL QUERY {thread_id} on {ip} failed: {error}")
+                return False
+        self.count(f"killed_{reason}")
+        METRICS.inc("queries_killed_total", (("backend", ip), ("reason", reason)))
+        return True
+
+    def count(self, key):
+        with self.lock:
+            self.counters[key] += 1
+
+    def check(self):
+        now = time.time()
+        with self.lock:
+            entries = list(self.running.values())
+        for entry in entries:
+            if entry["deadline"] is not None and now >= entry["deadline"]:
+                self.kill(entry, "deadline")
+            elif entry["client"] is not None and client_gone(entry["client"]):
+                self.kill(entry, "disconnect")
+
+    def loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.check()
+            except Exception as e:
+                print(f"Query watchdog: {e}")
+
+    def stats(self):
+        with self.lock:
+            return {**self.counters, "running": len(self.running)}
+
+    def reset_stats(self):
+        with self.lock:
+            self.counters = {key: 0 for key in self.counters}
+
+
+WATCHDOG = QueryWatchdog()
+
+# =========================
+# HEALTH CHECKS & CIRCUIT BREAKERS
+# =========================
+class CircuitBreaker:
+    """closed -> open after repeated failures; the health checker drives
+    open -> half_open -> closed once a trial probe succeeds. State lives in
+    shared memory so every worker process sees the same circuit."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    state = SharedField(0, choices=(CLOSED, OPEN, HALF_OPEN))
+    failures = SharedField(1, int)
+    opened_at = SharedField(2)
+    trips = SharedField(3, int)
+
+    def __init__(self, ip, failure_threshold=BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.ip = ip
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.cells = shared_array("d", 4)
+        self.lock = shared_lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.opened_at = 0.0
+            self.trips = 0
+
+    def available(self):
+        return self.state == self.CLOSED
+
+    def begin_trial(self):
+        # Returns False while the breaker is open and still cooling down
+        with self.lock:
+            if self.state == self.OPEN:
+                if time.time() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (
+                self.state == self.CLOSED and self.failures >= self.failure_threshold
+            ):
+                if self.state == self.CLOSED:
+                    print(f"Circuit opened for {self.ip} after {self.failures} failures")
+                self.state = self.OPEN
+                self.opened_at = time.time()
+                self.trips += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "trips": self.trips,
+            }
+
+
+class PingLatency:
+    """Rolling ping latency of one backend, in shared memory."""
+
+    ewma_ms = SharedField(0)
+    last_ms = SharedField(1)
+
+    def __init__(self):
+        self.cells = shared_array("d", 2)
+        self.ewma_ms = None
+        self.last_ms = None
+
+
+# Fed by the health checker
+latency_lock = shared_lock()
+
+
+def member_available(member):
+    return member.state == Backend.ACTIVE and member.breaker.available() and not member.lag.excluded
+
+
+def available_workers():
+    return [ip for ip, member in MEMBERS.items() if ip != MANAGER_IP and member_available(member)]
+
+
+def is_backend_failure(exc):
+    # Connection-level failures only; SQL errors say nothing about backend health
+    if isinstance(exc, (PoolTimeout, pymysql.err.InterfaceError)):
+        return True
+    if isinstance(exc, pymysql.err.OperationalError):
+        return bool(exc.args) and exc.args[0] in (2003, 2006, 2013, 2055)
+    return False
+
+
+def record_latency(ip, ms):
+    entry = LATENCY.get(ip)
+    if entry is None:  # left the membership meanwhile
+        return
+    with latency_lock:
+        prev = entry.ewma_ms
+        entry.ewma_ms = ms if prev is None else LATENCY_EWMA_ALPHA * ms + (1 - LATENCY_EWMA_ALPHA) * prev
+        entry.last_ms = round(ms, 3)
+
+
+def probe_backend(ip):
+    breaker = BREAKERS.get(ip)
+    if breaker is None or not breaker.begin_trial():
+        return None
+    start = time.time()
+    try:
+        with get_pool(ip).connection(timeout=HEALTH_CHECK_TIMEOUT, admit=False) as conn:
+            conn.ping(reconnect=False)
+    except Exception:
+        breaker.record_failure()
+        return None
+    ms = (time.time() - start) * 1000
+    breaker.record_success()
+    record_latency(ip, ms)
+    return ms
+
+
+health_checked = set()  # backends with a health_check_loop in this process
+
+
+def health_check_loop(ip):
+    # One thread per backend so a host stuck in connect_timeout never delays
+    # the others; it ends once the backend leaves the membership
+    try:
+        while ip in BREAKERS:
+            probe_backend(ip)
+            time.sleep(HEALTH_CHECK_INTERVAL)
+    finally:
+        health_checked.discard(ip)
+
+
+def start_health_checks():
+    # Also called as members join
+    for ip in list(BREAKERS):
+        if ip not in health_checked:
+            health_checked.add(ip)
+            threading.Thread(target=health_check_loop, args=(ip,), daemon=True).start()
+
+
+def latency_stats():
+    with latency_lock:
+        return {
+            ip: {"ewma_ms": None if entry.ewma_ms is None else round(entry.ewma_ms, 3), "last_ms": entry.last_ms}
+            for ip, entry in LATENCY.items()
+        }
+
+
+def health_stats():
+    return {ip: breaker.stats() for ip, breaker in BREAKERS.items()}
+
+# =========================
+# REPLICATION LAG
+# =========================
+REPLICA_STATUS_FIELDS = {
+    # 8.0.22+ name -> the name older servers use
+    "Replica_IO_Running": "Slave_IO_Running",
+    "Replica_SQL_Running": "Slave_SQL_Running",
+    "Seconds_Behind_Source": "Seconds_Behind_Master",
+}
+
+
+class ReplicaLag:
+    """Last replication status seen on one replica. Shared memory, like the
+    breakers, so one monitor serves every worker process."""
+
+    io_running = SharedField(0, bool)
+    sql_running = SharedField(1, bool)
+    seconds_behind = SharedField(2)
+    gtid_gap = SharedField(3, int)
+    excluded = SharedField(4, bool)
+    checked_at = SharedField(5)
+    caught_up_at = SharedField(6)  # it had applied everything the manager committed by then
+
+    def __init__(self, ip):
+        self.ip = ip
+        self.cells = shared_array("d", 7)
+        self.reset()
+
+    def reset(self):
+        self.io_running = self.sql_running = self.seconds_behind = None
+        self.gtid_gap = self.checked_at = self.caught_up_at = None
+        self.excluded = False
+
+    def update(self, io_running, sql_running, seconds_behind, gtid_gap, source_at=None):
+        # source_at: when the manager's gtid_executed that gtid_gap was measured against was read
+        self.io_running = io_running
+        self.sql_running = sql_running
+        self.seconds_behind = seconds_behind
+        self.gtid_gap = gtid_gap
+        self.checked_at = time.time()
+        if gtid_gap == 0 and source_at is not None:
+            self.caught_up_at = source_at
+        # Once out, a replica has to get well under the budget to come back
+        budget = REPLICA_LAG_RECOVER if self.excluded else REPLICA_LAG_BUDGET
+        excluded = (
+            not io_running or not sql_running or seconds_behind is None or seconds_behind > budget
+            or bool(REPLICA_GTID_GAP_BUDGET and gtid_gap is not None and gtid_gap > REPLICA_GTID_GAP_BUDGET)
+        )
+        if excluded != self.excluded:
+            print(f"Replica {self.ip} {'excluded from' if excluded else 'back in'} read routing "
+                  f"(io={io_running}, sql={sql_running}, behind={seconds_behind}s, gap={gtid_gap})")
+        self.excluded = excluded
+
+    def stats(self):
+        checked_at = self.checked_at
+        return {
+            "io_running": self.io_running,
+            "sql_running": self.sql_running,
+            "seconds_behind": self.seconds_behind,
+            "gtid_gap": self.gtid_gap,
+            "excluded": self.excluded,
+            "checked_s_ago": None if checked_at is None else round(time.time() - checked_at, 3),
+            "caught_up_s_ago": None if self.caught_up_at is None else round(time.time() - self.caught_up_at, 3),
+        }
+
+
+def replica_status_field(row, name):
+    return row.get(name, row.get(REPLICA_STATUS_FIELDS[name]))
+
+
+def record_replica_status(ip, row, source_gtids, source_at=None):
+    # row is SHOW REPLICA STATUS (None when the server is not a replica);
+    # source_gtids the manager's gtid_executed, None if it could not be read,
+    # and source_at when it was read
+    if row is None:
+        REPLICA_LAG[ip].update(False, False, None, None)
+        return
+    behind = replica_status_field(row, "Seconds_Behind_Source")
+    executed = parse_gtid_set(row.get("Executed_Gtid_Set") or "")
+    REPLICA_LAG[ip].update(
+        replica_status_field(row, "Replica_IO_Running") == "Yes",
+        replica_status_field(row, "Replica_SQL_Running") == "Yes",
+        None if behind is None else float(behind),
+        None if source_gtids is None else gtid_missing(source_gtids, executed),
+        source_at,
+    )
+    if executed:
+        REPLICA_PROGRESS.learn(ip, executed)
+
+
+def fetch_replica_status(cursor):
+    try:
+        cursor.execute("SHOW REPLICA STATUS")
+    except pymysql.err.ProgrammingError:
+        cursor.execute("SHOW SLAVE STATUS")  # before MySQL 8.0.22
+    return cursor.fetchone()
+
+
+def check_replication():
+    # Unreachable backends are skipped here; the breakers deal with those
+    source_gtids = None
+    source_at = time.time()  # no later than the read, so a replica is never credited too much
+    try:
+        with get_pool(MANAGER_IP).connection(timeout=HEALTH_CHECK_TIMEOUT, admit=False) as conn, \
+                conn.cursor() as cursor:
+            cursor.execute(GTID_EXECUTED_SQL)
+            source_gtids = parse_gtid_set(cursor.fetchone()["gtid"] or "")
+    except Exception:
+        pass
+    for ip in WORKER_IPS:
+        try:
+            with get_pool(ip).connection(timeout=HEALTH_CHECK_TIMEOUT, admit=False) as conn, \
+                    conn.cursor() as cursor:
+                row = fetch_replica_status(cursor)
+        except Exception:
+            continue
+        record_replica_status(ip, row, source_gtids, source_at)
+
+
+def replication_monitor_loop():
+    while True:
+        check_replication()
+        time.sleep(REPLICA_LAG_INTERVAL)
+
+
+def replication_stats():
+    return {ip: lag.stats() for ip, lag in REPLICA_LAG.items()}
+
+# =========================
+# MEMBERSHIP
+# =========================
+# Workers join and leave while the proxy runs: through /members, or by
+# editing the instances file or DB_HOSTS_FILE (both are watched). Per-backend
+# shared state sits in MAX_BACKENDS slots allocated before the fork, slot 0
+# being the manager, which does not change without a restart. A new worker
+# is "warming" until every process holds a warm pool for it (and the replica
+# monitor has seen it), then "active". "draining" takes it out of read
+# routing while its queries finish; "removing" then frees its slot.
+class Backend:
+    """One membership slot: which backend holds it, in what state, and that
+    backend's shared health and load state."""
+
+    FREE = "free"
+    WARMING = "warming"
+    ACTIVE = "active"
+    DRAINING = "draining"
+    REMOVING = "removing"
+
+    state = SharedField(0, choices=(FREE, WARMING, ACTIVE, DRAINING, REMOVING))
+    weight = SharedField(1)
+    since = SharedField(2)            # when it entered its state
+    warmed = SharedField(3, int)      # processes whose pool is warm, while warming
+    from_file = SharedField(4, bool)  # listed in a watched file rather than added through /members
+    rr_weight = SharedField(5)        # smooth weighted round-robin
+
+    def __init__(self, slot):
+        self.slot = slot
+        self.cells = shared_array("d", 6)
+        self.address = shared_array("c", 256)
+        self.breaker = CircuitBreaker(None)
+        self.latency = PingLatency()
+        self.lag = ReplicaLag(None)
+        self.outstanding = SharedValue("l", 0)
+        self.clear()
+
+    @property
+    def ip(self):
+        return self.address.value.decode()
+
+    def clear(self):
+        self.state = self.FREE
+        self.address.value = b""
+        self.weight = 0.0
+        self.since = time.time()
+        self.warmed = 0
+        self.from_file = False
+        self.rr_weight = 0.0
+        self.breaker.reset()
+        self.latency.ewma_ms = self.latency.last_ms = None
+        self.lag.reset()
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "weight": self.weight,
+            "outstanding": self.outstanding.value,
+            "from_file": self.from_file,
+            "state_for_s": round(time.time() - self.since, 3),
+        }
+
+
+SLOTS = [Backend(slot) for slot in range(MAX_BACKENDS)]
+members_lock = shared_lock()
+members_generation = SharedValue("Q", 0)  # bumped after every change to SLOTS
+
+
+def find_member(host):
+    return next((m for m in SLOTS if m.state != Backend.FREE and m.ip == host), None)
+
+
+def set_state(member, state):
+    # Caller holds members_lock
+    print(f"Member {member.ip}: {member.state} -> {state}")
+    member.state = state
+    member.since = time.time()
+    members_generation.incr()
+
+
+def validate_host(host):
+    if not isinstance(host, str) or not host or any(c.isspace() for c in host) or len(host) > 255:
+        raise ValueError(f"Invalid host {host!r}")
+    _, _, port = host.partition(":")
+    if port and not port.isdigit():
+        raise ValueError(f"Invalid port in {host!r}")
+
+
+def add_member(host, weight=1.0, from_file=False):
+    # New workers start warming; a draining one goes back to active. For an
+    # existing member (the manager included) only the weight changes.
+    validate_host(host)
+    weight = float(weight)
+    if weight < 0:
+        raise ValueError(f"Negative weight for {host}")
+    with members_lock:
+        member = find_member(host)
+        if member is not None:
+            member.weight = weight
+            if member.state in (Backend.DRAINING, Backend.REMOVING):
+                set_state(member, Backend.ACTIVE)
+            return member
+        # A slot still counting queries of its previous backend is not reused yet
+        member = next((m for m in SLOTS[1:] if m.state == Backend.FREE and m.outstanding.value == 0), None)
+        if member is None:
+            raise ValueError(f"No free backend slot, MAX_BACKENDS is {MAX_BACKENDS}")
+        member.clear()
+        member.address.value = host.encode()
+        member.weight = weight
+        member.from_file = from_file
+        set_state(member, Backend.WARMING)
+        return member
+
+
+def drain_member(host, remove=False):
+    with members_lock:
+        member = find_member(host)
+        if member is None:
+            raise LookupError(f"{host} is not a member")
+        if member is SLOTS[0]:
+            raise ValueError("The manager cannot be drained or removed")
+        state = Backend.REMOVING if remove else Backend.DRAINING
+        if member.state not in (state, Backend.REMOVING):
+            set_state(member, state)
+        return member
+
+
+def members_stats():
+    return {m.ip: m.stats() for m in SLOTS if m.state != Backend.FREE}
+
+
+with members_lock:
+    if len(instances) > MAX_BACKENDS:
+        raise ValueError(f"{INSTANCES_FILE} lists {len(instances)} backends, MAX_BACKENDS is {MAX_BACKENDS}")
+    for member, (ip, weight) in zip(SLOTS, instances):
+        member.address.value = ip.encode()
+        member.weight = weight
+        member.from_file = True
+        member.state = Backend.ACTIVE  # pools are warmed before the proxy serves
+    members_generation.incr()
+
+# This process's view of the table, rebuilt by sync_members: ip -> Backend
+# and the per-backend maps the rest of the proxy reads
+MEMBERS = {}
+BACKENDS = []
+BREAKERS = {}
+LATENCY = {}
+REPLICA_LAG = {}
+OUTSTANDING = {}
+synced_generation = None
+sync_lock = threading.Lock()
+
+
+def sync_members():
+    """Catch this process up with SLOTS. Returns (joined, left) ips. The maps
+    are replaced, never mutated, so readers need no lock."""
+    global MEMBERS, WORKER_IPS, BACKENDS, BREAKERS, LATENCY, REPLICA_LAG, OUTSTANDING, synced_generation
+    with sync_lock:
+        generation = members_generation.value
+        if generation == synced_generation:
+            return [], []
+        members = {m.ip: m for m in SLOTS if m.state != Backend.FREE}
+        for ip, member in members.items():
+            member.breaker.ip = member.lag.ip = ip
+        previous = MEMBERS
+        MEMBERS = members
+        WORKER_IPS = [ip for ip in members if ip != MANAGER_IP]
+        BACKENDS = [MANAGER_IP] + WORKER_IPS
+        BREAKERS = {ip: m.breaker for ip, m in members.items()}
+        LATENCY = {ip: m.latency for ip, m in members.items()}
+        REPLICA_LAG = {ip: members[ip].lag for ip in WORKER_IPS}
+        OUTSTANDING = {ip: m.outstanding for ip, m in members.items()}
+        synced_generation = generation
+    return [ip for ip in members if ip not in previous], [ip for ip in previous if ip not in members]
+
+
+sync_members()
+
+
+def update_pools(joined, left):
+    global POOLS
+    pools = dict(POOLS)
+    for ip in joined:
+        pools.setdefault(ip, ConnectionPool(ip))
+    retired = [pools.pop(ip) for ip in left if ip in pools]
+    POOLS = pools
+    for pool in retired:
+        pool.retire()
+    for ip in left:
+        REPLICA_PROGRESS.forget(ip)
+
+
+warming_started = set()  # (slot, since) of the warm-ups this process began
+
+
+def warm_members(start):
+    # Calls start(member, ip, since) once per process for each warming member
+    for ip, member in MEMBERS.items():
+        key = (member.slot, member.since)
+        if member.state == Backend.WARMING and key not in warming_started:
+            warming_started.add(key)
+            start(member, ip, member.since)
+
+
+def mark_warmed(member, since):
+    with members_lock:
+        if member.state == Backend.WARMING and member.since == since:
+            member.warmed += 1
+
+
+def warm_member(member, ip, since):
+    # Warm once this process's pool holds a connection that answers a ping
+    while member.state == Backend.WARMING and member.since == since:
+        pool = POOLS.get(ip)
+        if pool is not None:
+            pool.fill()
+            try:
+                with pool.connection(timeout=HEALTH_CHECK_TIMEOUT, admit=False) as conn:
+                    conn.ping(reconnect=False)
+            except Exception:
+                pass
+            else:
+                mark_warmed(member, since)
+                return
+        time.sleep(HEALTH_CHECK_INTERVAL)
+
+
+def live_processes():
+    return sum(EXCHANGE.alive) if EXCHANGE is not None else 1
+
+
+def advance_members():
+    # Leader only: warming -> active once every process is warm, removing ->
+    # free once its queries are done (or DRAIN_TIMEOUT ran out)
+    now = time.time()
+    with members_lock:
+        for member in SLOTS[1:]:
+            if member.state == Backend.WARMING:
+                if member.warmed >= live_processes() and (not REPLICA_MONITOR or member.lag.checked_at is not None):
+                    set_state(member, Backend.ACTIVE)
+            elif member.state == Backend.REMOVING:
+                left = member.outstanding.value
+                if left == 0 or now - member.since > DRAIN_TIMEOUT:
+                    if left:
+                        print(f"Member {member.ip}: removed with {left} queries still running")
+                    set_state(member, Backend.FREE)
+
+
+member_file_stamps = {}  # path -> mtime when last read
+
+
+def read_member_files():
+    # -> (manager weight, {worker host: weight}) from the instances file and
+    # DB_HOSTS_FILE; weights only come from the former
+    workers = {}
+    manager_weight = None
+    try:
+        instances = read_instances(INSTANCES_FILE)
+    except OSError:
+        instances = []
+    for i, (host, weight) in enumerate(instances):
+        if i == 0:
+            if host != MANAGER_IP:
+                print(f"{INSTANCES_FILE} names manager {host}, still using {MANAGER_IP} until a restart")
+            manager_weight = weight
+        else:
+            workers[host] = weight
+    try:
+        with open(DB_HOSTS_FILE) as f:
+            db_hosts = json.load(f)
+    except FileNotFoundError:
+        db_hosts = {}
+    if db_hosts.get("master", MANAGER_IP) != MANAGER_IP:
+        print(f"{DB_HOSTS_FILE} names manager {db_hosts['master']}, still using {MANAGER_IP} until a restart")
+    for host in db_hosts.get("workers", ()):
+        workers.setdefault(host, 1.0)
+    return manager_weight, workers
+
+
+def watch_member_files():
+    # Leader only. Members added through /members are left alone.
+    stamps = {}
+    for path in (INSTANCES_FILE, DB_HOSTS_FILE):
+        try:
+            stamps[path] = os.stat(path).st_mtime
+        except OSError:
+            stamps[path] = None
+    if stamps == member_file_stamps:
+        return
+    member_file_stamps.clear()
+    member_file_stamps.update(stamps)
+    try:
+        manager_weight, workers = read_member_files()
+    except (OSError, ValueError) as e:
+        print(f"Member files not applied: {e}")
+        return
+    if manager_weight is not None:
+        SLOTS[0].weight = manager_weight
+    for host, weight in workers.items():
+        member = find_member(host)
+        if member is None or member.from_file and member.state == Backend.REMOVING:
+            add_member(host, weight, from_file=True)
+        elif member.from_file:
+            member.weight = weight
+    for member in SLOTS[1:]:
+        if member.from_file and member.state not in (Backend.FREE, Backend.REMOVING) and member.ip not in workers:
+            drain_member(member.ip, remove=True)
+
+
+def membership_loop(leader):
+    while True:
+        try:
+            if leader:
+                watch_member_files()
+                advance_members()
+            joined, left = sync_members()
+            update_pools(joined, left)
+            if leader and joined:
+                start_health_checks()
+            warm_members(lambda *args: threading.Thread(target=warm_member, args=args, daemon=True).start())
+        except Exception as e:
+            print(f"Membership update failed: {e!r}")
+        time.sleep(MEMBERSHIP_INTERVAL)
+
+# =========================
+# ROUTING STRATEGIES
+# =========================
+# Reads go to the available workers, plus the manager when it was given a
+# read weight. Every strategy but direct honours the weights; least and p2c
+# also look at OUTSTANDING, the queries each backend is running right now
+# (counted across all worker processes), so a backend stuck on slow queries
+# gets fewer new ones.
+rr_lock = shared_lock()
+
+
+@contextmanager
+def outstanding(ip):
+    counter = OUTSTANDING[ip]
+    counter.incr()
+    try:
+        yield
+    finally:
+        counter.incr(-1)
+
+
+def read_candidates():
+    # -> [(ip, weight), ...]
+    members = MEMBERS
+    candidates = [(ip, m.weight) for ip, m in members.items() if ip != MANAGER_IP and member_available(m)]
+    manager = members[MANAGER_IP]
+    if manager.breaker.available():
+        candidates.append((MANAGER_IP, manager.weight))
+    return [(ip, weight) for ip, weight in candidates if weight > 0]
+
+
+def load(ip, weight):
+    return OUTSTANDING[ip].value / weight
+
+
+def pick_weighted(candidates):
+    ips, weights = zip(*candidates)
+    return random.choices(ips, weights)[0]
+
+
+def get_next_worker():
+    # Smooth weighted round-robin (nginx's): with equal weights a plain
+    # rotation, otherwise each backend's share spread out rather than bunched
+    candidates = read_candidates()
+    if not candidates:
+        return MANAGER_IP
+    total = sum(weight for _, weight in candidates)
+    members = [(MEMBERS[ip], weight) for ip, weight in candidates]
+    with rr_lock:
+        for member, weight in members:
+            member.rr_weight += weight
+        best = max(members, key=lambda m: m[0].rr_weight)[0]
+        best.rr_weight -= total
+    return best.ip
+
+
+def pick_direct():
+    return MANAGER_IP
+
+
+def pick_random():
+    candidates = read_candidates()
+    return pick_weighted(candidates) if candidates else MANAGER_IP
+
+
+def pick_least():
+    # Least outstanding requests per unit of weight. Ties (an idle pool above
+    # all) are split by weight, not always won by the first or the heaviest.
+    candidates = read_candidates()
+    if not candidates:
+        return MANAGER_IP
+    loads = [load(ip, weight) for ip, weight in candidates]
+    lowest = min(loads)
+    return pick_weighted([c for c, l in zip(candidates, loads) if l == lowest])
+
+
+def pick_two():
+    # Power of two choices: two distinct weighted samples, the less loaded
+    # wins (the first on a tie). Nearly as good as least under skew, without
+    # every request herding onto the same momentarily idle backend.
+    candidates = read_candidates()
+    if len(candidates) < 2:
+        return candidates[0][0] if candidates else MANAGER_IP
+    ips, weights = zip(*candidates)
+    first = random.choices(range(len(ips)), weights)[0]
+    rest = [i for i in range(len(ips)) if i != first]
+    second = random.choices(rest, [weights[i] for i in rest])[0]
+    return ips[min((first, second), key=lambda i: load(ips[i], weights[i]))]
+
+
+def pick_fastest():
+    # Expected wait = ping EWMA x (outstanding + 1), so a backend that is fast
+    # but busy stops winning; any worker within FASTEST_TOLERANCE of the best
+    # is picked at random, so near-equal pings don't send everything to one.
+    members = MEMBERS
+    with latency_lock:
+        scores = [
+            (m.latency.ewma_ms * (m.outstanding.value + 1), ip) for ip, m in members.items()
+            if ip != MANAGER_IP and member_available(m) and m.latency.ewma_ms is not None
+        ]
+    if not scores:
+        return MANAGER_IP
+    best = min(scores)[0]
+    return random.choice([ip for score, ip in scores if score <= best * FASTEST_TOLERANCE])
+
+
+def routing_stats():
+    return {ip: {"state": m.state, "weight": m.weight, "outstanding": m.outstanding.value}
+            for ip, m in MEMBERS.items()}
+
+
+STRATEGIES = {
+    "roundrobin": get_next_worker,
+    "direct": pick_direct,
+    "random": pick_random,
+    "custom": pick_fastest,
+    "least": pick_least,
+    "p2c": pick_two,
+}
+STRATEGY_NAMES = list(STRATEGIES)
+
+# Index into STRATEGY_NAMES, shared so POST /strategy reaches every worker process
+strategy_index = SharedValue("i", STRATEGY_NAMES.index(STRATEGY) if STRATEGY in STRATEGIES else 0)
+
+
+def current_strategy():
+    return STRATEGY_NAMES[strategy_index.value]
+
+
+def set_strategy(name):
+    if name not in STRATEGIES:
+        raise ValueError(f"Unknown strategy {name!r}, expected one of {sorted(STRATEGIES)}")
+    strategy_index.value = STRATEGY_NAMES.index(name)
+
+
+def choose_target(read):
+    if not read:
+        return MANAGER_IP
+    return STRATEGIES[current_strategy()]()
+
+
+def fallback_target(exclude):
+    candidates = [ip for ip in available_workers() if ip not in exclude]
+    if candidates:
+        return random.choice(candidates)
+    if MANAGER_IP not in exclude:
+        return MANAGER_IP
+    return None
+
+
+def reset_counters():
+    METRICS.reset()
+
+
+def backend_labels(ip, qtype):
+    return (("backend", ip), ("role", "manager" if ip == MANAGER_IP else "worker"), ("type", qtype))
+
+
+def record_target(ip, qtype):
+    METRICS.inc("backend_queries_total", backend_labels(ip, qtype))
+
+
+def execute_on(ip, sql, read, capture_gtid=False, session=False):
+    # session: the statement leaves state on the connection (SqlInfo.session)
+    start = time.time()
+    try:
+        with outstanding(ip), get_pool(ip).connection(reuse=not session) as conn:
+            with WATCHDOG.watch(ip, conn), conn.cursor() as cursor:
+                # Buffered cursors read the whole result set inside execute
+                with span("execute"):
+                    cursor.execute(limit_execution(sql) if read else sql)
+                if read:
+                    with span("fetch"):
+                        return cursor.fetchall()
+                with span("commit"):
+                    conn.commit()
+                result = {"rows_affected": cursor.rowcount}
+                if capture_gtid:
+                    # Read after the commit, so it includes this write
+                    cursor.execute(GTID_EXECUTED_SQL)
+                    result["session_token"] = compact_gtid_set(cursor.fetchone()["gtid"])
+                return result
+    finally:
+        METRICS.observe(
+            "backend_query_latency_ms",
+            (time.time() - start) * 1000,
+            backend_labels(ip, "READ" if read else "WRITE"),
+        )
+
+
+def run_with_failover(target_ip, read, qtype, failed, fn, fallback=None):
+    # Calls fn(ip), moving reads to another backend on connection-level failures.
+    # Returns (ip, result); failed collects the backends that were given up on.
+    fallback = fallback or fallback_target
+    while True:
+        try:
+            return target_ip, fn(target_ip)
+        except Exception as e:
+            if not is_backend_failure(e):
+                raise
+            breaker = BREAKERS.get(target_ip)
+            if breaker is not None:         # member may have been removed mid-query
+                breaker.record_failure()
+            failed.append(target_ip)
+            # Only reads are safe to replay elsewhere
+            next_ip = fallback(failed) if read and len(failed) <= READ_RETRIES else None
+            if next_ip is None:
+                raise
+            target_ip = next_ip
+            record_target(target_ip, qtype)
+
+# =========================
+# SESSION CONSISTENCY
+# =========================
+# A write made with {"consistency": "session"} returns the manager's
+# gtid_executed as "session_token". A read that sends it back runs on the
+# routed replica only once that replica has applied the set, waiting at most
+# SESSION_WAIT_MS with WAIT_FOR_EXECUTED_GTID_SET; otherwise on the manager.
+GTID_EXECUTED_SQL = "SELECT @@GLOBAL.gtid_executed AS gtid"
+GTID_WAIT_SQL = "SELECT WAIT_FOR_EXECUTED_GTID_SET(%s, %s) AS timed_out"
+GTID_INTERVAL = re.compile(r"^(\d+)(?:-(\d+))?$")
+GTID_TAG = re.compile(r"^[a-z_][a-z0-9_]{0,31}$")
+
+
+def compact_gtid_set(text):
+    # MySQL breaks long sets over several lines
+    return "".join((text or "").split())
+
+
+def merge_intervals(intervals):
+    out = []
+    for lo, hi in sorted(intervals):
+        if out and lo <= out[-1][1] + 1:
+            out[-1] = (out[-1][0], max(out[-1][1], hi))
+        else:
+            out.append((lo, hi))
+    return out
+
+
+def parse_gtid_set(text):
+    """'uuid:1-5:7,uuid2:1-3' -> {"uuid": [(1, 5), (7, 7)], "uuid2": [(1, 3)]}.
+    Tagged GTIDs (uuid:tag:1-5) are keyed "uuid:tag". Raises ValueError."""
+    if not isinstance(text, str):
+        raise ValueError("GTID set must be a string")
+    sets = {}
+    for member in compact_gtid_set(text).split(","):
+        if not member:
+            continue
+        source, *parts = member.lower().split(":")
+        if not source or not parts:
+            raise ValueError(f"Malformed GTID set member {member!r}")
+        key, tagged = source, False
+        for part in parts:
+            match = GTID_INTERVAL.match(part)
+            if match is None:
+                # A tag applies to the intervals after it and needs at least one
+                if tagged or not GTID_TAG.match(part):
+                    raise ValueError(f"Malformed GTID interval {part!r}")
+                key, tagged = f"{source}:{part}", True
+                continue
+            lo, hi = int(match.group(1)), int(match.group(2) or match.group(1))
+            if lo < 1 or hi < lo:
+                raise ValueError(f"Malformed GTID interval {part!r}")
+            sets.setdefault(key, []).append((lo, hi))
+            tagged = False
+        if tagged:
+            raise ValueError(f"GTID tag without intervals in {member!r}")
+    return {key: merge_intervals(intervals) for key, intervals in sets.items()}
+
+
+def gtid_subset(a, b):
+    for key, intervals in a.items():
+        have = b.get(key, ())
+        for lo, hi in intervals:
+            if not any(h_lo <= lo and hi <= h_hi for h_lo, h_hi in have):
+                return False
+    return True
+
+
+def gtid_missing(a, b):
+    # How many GTIDs of a are not in b
+    missing = 0
+    for key, intervals in a.items():
+        have = b.get(key, ())
+        for lo, hi in intervals:
+            covered = sum(max(0, min(hi, h_hi) - max(lo, h_lo) + 1) for h_lo, h_hi in have)
+            missing += hi - lo + 1 - covered
+    return missing
+
+
+def gtid_union(a, b):
+    return {key: merge_intervals(a.get(key, []) + b.get(key, [])) for key in a.keys() | b.keys()}
+
+
+class ReplicaProgress:
+    """GTIDs each replica is known to have applied, so a replica that already
+    caught up with a token is not asked to wait for it again."""
+
+    def __init__(self):
+        self.applied = {}  # ip -> parsed GTID set
+        self.lock = threading.Lock()
+
+    def covers(self, ip, gtids):
+        with self.lock:
+            have = self.applied.get(ip)
+        return have is not None and gtid_subset(gtids, have)
+
+    def learn(self, ip, gtids):
+        with self.lock:
+            self.applied[ip] = gtid_union(self.applied.get(ip, {}), gtids)
+
+    def forget(self, ip):
+        with self.lock:
+            self.applied.pop(ip, None)
+
+
+REPLICA_PROGRESS = ReplicaProgress()
+
+
+def session_token(data):
+    # (token, parsed set) from a read request, (None, None) without one
+    token = data.get("session_token")
+    if not token:
+        return None, None
+    return compact_gtid_set(token), parse_gtid_set(token)
+
+
+def session_wait_seconds():
+    # Leave the query itself at least half of whatever budget remains
+    remaining = remaining_ms()
+    wait_ms = SESSION_WAIT_MS if remaining is None else min(SESSION_WAIT_MS, remaining / 2)
+    return max(wait_ms, 1.0) / 1000
+
+
+def wait_for_gtids(ip, token):
+    try:
+        with get_pool(ip).connection() as conn, conn.cursor() as cursor:
+            cursor.execute(GTID_WAIT_SQL, (token, session_wait_seconds()))
+            return cursor.fetchone()["timed_out"] == 0
+    except (Overloaded, PoolTimeout, pymysql.err.MySQLError):
+        return False
+
+
+def settle_session_read(ip, gtids, caught_up):
+    # Shared by both servers once they know whether the replica has the writes
+    if ip == MANAGER_IP:
+        outcome = "manager"
+    elif caught_up is None:
+        outcome = "replica"
+    elif caught_up:
+        REPLICA_PROGRESS.learn(ip, gtids)
+        outcome = "waited"
+    else:
+        ip, outcome = MANAGER_IP, "fallback"
+    METRICS.inc("session_reads_total", (("outcome", outcome),))
+    annotate(session=outcome)
+    return ip
+
+
+def consistent_target(ip, token, gtids):
+    # The routed replica if it has applied the session's writes, else the manager
+    caught_up = None
+    if ip != MANAGER_IP and not REPLICA_PROGRESS.covers(ip, gtids):
+        with span("gtid_wait"):
+            caught_up = wait_for_gtids(ip, token)
+    return settle_session_read(ip, gtids, caught_up)
+
+
+def manager_fallback(exclude):
+    # Another replica may not have the session's writes yet
+    return None if MANAGER_IP in exclude else MANAGER_IP
+
+# =========================
+# STREAMING
+# =========================
+def open_stream(ip, sql):
+    # Executes on an unbuffered cursor; rows are pulled off the socket as they are sent.
+    # Outstanding until stream_rows is done with the connection.
+    pool = get_pool(ip)
+    counter = OUTSTANDING[ip]
+    counter.incr()
+    try:
+        with span("checkout"):
+            conn = pool.acquire(sample=False)
+    except BaseException:
+        counter.incr(-1)
+        raise
+    try:
+        cursor = conn.cursor(pymysql.cursors.SSCursor)
+        with WATCHDOG.watch(ip, conn), span("execute"):
+            cursor.execute(sql)
+    except BaseException as e:
+        counter.incr(-1)
+        if is_backend_failure(e):
+            pool.discard(conn)
+        else:
+            pool.release(conn)
+        raise
+    return pool, conn, cursor, counter
+
+
+def stream_rows(pool, conn, cursor, counter, header, start, reuse=True):
+    # NDJSON: one header line with the column names, row batches, then a trailer
+    dumps = app.json.dumps
+    row_count = 0
+    finished = False
+    try:
+        columns = [d[0] for d in cursor.description or ()]
+        yield dumps({**header, "columns": columns}) + "\n"
+        while True:
+            batch = cursor.fetchmany(STREAM_BATCH_ROWS)
+            if not batch:
+                break
+            row_count += len(batch)
+            yield dumps({"rows": batch}) + "\n"
+        cursor.close()
+        finished = True
+        yield dumps({
+            "done": True,
+            "row_count": row_count,
+            "duration_ms": round((time.time() - start) * 1000, 2)
+        }) + "\n"
+    except Exception as e:
+        yield dumps({"error": str(e), "row_count": row_count}) + "\n"
+    finally:
+        counter.incr(-1)
+        # An unfinished unbuffered result leaves the connection unusable; stop
+        # MySQL producing the rest (the client hung up or the read failed)
+        if finished:
+            pool.give_back(conn, reuse)
+        else:
+            if QUERY_TIME_LIMITS:
+                WATCHDOG.kill_query(pool.ip, conn.thread_id(), "disconnect")
+            pool.discard(conn)
+
+# =========================
+# BATCHES
+# =========================
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_PARALLELISM, thread_name_prefix="batch")
+
+
+def run_statement(index, sql, read, target_ip=None):
+    # One routed statement with failover; errors are reported, not raised
+    qtype = "READ" if read else "WRITE"
+    count_query(qtype)
+    if target_ip is None:
+        target_ip = choose_target(read)
+    record_target(target_ip, qtype)
+    session = classify(sql).session
+    failed = []
+    start = time.time()
+    entry = {"index": index, "type": qtype}
+    try:
+        target_ip, entry["result"] = run_with_failover(
+            target_ip, read, qtype, failed, lambda ip: execute_on(ip, sql, read, session=session)
+        )
+    except Overloaded as e:
+        entry["error"] = str(e)
+        entry["shed"] = e.reason
+    except QueryKilled as e:
+        entry["error"] = str(e)
+        entry["killed"] = e.reason
+    except Exception as e:
+        entry["error"] = str(e)
+    if not read and entry.get("shed") is None:
+        CACHE.invalidate(classify(sql).write_tables)
+    entry["target"] = target_ip
+    entry["failed_backends"] = failed
+    entry["duration_ms"] = round((time.time() - start) * 1000, 2)
+    return entry
+
+
+def run_parallel(statements):
+    # Independent reads fanned out across workers
+    context = request_context()
+    futures = [
+        batch_executor.submit(run_in, context, run_statement, i, sql, True)
+        for i, sql in enumerate(statements)
+    ]
+    return [f.result() for f in futures]
+
+
+def run_pipeline(statements):
+    # In order, stopping at the first failure. Once a write has gone to the
+    # manager, later reads follow it there so they see their own writes.
+    results = []
+    wrote = False
+    for i, sql in enumerate(statements):
+        read = is_read_query(sql)
+        results.append(run_statement(i, sql, read, MANAGER_IP if read and wrote else None))
+        wrote = wrote or not read
+        if "error" in results[-1]:
+            break
+    return results
+
+
+def run_transaction(statements, capture_gtid=False):
+    # Everything on the manager, one connection, one commit
+    results = []
+    token = None
+    for sql in statements:
+        qtype = "READ" if is_read_query(sql) else "WRITE"
+        count_query(qtype)
+        record_target(MANAGER_IP, qtype)
+    reuse = not any(classify(sql).session for sql in statements)
+    try:
+        with outstanding(MANAGER_IP), get_pool(MANAGER_IP).connection(reuse=reuse) as conn, \
+                WATCHDOG.watch(MANAGER_IP, conn):
+            conn.begin()
+            with conn.cursor() as cursor:
+                for i, sql in enumerate(statements):
+                    start = time.time()
+                    read = is_read_query(sql)
+                    try:
+                        with span("execute"):
+                            cursor.execute(sql)
+                    except Exception as e:
+                        results.append({"index": i, "type": "READ" if read else "WRITE",
+                                        "target": MANAGER_IP, "error": str(e)})
+                        raise
+                    with span("fetch"):
+                        result = cursor.fetchall() if read else {"rows_affected": cursor.rowcount}
+                    results.append({
+                        "index": i,
+                        "type": "READ" if read else "WRITE",
+                        "target": MANAGER_IP,
+                        "duration_ms": round((time.time() - start) * 1000, 2),
+                        "result": result,
+                    })
+            start = time.time()
+            with span("commit"):
+                conn.commit()
+            commit_ms = round((time.time() - start) * 1000, 2)
+            if capture_gtid:
+                with conn.cursor() as cursor:
+                    cursor.execute(GTID_EXECUTED_SQL)
+                    token = compact_gtid_set(cursor.fetchone()["gtid"])
+    finally:
+        CACHE.invalidate(batch_write_tables(statements))
+    return results, commit_ms, token
+
+
+def batch_write_tables(statements):
+    tables = set()
+    for sql in statements:
+        written = classify(sql).write_tables
+        if written is None:
+            return None
+        tables |= written
+    return tables
+
+# =========================
+# SQL CLASSIFIER
+# =========================
+# Lexer, fingerprints and classify_statement are in classifier.py, shared
+# with the gatekeeper's firewall
+CLASSIFIER = ClassifierCache(CLASSIFIER_CACHE_SIZE)
+
+
+def classify(sql):
+    return CLASSIFIER.classify(sql)
+
+# =========================
+# RESULT CACHE
+# =========================
+SQL_TOKEN = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`|\s+")
+
+
+def normalize_sql(sql):
+    # Collapse whitespace outside quoted literals and drop a trailing ';'
+    parts = []
+    pos = 0
+    for m in SQL_TOKEN.finditer(sql):
+        parts.append(sql[pos:m.start()])
+        parts.append(" " if m.group().isspace() else m.group())
+        pos = m.end()
+    parts.append(sql[pos:])
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+def estimate_size(value):
+    return len(json.dumps(value, default=str))
+
+
+class ResultCache:
+    """LRU of read results bounded by approximate bytes, with per-entry TTL
+    and per-table invalidation. Write generations are in shared memory: a
+    write through one worker process bumps them, and the other processes drop
+    their copies the next time they look them up."""
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, ttl=CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (result, tables, size, expires_at, generations)
+        self.by_table = {}            # table -> set of keys
+        self.generations = SharedGenerations()  # table -> bumped on every write
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.counters = self._new_counters()
+
+    @staticmethod
+    def _new_counters():
+        return {"hits": 0, "misses": 0, "stores": 0, "evictions": 0,
+                "expirations": 0, "invalidations": 0, "bypasses": 0, "unverified": 0}
+
+    def _remove(self, key):
+        _, tables, size, _, _ = self.entries.pop(key)
+        self.bytes -= size
+        for table in tables:
+            keys = self.by_table.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.by_table[table]
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+            if entry[3] < time.time():
+                self._remove(key)
+                self.counters["expirations"] += 1
+                self.counters["misses"] += 1
+                return None
+            if not self.generations.current(entry[4]):
+                # Written through another process since it was stored
+                self._remove(key)
+                self.counters["invalidations"] += 1
+                self.counters["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.counters["hits"] += 1
+            return entry[0]
+
+    def snapshot(self, tables):
+        # Taken before a read runs; put() refuses the result if a write landed since
+        return self.generations.snapshot(tables)
+
+    def put(self, key, result, tables, snapshot, verified=True):
+        # verified=False: read from a replica not yet known to have the latest writes
+        if not verified:
+            with self.lock:
+                self.counters["unverified"] += 1
+            return
+        size = estimate_size(result)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if not self.generations.current(snapshot):
+                return
+            if key in self.entries:
+                self._remove(key)
+            while self.entries and self.bytes + size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.counters["evictions"] += 1
+            self.entries[key] = (result, tables, size, time.time() + self.ttl, snapshot)
+            self.bytes += size
+            for table in tables:
+                self.by_table.setdefault(table, set()).add(key)
+            self.counters["stores"] += 1
+
+    def invalidate(self, tables):
+        self.generations.bump(tables)
+        with self.lock:
+            if tables is None:
+                dropped = len(self.entries)
+                self.entries.clear()
+                self.by_table.clear()
+                self.bytes = 0
+            else:
+                dropped = 0
+                for table in tables:
+                    for key in list(self.by_table.get(table, ())):
+                        self._remove(key)
+                        dropped += 1
+            self.counters["invalidations"] += dropped
+
+    def bypass(self):
+        with self.lock:
+            self.counters["bypasses"] += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "enabled": CACHE_ENABLED,
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_sec": self.ttl,
+                **self.counters,
+            }
+
+    def reset_stats(self):
+        with self.lock:
+            self.counters = self._new_counters()
+
+
+CACHE = ResultCache()
+
+
+def replica_current(ip, tables):
+    # A replica's result is only cached once the monitor has seen it apply
+    # every write made to `tables` through this proxy; read any earlier, the
+    # stale result would outlive the lag by a whole CACHE_TTL. Without the
+    # monitor nothing vouches for a replica, so only the manager's are cached.
+    if ip == MANAGER_IP:
+        return True
+    lag = REPLICA_LAG.get(ip)
+    caught_up_at = lag.caught_up_at if lag is not None else None
+    return caught_up_at is not None and caught_up_at >= CACHE.generations.last_bump(tables)
+
+# =========================
+# METRICS
+# =========================
+BREAKER_STATE_VALUES = {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}
+
+
+def pool_gauge(field):
+    # Each pre-fork worker has its own pools: sum the field over all of them
+    def values():
+        totals = {}
+        for pools in process_pool_stats():
+            for ip, s in pools.items():
+                labels = (("backend", ip),)
+                totals[labels] = round(totals.get(labels, 0) + s[field], 2)
+        return totals
+    return values
+
+
+METRICS.describe("queries_total", "Queries received by the proxy")
+METRICS.describe("backend_queries_total", "Queries routed to each backend")
+METRICS.describe("backend_query_latency_ms", "Checkout + execute + fetch time per backend")
+METRICS.describe("http_request_latency_ms", "Proxy request handling time")
+METRICS.describe("session_reads_total", "Reads with a session token, by where they could run")
+METRICS.gauge("pool_connections", pool_gauge("size"), "Open MySQL connections per backend")
+METRICS.gauge("pool_idle_connections", pool_gauge("idle"), "Idle pooled connections per backend")
+METRICS.gauge("pool_in_use_connections", pool_gauge("in_use"), "Checked-out connections per backend")
+METRICS.gauge("admission_limit", pool_gauge("limit"), "Adaptive concurrency limit per backend, summed over processes")
+METRICS.gauge("admission_queued", pool_gauge("queued"), "Requests waiting for a connection per backend")
+METRICS.describe("admission_shed_total", "Requests rejected before reaching MySQL, by reason")
+METRICS.gauge(
+    "backend_circuit_state",
+    lambda: {(("backend", ip),): BREAKER_STATE_VALUES[s["state"]] for ip, s in health_stats().items()},
+    "0 closed, 1 half-open, 2 open",
+)
+METRICS.gauge(
+    "backend_ping_ewma_ms",
+    lambda: {(("backend", ip),): s["ewma_ms"] for ip, s in latency_stats().items()},
+    "Rolling ping latency per backend",
+)
+METRICS.gauge(
+    "backend_outstanding_queries",
+    lambda: {(("backend", ip),): s["outstanding"] for ip, s in routing_stats().items()},
+    "Queries running on each backend, across all proxy processes",
+)
+METRICS.gauge(
+    "replica_lag_seconds",
+    lambda: {(("backend", ip),): s["seconds_behind"] for ip, s in replication_stats().items()},
+    "Seconds_Behind_Source per replica (absent while replication is stopped)",
+)
+METRICS.gauge(
+    "replica_gtid_gap",
+    lambda: {(("backend", ip),): s["gtid_gap"] for ip, s in replication_stats().items()},
+    "Transactions executed on the manager but not yet on the replica",
+)
+METRICS.gauge(
+    "replica_excluded",
+    lambda: {(("backend", ip),): int(s["excluded"]) for ip, s in replication_stats().items()},
+    "1 while the replica is left out of read routing for lag",
+)
+METRICS.gauge(
+    "result_cache",
+    lambda: {(("stat", k),): v for k, v in CACHE.stats().items() if not isinstance(v, bool)},
+    "Result cache counters",
+)
+
+
+# Per-request stage timings: the gatekeeper's X-Request-ID is reused so both
+# hops log the same id; sampled traces are kept in TRACES for GET /traces
+TRACES = TraceBuffer()
+
+
+@app.before_request
+def start_timer():
+    g.start = time.time()
+    g.trace = begin_trace(request.headers.get(REQUEST_ID_HEADER), request.path)
+    # Remaining budget in ms, relative so the hops' clocks need not agree
+    try:
+        budget_ms = float(request.headers.get(DEADLINE_HEADER, DEFAULT_DEADLINE_MS))
+    except ValueError:
+        budget_ms = DEFAULT_DEADLINE_MS
+    DEADLINE.set(g.start + budget_ms / 1000)
+    # Only the Werkzeug server exposes the socket; elsewhere only the deadline applies
+    CLIENT.set(request.environ.get("werkzeug.socket"))
+
+
+@app.after_request
+def observe_request(response):
+    start = g.get("start")
+    if start is not None and request.url_rule is not None:
+        METRICS.observe(
+            "http_request_latency_ms",
+            (time.time() - start) * 1000,
+            (("route", request.url_rule.rule), ("type", g.get("qtype", "")), ("status", str(response.status_code))),
+        )
+    trace = g.get("trace")
+    if trace is not None:
+        response.headers["Server-Timing"] = trace.server_timing()
+        response.headers[REQUEST_ID_HEADER] = trace.request_id
+        if request.url_rule is not None and request.url_rule.rule.startswith("/query"):
+            annotate(status=response.status_code, type=g.get("qtype"))
+            TRACES.offer(trace, force=g.get("trace_forced", False))
+    return response
+
+
+@app.teardown_request
+def finish_trace(exc):
+    end_trace()
+    DEADLINE.set(None)
+    CLIENT.set(None)
+
+
+def shed(exc, **extra):
+    annotate(shed=exc.reason)
+    response = jsonify({"error": str(exc), "shed": exc.reason, **extra})
+    response.headers["Retry-After"] = str(exc.retry_after)
+    return response, exc.status
+
+
+def killed(exc, **extra):
+    annotate(killed=exc.reason)
+    return jsonify({"error": str(exc), "killed": exc.reason, **extra}), 504
+
+
+def respond(payload, data, status=200):
+    # "timing": true in the request adds the breakdown so far to the body and
+    # always samples the trace; serialization itself only shows in Server-Timing
+    if data.get("timing"):
+        payload["timing_ms"] = g.trace.breakdown()
+    with span("serialize"):
+        if wants_msgpack(request.headers.get("Accept")):
+            body, headers = pack(payload, request.headers.get("Accept-Encoding"))
+            return Response(body, status, headers)
+        return jsonify(payload), status
+
+# =========================
+# MULTI-PROCESS
+# =========================
+# With PROXY_PROCESSES > 1 the membership, round-robin state, outstanding
+# counts, circuit breakers, ping latency, strategy and cache generations are
+# already shared (see above).
+# Pools, caches and counters stay per process; /stats asks every process for
+# its share through EXCHANGE and adds them up.
+EXCHANGE = StatsExchange(PROXY_PROCESSES) if PROXY_PROCESSES > 1 else None
+
+
+def local_stats():
+    return {"pid": os.getpid(), "pools": pool_stats(), "cache": CACHE.stats(), "classifier": CLASSIFIER.stats(),
+            "traces": TRACES.stats(), "watchdog": WATCHDOG.stats()}
+
+
+def reset_local_stats():
+    reset_counters()
+    CACHE.reset_stats()
+    CLASSIFIER.reset_stats()
+    for pool in POOLS.values():
+        pool.reset_stats()
+    TRACES.clear()
+    WATCHDOG.reset_stats()
+
+
+def sum_stats(parts):
+    # Counts add up across processes; settings and averages come from the first
+    out = {}
+    for part in parts:
+        for key, value in part.items():
+            if key not in out:
+                out[key] = value
+            elif isinstance(value, int) and not isinstance(value, bool):
+                out[key] += value
+    return out
+
+
+def process_stats():
+    if EXCHANGE is None:
+        stats = local_stats()
+        del stats["pid"]
+        return stats
+    per_process = dict(EXCHANGE.collect("stats"))
+    parts = list(per_process.values())
+    stats = {section: sum_stats([p[section] for p in parts]) for section in ("cache", "classifier", "traces", "watchdog")}
+    # Right after a membership change the processes may not list the same pools
+    ips = dict.fromkeys(ip for p in parts for ip in p["pools"])
+    stats["pools"] = {ip: sum_stats([p["pools"][ip] for p in parts if ip in p["pools"]]) for ip in ips}
+    stats["processes"] = per_process
+    return stats
+
+
+def process_pool_stats():
+    # -> [pool_stats() of each process]
+    if EXCHANGE is None:
+        return [pool_stats()]
+    return [pools for _, pools in EXCHANGE.collect("pools")]
+
+
+def reset_all_stats():
+    if EXCHANGE is None:
+        reset_local_stats()
+    else:
+        EXCHANGE.collect("reset")
+
+
+def start_background(health_checks=True):
+    # A respawned worker forked from the master's view of the membership
+    update_pools(*sync_members())
+    warm_pools()
+    threading.Thread(target=pool_maintenance_loop, daemon=True).start()
+    # The process running the health checks also drives membership changes
+    threading.Thread(target=membership_loop, args=(health_checks,), daemon=True).start()
+    if health_checks:
+        start_health_checks()
+        if REPLICA_MONITOR:
+            threading.Thread(target=replication_monitor_loop, daemon=True).start()
+    threading.Thread(target=WATCHDOG.loop, daemon=True).start()
+
+
+def run_worker(index, sock):
+    # One prober is enough now that breakers, ping latency and replica lag are shared
+    METRICS.collect = lambda: [snapshot for _, snapshot in EXCHANGE.collect("metrics")]
+    EXCHANGE.start(index, {"metrics": METRICS.local_snapshot, "stats": local_stats, "pools": pool_stats, "reset": reset_local_stats})
+    start_background(health_checks=index == 0)
+    print(f"Worker {index} (pid {os.getpid()}) ready")
+    make_server("0.0.0.0", PROXY_PORT, app, threaded=True, fd=sock.fileno()).serve_forever()
+
 # =========================
 # ROUTES
 # =========================
 @app.route("/query", methods=["POST"])
 def query():
-    data = request.get_json()
+    with span("parse"):
+        data = request.get_json()
     sql = data.get("query")
+    g.trace_forced = bool(data.get("timing"))
 
     if not sql:
         return jsonify({"error": "Missing query"}), 400
 
-    read = is_read_query(sql)
+    with span("classify"):
+        info = classify(sql)
+    read = info.read
     qtype = "READ" if read else "WRITE"
+    g.qtype = qtype
 
-    STATS["proxy"][qtype] += 1
-
-    target_ip = None
+    count_query(qtype)
 
+    token = gtids = None
     if read:
-        target_ip = get_next_worker()
-        STATS["workers"][target_ip]["READ"] += 1
-    else:
-        target_ip = MANAGER_IP
-        STATS["manager"]["WRITE"] += 1
+        try:
+            token, gtids = session_token(data)
+        except ValueError as e:
+            return jsonify({"error": f"Invalid session_token: {e}"}), 400
+    capture_gtid = not read and (SESSION_CONSISTENCY or data.get("consistency") == "session")
+
+    strategy = current_strategy()
+    if read and data.get("stream"):
+        return stream_query(sql, strategy, token, gtids)
+
+    # A cached result may predate the session's writes
+    use_cache = CACHE_ENABLED and info.cacheable and data.get("cache", True) and token is None
+    if read and not use_cache:
+        CACHE.bypass()
+    if use_cache:
+        start = time.time()
+        with span("cache"):
+            cache_key = normalize_sql(sql)
+            cached = CACHE.get(cache_key)
+        if cached is not None:
+            return respond({
+                "strategy": strategy,
+                "target": "cache",
+                "type": qtype,
+                "cached": True,
+                "duration_ms": round((time.time() - start) * 1000, 3),
+                "result": cached
+            }, data)
+        tables = info.tables
+        snapshot = CACHE.snapshot(tables)
+
+    with span("route"):
+        target_ip = choose_target(read)
+        if token:
+            target_ip = consistent_target(target_ip, token, gtids)
+    record_target(target_ip, qtype)
 
     start = time.time()
+    failed = []
 
     try:
-        conn = connect(target_ip)
-        with conn.cursor() as cursor:
-            cursor.execute(sql)
-            if read:
-                result = cursor.fetchall()
-            else:
-                conn.commit()
-                result = {"rows_affected": cursor.rowcount}
-        conn.close()
+        target_ip, result = run_with_failover(
+            target_ip, read, qtype, failed, lambda ip: execute_on(ip, sql, read, capture_gtid, info.session),
+            manager_fallback if token else None,
+        )
+    except Overloaded as e:
+        return shed(e, failed_backends=failed)
+    except QueryKilled as e:
+        if not read:
+            CACHE.invalidate(info.write_tables)
+        return killed(e, failed_backends=failed)
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        if not is_backend_failure(e):
+            return jsonify({"error": str(e)}), 500
+        if not read:
+            # The write may or may not have landed
+            CACHE.invalidate(info.write_tables)
+        return jsonify({"error": str(e), "failed_backends": failed}), 503
 
     duration = round((time.time() - start) * 1000, 2)
+    if capture_gtid:
+        token = result.pop("session_token")
 
-    return jsonify({
-        "strategy": "proxy-no-boto3",
+    with span("cache"):
+        if use_cache:
+            CACHE.put(cache_key, result, tables, snapshot, replica_current(target_ip, tables))
+        elif not read:
+            CACHE.invalidate(info.write_tables)
+
+    response = {
+        "strategy": strategy,
         "target": target_ip,
         "type": qtype,
+        "cached": False,
+        "failed_backends": failed,
         "duration_ms": duration,
         "result": result
+    }
+    if token:
+        response["session_token"] = token
+    return respond(response, data)
+
+def stream_query(sql, strategy, token=None, gtids=None):
+    CACHE.bypass()
+    target_ip = choose_target(True)
+    if token:
+        target_ip = consistent_target(target_ip, token, gtids)
+    record_target(target_ip, "READ")
+
+    start = time.time()
+    failed = []
+
+    try:
+        target_ip, (pool, conn, cursor, counter) = run_with_failover(
+            target_ip, True, "READ", failed, lambda ip: open_stream(ip, sql),
+            manager_fallback if token else None,
+        )
+    except Overloaded as e:
+        return shed(e, failed_backends=failed)
+    except QueryKilled as e:
+        return killed(e, failed_backends=failed)
+    except Exception as e:
+        status = 503 if is_backend_failure(e) else 500
+        return jsonify({"error": str(e), "failed_backends": failed}), status
+
+    header = {
+        "strategy": strategy,
+        "target": target_ip,
+        "type": "READ",
+        "failed_backends": failed,
+    }
+    reuse = not classify(sql).session
+    return Response(stream_rows(pool, conn, cursor, counter, header, start, reuse), mimetype="application/x-ndjson")
+
+@app.route("/query/batch", methods=["POST"])
+def query_batch():
+    with span("parse"):
+        data = request.get_json(silent=True) or {}
+    statements = data.get("queries")
+    mode = data.get("mode", "pipeline")
+    g.trace_forced = bool(data.get("timing"))
+
+    if not isinstance(statements, list) or not statements or not all(
+        isinstance(s, str) and s.strip() for s in statements
+    ):
+        return jsonify({"error": "queries must be a non-empty list of SQL strings"}), 400
+    if len(statements) > BATCH_MAX_STATEMENTS:
+        return jsonify({"error": f"Batch exceeds {BATCH_MAX_STATEMENTS} statements"}), 400
+    if mode not in BATCH_MODES:
+        return jsonify({"error": f"Unknown mode {mode!r}, expected one of {list(BATCH_MODES)}"}), 400
+
+    start = time.time()
+    response = {"strategy": current_strategy(), "mode": mode}
+
+    if mode == "parallel":
+        writes = [i for i, sql in enumerate(statements) if not is_read_query(sql)]
+        if writes:
+            return jsonify({"error": "parallel mode only accepts reads", "write_indexes": writes}), 400
+        results = run_parallel(statements)
+    elif mode == "pipeline":
+        results = run_pipeline(statements)
+    else:
+        results = []
+        try:
+            results, response["commit_ms"], token = run_transaction(
+                statements, SESSION_CONSISTENCY or data.get("consistency") == "session"
+            )
+            if token:
+                response["session_token"] = token
+        except Overloaded as e:
+            return shed(e, mode=mode)
+        except QueryKilled as e:
+            return killed(e, mode=mode, results=results)
+        except Exception as e:
+            response.update({
+                "error": f"Transaction rolled back: {e}",
+                "results": results,
+                "duration_ms": round((time.time() - start) * 1000, 2),
+            })
+            return jsonify(response), 503 if is_backend_failure(e) else 500
+
+    response.update({
+        "results": results,
+        "errors": sum(1 for r in results if "error" in r),
+        "duration_ms": round((time.time() - start) * 1000, 2),
     })
+    return respond(response, data)
+
+@app.route("/strategy", methods=["GET"])
+def get_strategy():
+    return jsonify({"strategy": current_strategy(), "available": sorted(STRATEGIES), "latency": latency_stats(),
+                    "routing": routing_stats()})
+
+@app.route("/strategy", methods=["POST"])
+def update_strategy():
+    data = request.get_json(silent=True) or {}
+    try:
+        set_strategy(data.get("strategy"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    print("Strategy switched to", current_strategy())
+    return jsonify({"status": "ok", "strategy": current_strategy()})
+
+@app.route("/members", methods=["GET"])
+def get_members():
+    return jsonify({"members": members_stats(), "capacity": MAX_BACKENDS})
+
+@app.route("/members", methods=["POST"])
+def post_member():
+    # {"host": "10.0.0.9[:port]", "weight": 1}: adds a worker (it takes reads
+    # once warm), re-activates a draining one, or changes a weight
+    data = request.get_json(silent=True) or {}
+    try:
+        member = add_member(data.get("host"), data.get("weight", 1.0))
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"host": member.ip, **member.stats()})
+
+@app.route("/members/<host>/drain", methods=["POST"])
+def drain(host):
+    return change_member(host, remove=False)
+
+@app.route("/members/<host>", methods=["DELETE"])
+def remove(host):
+    # Drains first; the slot is freed once its queries are done
+    return change_member(host, remove=True)
+
+def change_member(host, remove):
+    try:
+        member = drain_member(host, remove)
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"host": member.ip, **member.stats()}), 202
 
 @app.route("/stats", methods=["GET"])
 def stats():
-    return jsonify(STATS)
+    return jsonify({**stats_snapshot(), "strategy": current_strategy(), "latency_ms": latency_summary(),
+                    "latency": latency_stats(), "health": health_stats(), "replication": replication_stats(),
+                    "routing": routing_stats(), **process_stats()})
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(METRICS.prometheus("proxy_"), content_type=PROMETHEUS_CONTENT_TYPE)
+
+@app.route("/stats/pools", methods=["GET"])
+def stats_pools():
+    return jsonify(process_stats()["pools"])
 
 @app.route("/stats/reset", methods=["POST"])
 def reset_stats():
-    STATS["proxy"]["READ"] = 0
-    STATS["proxy"]["WRITE"] = 0
-    STATS["manager"]["READ"] = 0
-    STATS["manager"]["WRITE"] = 0
-    for ip in STATS["workers"]:
-        STATS["workers"][ip]["READ"] = 0
-        STATS["workers"][ip]["WRITE"] = 0
+    reset_all_stats()
     return jsonify({"status": "ok"})
 
+@app.route("/traces", methods=["GET"])
+def traces():
+    # ?request_id= finds one request; ?min_ms= only slow ones
+    return jsonify({
+        **TRACES.stats(),
+        "traces": TRACES.recent(
+            limit=request.args.get("limit", 50, type=int),
+            min_ms=request.args.get("min_ms", 0.0, type=float),
+            request_id=request.args.get("request_id"),
+            name=request.args.get("name"),
+        ),
+    })
+
 # =========================
 # START
 # =========================
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000)
+    set_strategy(STRATEGY)
+    if EXCHANGE is not None:
+        run_processes(PROXY_PROCESSES, "0.0.0.0", PROXY_PORT, run_worker, on_exit=EXCHANGE.mark_dead)
+    else:
+        start_background()
+        app.run(host="0.0.0.0", port=PROXY_PORT, threaded=True)
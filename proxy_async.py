@@ -0,0 +1,904 @@
+import asyncio
+import os
+import time
+
+import aiomysql
+from aiohttp import web
+
+import proxy
+from proxy import (
+    MYSQL_USER, MYSQL_PASSWORD, MYSQL_DB, PROXY_PORT,
+    MANAGER_IP, METRICS, PROMETHEUS_CONTENT_TYPE,
+    POOL_MIN_SIZE, POOL_IDLE_TIMEOUT, POOL_CHECKOUT_TIMEOUT,
+    HEALTH_CHECK_INTERVAL, HEALTH_CHECK_TIMEOUT, READ_RETRIES, CACHE_ENABLED, CACHE,
+    STREAM_BATCH_ROWS, BATCH_MAX_STATEMENTS, BATCH_PARALLELISM, BATCH_MODES, batch_write_tables, is_read_query,
+    CLASSIFIER, PoolTimeout, backend_address, count_query, stats_snapshot, latency_summary, backend_labels, classify, choose_target, fallback_target, record_target, normalize_sql,
+    is_backend_failure, record_latency, reset_counters,
+    latency_stats, health_stats, current_strategy, set_strategy, STRATEGIES, TRACES,
+    ADMISSION_CONTROL, DEADLINE, DEFAULT_DEADLINE_MS, Overloaded,
+    QUERY_TIME_LIMITS, WATCHDOG, QueryKilled, is_interrupted, limit_execution, remaining_ms,
+    SESSION_CONSISTENCY, GTID_EXECUTED_SQL, GTID_WAIT_SQL, REPLICA_PROGRESS, compact_gtid_set, manager_fallback,
+    session_token, session_wait_seconds, settle_session_read,
+    REPLICA_MONITOR, REPLICA_LAG_INTERVAL, parse_gtid_set, record_replica_status, replication_stats, replica_current,
+    outstanding, routing_stats,
+    MAX_BACKENDS, MEMBERSHIP_INTERVAL, Backend, add_member, drain_member, members_stats, sync_members,
+    warm_members, mark_warmed, advance_members, watch_member_files,
+)
+from tracing import DEADLINE_HEADER, REQUEST_ID_HEADER, annotate, begin_trace, current_trace, end_trace, span
+from wire import pack, wants_msgpack
+
+# =========================
+# CONFIG
+# =========================
+# Same /query, /query/batch, /stats and routing as proxy.py, served from one event loop.
+# MySQL connections are the real concurrency limit, so the async pools run
+# much larger than the threaded ones. The membership maps (proxy.MEMBERS,
+# proxy.BREAKERS, ...) are replaced as workers join and leave, so they are
+# always read through the module rather than imported.
+ASYNC_POOL_MAX_SIZE = int(os.getenv("ASYNC_POOL_MAX_SIZE", "100"))
+
+POOLS = {}
+
+# Same encoder as the Flask app so datetimes/decimals serialize identically
+dumps = proxy.app.json.dumps
+
+# =========================
+# ASYNC POOLS
+# =========================
+async def create_pool(ip):
+    host, port = backend_address(ip)
+    return await aiomysql.create_pool(
+        host=host,
+        user=MYSQL_USER,
+        password=MYSQL_PASSWORD,
+        db=MYSQL_DB,
+        port=port,
+        connect_timeout=3,
+        autocommit=True,
+        minsize=POOL_MIN_SIZE,
+        maxsize=ASYNC_POOL_MAX_SIZE,
+        pool_recycle=POOL_IDLE_TIMEOUT,
+        cursorclass=aiomysql.DictCursor,
+    )
+
+
+async def get_pool(ip):
+    pool = POOLS.get(ip)
+    if pool is None:
+        if ip not in proxy.MEMBERS:
+            raise PoolTimeout(f"{ip} is no longer a member")
+        pool = POOLS[ip] = await create_pool(ip)
+    return pool
+
+
+async def acquire(ip, timeout=POOL_CHECKOUT_TIMEOUT, admit=True):
+    # aiomysql queues waiters itself; the request's deadline only caps the wait
+    pool = await get_pool(ip)
+    deadline = DEADLINE.get() if admit and ADMISSION_CONTROL else None
+    wait = timeout if deadline is None else min(timeout, deadline - time.time())
+    try:
+        if wait <= 0:
+            raise asyncio.TimeoutError
+        with span("checkout"):
+            return pool, await asyncio.wait_for(pool.acquire(), wait)
+    except asyncio.TimeoutError:
+        if wait < timeout:
+            METRICS.inc("admission_shed_total", (("backend", ip), ("reason", "deadline")))
+            raise Overloaded(f"deadline expired waiting for {ip}", 503, "deadline")
+        raise PoolTimeout(f"no free connection to {ip} after {timeout}s")
+
+
+async def run_limited(ip, conn, coro):
+    # The deadline and the client hanging up (handler cancellation) both end
+    # in KILL QUERY; the connection is mid-result either way, so it is closed
+    budget = remaining_ms()
+    try:
+        if not QUERY_TIME_LIMITS or budget is None:
+            return await coro
+        return await asyncio.wait_for(coro, max(0.0, budget) / 1000)
+    except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+        reason = "deadline" if isinstance(e, asyncio.TimeoutError) else "disconnect"
+        conn.close()
+        if QUERY_TIME_LIMITS:
+            await asyncio.get_running_loop().run_in_executor(None, WATCHDOG.kill_query, ip, conn.thread_id(), reason)
+        if reason == "deadline":
+            raise QueryKilled("query killed: deadline", reason) from e
+        raise
+    except aiomysql.OperationalError as e:
+        if is_interrupted(e):
+            raise QueryKilled("query killed: deadline", "deadline") from e
+        raise
+
+
+async def execute_on(ip, sql, read, capture_gtid=False, session=False):
+    # session: the statement leaves state on the connection, which is then
+    # closed instead of going back to the pool (see classifier.SESSION_STATE_VERBS)
+    start = time.time()
+    try:
+        with outstanding(ip):
+            pool, conn = await acquire(ip)
+            try:
+                async with conn.cursor() as cursor:
+                    with span("execute"):
+                        await run_limited(ip, conn, cursor.execute(limit_execution(sql) if read else sql))
+                    if read:
+                        with span("fetch"):
+                            return await cursor.fetchall()
+                    with span("commit"):
+                        await conn.commit()
+                    result = {"rows_affected": cursor.rowcount}
+                    if capture_gtid:
+                        await cursor.execute(GTID_EXECUTED_SQL)
+                        result["session_token"] = compact_gtid_set((await cursor.fetchone())["gtid"])
+                    return result
+            except Exception as e:
+                if is_backend_failure(e):
+                    conn.close()
+                raise
+            finally:
+                if session:
+                    conn.close()
+                pool.release(conn)
+    finally:
+        METRICS.observe(
+            "backend_query_latency_ms",
+            (time.time() - start) * 1000,
+            backend_labels(ip, "READ" if read else "WRITE"),
+        )
+
+
+async def wait_for_gtids(ip, token):
+    try:
+        pool, conn = await acquire(ip)
+    except (Overloaded, PoolTimeout):
+        return False
+    try:
+        async with conn.cursor() as cursor:
+            await cursor.execute(GTID_WAIT_SQL, (token, session_wait_seconds()))
+            return (await cursor.fetchone())["timed_out"] == 0
+    except aiomysql.MySQLError as e:
+        if is_backend_failure(e):
+            conn.close()
+        return False
+    finally:
+        pool.release(conn)
+
+
+async def consistent_target(ip, token, gtids):
+    caught_up = None
+    if ip != MANAGER_IP and not REPLICA_PROGRESS.covers(ip, gtids):
+        with span("gtid_wait"):
+            caught_up = await wait_for_gtids(ip, token)
+    return settle_session_read(ip, gtids, caught_up)
+
+
+async def open_stream(ip, sql):
+    # Outstanding until stream_query is done with the connection
+    counter = proxy.OUTSTANDING[ip]
+    counter.incr()
+    try:
+        pool, conn = await acquire(ip)
+    except BaseException:
+        counter.incr(-1)
+        raise
+    try:
+        cursor = await conn.cursor(aiomysql.SSCursor)
+        await cursor.execute(sql)
+    except BaseException as e:
+        counter.incr(-1)
+        if is_backend_failure(e):
+            conn.close()
+        pool.release(conn)
+        raise
+    return pool, conn, cursor, counter
+
+
+def pool_stats():
+    return {
+        ip: {
+            "size": pool.size,
+            "idle": pool.freesize,
+            "in_use": pool.size - pool.freesize,
+            "min_size": pool.minsize,
+            "max_size": pool.maxsize,
+        }
+        for ip, pool in POOLS.items()
+    }
+
+for _name, _field in (("pool_connections", "size"), ("pool_idle_connections", "idle"),
+                      ("pool_in_use_connections", "in_use")):
+    METRICS.gauge(_name, lambda field=_field: {(("backend", ip),): s[field] for ip, s in pool_stats().items()})
+
+# =========================
+# BATCHES
+# =========================
+# Same modes and results as proxy.py's /query/batch
+async def run_with_failover(target_ip, read, qtype, failed, fn, fallback=None):
+    # Awaits fn(ip), moving reads to another backend on connection-level failures
+    fallback = fallback or fallback_target
+    while True:
+        try:
+            return target_ip, await fn(target_ip)
+        except Exception as e:
+            if not is_backend_failure(e):
+                raise
+            breaker = proxy.BREAKERS.get(target_ip)
+            if breaker is not None:         # member may have been removed mid-query
+                breaker.record_failure()
+            failed.append(target_ip)
+            next_ip = fallback(failed) if read and len(failed) <= READ_RETRIES else None
+            if next_ip is None:
+                raise
+            target_ip = next_ip
+            record_target(target_ip, qtype)
+
+
+async def run_statement(index, sql, read, target_ip=None):
+    # One routed statement with failover; errors are reported, not raised
+    qtype = "READ" if read else "WRITE"
+    count_query(qtype)
+    if target_ip is None:
+        target_ip = choose_target(read)
+    record_target(target_ip, qtype)
+    session = classify(sql).session
+    failed = []
+    start = time.time()
+    entry = {"index": index, "type": qtype}
+    try:
+        target_ip, entry["result"] = await run_with_failover(
+            target_ip, read, qtype, failed, lambda ip: execute_on(ip, sql, read, session=session)
+        )
+    except Overloaded as e:
+        entry["error"] = str(e)
+        entry["shed"] = e.reason
+    except QueryKilled as e:
+        entry["error"] = str(e)
+        entry["killed"] = e.reason
+    except Exception as e:
+        entry["error"] = str(e)
+    if not read and entry.get("shed") is None:
+        CACHE.invalidate(classify(sql).write_tables)
+    entry["target"] = target_ip
+    entry["failed_backends"] = failed
+    entry["duration_ms"] = round((time.time() - start) * 1000, 2)
+    return entry
+
+
+async def run_parallel(statements):
+    # Independent reads fanned out, BATCH_PARALLELISM at a time
+    limit = asyncio.Semaphore(BATCH_PARALLELISM)
+
+    async def one(index, sql):
+        # Untraced, like proxy.py's executor threads: concurrent spans would
+        # interleave in the request's trace
+        end_trace()
+        async with limit:
+            return await run_statement(index, sql, True)
+
+    return await asyncio.gather(*(one(i, sql) for i, sql in enumerate(statements)))
+
+
+async def run_pipeline(statements):
+    # In order, stopping at the first failure; reads after a write follow it to the manager
+    results = []
+    wrote = False
+    for i, sql in enumerate(statements):
+        read = is_read_query(sql)
+        results.append(await run_statement(i, sql, read, MANAGER_IP if read and wrote else None))
+        wrote = wrote or not read
+        if "error" in results[-1]:
+            break
+    return results
+
+
+async def run_transaction(statements, capture_gtid=False):
+    # Everything on the manager, one connection, one commit
+    results = []
+    token = None
+    for sql in statements:
+        qtype = "READ" if is_read_query(sql) else "WRITE"
+        count_query(qtype)
+        record_target(MANAGER_IP, qtype)
+    try:
+        with outstanding(MANAGER_IP):
+            pool, conn = await acquire(MANAGER_IP)
+            try:
+                await conn.begin()
+                async with conn.cursor() as cursor:
+                    for i, sql in enumerate(statements):
+                        start = time.time()
+                        read = is_read_query(sql)
+                        try:
+                            with span("execute"):
+                                await run_limited(MANAGER_IP, conn, cursor.execute(sql))
+                        except Exception as e:
+                            results.append({"index": i, "type": "READ" if read else "WRITE",
+                                            "target": MANAGER_IP, "error": str(e)})
+                            raise
+                        with span("fetch"):
+                            result = await cursor.fetchall() if read else {"rows_affected": cursor.rowcount}
+                        results.append({
+                            "index": i,
+                            "type": "READ" if read else "WRITE",
+                            "target": MANAGER_IP,
+                            "duration_ms": round((time.time() - start) * 1000, 2),
+                            "result": result,
+                        })
+                start = time.time()
+                with span("commit"):
+                    await conn.commit()
+                commit_ms = round((time.time() - start) * 1000, 2)
+                if capture_gtid:
+                    async with conn.cursor() as cursor:
+                        await cursor.execute(GTID_EXECUTED_SQL)
+                        token = compact_gtid_set((await cursor.fetchone())["gtid"])
+            except Exception as e:
+                # Roll back a healthy connection; anything else may be mid-result
+                if is_backend_failure(e) or conn.closed:
+                    conn.close()
+                else:
+                    try:
+                        await conn.rollback()
+                    except Exception:
+                        conn.close()
+                raise
+            except BaseException:
+                conn.close()
+                raise
+            finally:
+                if any(classify(sql).session for sql in statements):
+                    conn.close()
+                pool.release(conn)
+    finally:
+        CACHE.invalidate(batch_write_tables(statements))
+    return results, commit_ms, token
+
+# =========================
+# HEALTH CHECKS
+# =========================
+async def probe_backend(ip):
+    breaker = proxy.BREAKERS.get(ip)
+    if breaker is None or not breaker.begin_trial():
+        return
+    start = time.time()
+    try:
+        pool, conn = await acquire(ip, HEALTH_CHECK_TIMEOUT, admit=False)
+        try:
+            await conn.ping(reconnect=False)
+        finally:
+            pool.release(conn)
+    except Exception:
+        breaker.record_failure()
+        return
+    breaker.record_success()
+    record_latency(ip, (time.time() - start) * 1000)
+
+
+health_checked = set()
+
+
+async def health_check_loop(ip):
+    health_checked.add(ip)
+    try:
+        while ip in proxy.BREAKERS:
+            await probe_backend(ip)
+            await asyncio.sleep(HEALTH_CHECK_INTERVAL)
+    finally:
+        health_checked.discard(ip)
+
+
+async def fetch_one(ip, sql, fallback_sql=None):
+    pool, conn = await acquire(ip, HEALTH_CHECK_TIMEOUT, admit=False)
+    try:
+        async with conn.cursor() as cursor:
+            try:
+                await cursor.execute(sql)
+            except aiomysql.ProgrammingError:
+                if fallback_sql is None:
+                    raise
+                await cursor.execute(fallback_sql)
+            return await cursor.fetchone()
+    finally:
+        pool.release(conn)
+
+
+async def check_replication():
+    # Same checks as proxy.check_replication, over the async pools
+    source_gtids = None
+    source_at = time.time()
+    try:
+        source_gtids = parse_gtid_set((await fetch_one(MANAGER_IP, GTID_EXECUTED_SQL))["gtid"] or "")
+    except Exception:
+        pass
+    for ip in proxy.WORKER_IPS:
+        try:
+            row = await fetch_one(ip, "SHOW REPLICA STATUS", "SHOW SLAVE STATUS")
+        except Exception:
+            continue
+        record_replica_status(ip, row, source_gtids, source_at)
+
+
+async def replication_monitor_loop():
+    while True:
+        await check_replication()
+        await asyncio.sleep(REPLICA_LAG_INTERVAL)
+
+# =========================
+# MEMBERSHIP
+# =========================
+async def warm_member(member, ip, since):
+    # Creating the pool opens POOL_MIN_SIZE connections; one ping proves them
+    while member.state == Backend.WARMING and member.since == since:
+        try:
+            pool, conn = await acquire(ip, HEALTH_CHECK_TIMEOUT, admit=False)
+            try:
+                await conn.ping(reconnect=False)
+            finally:
+                pool.release(conn)
+        except Exception:
+            await asyncio.sleep(HEALTH_CHECK_INTERVAL)
+            continue
+        mark_warmed(member, since)
+        return
+
+
+def retire_pool(ip):
+    # Closes idle connections now and the others as they are released
+    pool = POOLS.pop(ip, None)
+    if pool is not None:
+        pool.close()
+    REPLICA_PROGRESS.forget(ip)
+
+
+async def membership_loop(app):
+    # Same steps as proxy.membership_loop; this single process always leads
+    def start(coro):
+        app["health_checks"].append(asyncio.ensure_future(coro))
+
+    while True:
+        try:
+            watch_member_files()
+            advance_members()
+            joined, left = sync_members()
+            for ip in left:
+                retire_pool(ip)
+            for ip in joined:
+                if ip not in health_checked:
+                    start(health_check_loop(ip))
+            warm_members(lambda *args: start(warm_member(*args)))
+            app["health_checks"] = [task for task in app["health_checks"] if not task.done()]
+        except Exception as e:
+            print(f"Membership update failed: {e!r}")
+        await asyncio.sleep(MEMBERSHIP_INTERVAL)
+
+# =========================
+# ROUTES
+# =========================
+def json_response(data, status=200):
+    return web.json_response(data, status=status, dumps=dumps)
+
+
+def shed(exc, **extra):
+    response = json_response({"error": str(exc), "shed": exc.reason, **extra}, exc.status)
+    response.headers["Retry-After"] = str(exc.retry_after)
+    return response
+
+
+def respond(request, payload, data, status=200):
+    # Same "timing": true contract and Accept negotiation as proxy.respond
+    if data.get("timing"):
+        payload["timing_ms"] = current_trace().breakdown()
+    with span("serialize"):
+        if wants_msgpack(request.headers.get("Accept")):
+            body, headers = pack(payload, request.headers.get("Accept-Encoding"))
+            return web.Response(body=body, status=status, headers=headers)
+        return json_response(payload, status)
+
+
+@web.middleware
+async def trace_requests(request, handler):
+    # Mirrors proxy.py's before/after_request hooks; each request runs in its
+    # own task, so the trace context var does not leak between requests
+    trace = begin_trace(request.headers.get(REQUEST_ID_HEADER), request.path)
+    request["trace"] = trace
+    try:
+        budget_ms = float(request.headers.get(DEADLINE_HEADER, DEFAULT_DEADLINE_MS))
+    except ValueError:
+        budget_ms = DEFAULT_DEADLINE_MS
+    DEADLINE.set(time.time() + budget_ms / 1000)
+    try:
+        response = await handler(request)
+        if not response.prepared:
+            response.headers["Server-Timing"] = trace.server_timing()
+            response.headers[REQUEST_ID_HEADER] = trace.request_id
+        if request.path.startswith("/query"):
+            annotate(status=response.status, type=request.get("qtype"))
+            TRACES.offer(trace, force=request.get("trace_forced", False))
+        return response
+    finally:
+        end_trace()
+
+
+async def query(request):
+    with span("parse"):
+        try:
+            data = await request.json()
+        except ValueError:
+            data = {}
+    sql = data.get("query")
+    request["trace_forced"] = bool(data.get("timing"))
+
+    if not sql:
+        return json_response({"error": "Missing query"}, 400)
+
+    with span("classify"):
+        info = classify(sql)
+    read = info.read
+    qtype = "READ" if read else "WRITE"
+    request["qtype"] = qtype
+
+    count_query(qtype)
+
+    token = gtids = None
+    if read:
+        try:
+            token, gtids = session_token(data)
+        except ValueError as e:
+            return json_response({"error": f"Invalid session_token: {e}"}, 400)
+    capture_gtid = not read and (SESSION_CONSISTENCY or data.get("consistency") == "session")
+
+    strategy = current_strategy()
+    if read and data.get("stream"):
+        return await stream_query(request, sql, strategy, token, gtids)
+
+    use_cache = CACHE_ENABLED and info.cacheable and data.get("cache", True) and token is None
+    if read and not use_cache:
+        CACHE.bypass()
+    if use_cache:
+        start = time.time()
+        with span("cache"):
+            cache_key = normalize_sql(sql)
+            cached = CACHE.get(cache_key)
+        if cached is not None:
+            return respond(request, {
+                "strategy": strategy,
+                "target": "cache",
+                "type": qtype,
+                "cached": True,
+                "duration_ms": round((time.time() - start) * 1000, 3),
+                "result": cached
+            }, data)
+        tables = info.tables
+        snapshot = CACHE.snapshot(tables)
+
+    with span("route"):
+        target_ip = choose_target(read)
+        if token:
+            target_ip = await consistent_target(target_ip, token, gtids)
+    record_target(target_ip, qtype)
+    fallback = manager_fallback if token else fallback_target
+
+    start = time.time()
+    failed = []
+
+    while True:
+        try:
+            result = await execute_on(target_ip, sql, read, capture_gtid, info.session)
+            break
+        except Overloaded as e:
+            return shed(e, failed_backends=failed)
+        except QueryKilled as e:
+            if not read:
+                CACHE.invalidate(info.write_tables)
+            return json_response({"error": str(e), "killed": e.reason, "failed_backends": failed}, 504)
+        except Exception as e:
+            if not is_backend_failure(e):
+                return json_response({"error": str(e)}, 500)
+            breaker = proxy.BREAKERS.get(target_ip)
+            if breaker is not None:         # member may have been removed mid-query
+                breaker.record_failure()
+            failed.append(target_ip)
+            next_ip = fallback(failed) if read and len(failed) <= READ_RETRIES else None
+            if next_ip is None:
+                if not read:
+                    CACHE.invalidate(info.write_tables)
+                return json_response({"error": str(e), "failed_backends": failed}, 503)
+            target_ip = next_ip
+            record_target(target_ip, qtype)
+
+    duration = round((time.time() - start) * 1000, 2)
+    if capture_gtid:
+        token = result.pop("session_token")
+
+    with span("cache"):
+        if use_cache:
+            CACHE.put(cache_key, result, tables, snapshot, replica_current(target_ip, tables))
+        elif not read:
+            CACHE.invalidate(info.write_tables)
+
+    response = {
+        "strategy": strategy,
+        "target": target_ip,
+        "type": qtype,
+        "cached": False,
+        "failed_backends": failed,
+        "duration_ms": duration,
+        "result": result
+    }
+    if token:
+        response["session_token"] = token
+    return respond(request, response, data)
+
+
+async def stream_query(request, sql, strategy, token=None, gtids=None):
+    CACHE.bypass()
+    target_ip = choose_target(True)
+    if token:
+        target_ip = await consistent_target(target_ip, token, gtids)
+    record_target(target_ip, "READ")
+    fallback = manager_fallback if token else fallback_target
+
+    start = time.time()
+    failed = []
+
+    while True:
+        try:
+            pool, conn, cursor, counter = await open_stream(target_ip, sql)
+            break
+        except Overloaded as e:
+            return shed(e, failed_backends=failed)
+        except Exception as e:
+            if not is_backend_failure(e):
+                return json_response({"error": str(e), "failed_backends": failed}, 500)
+            breaker = proxy.BREAKERS.get(target_ip)
+            if breaker is not None:         # member may have been removed mid-query
+                breaker.record_failure()
+            failed.append(target_ip)
+            next_ip = fallback(failed) if len(failed) <= READ_RETRIES else None
+            if next_ip is None:
+                return json_response({"error": str(e), "failed_backends": failed}, 503)
+            target_ip = next_ip
+            record_target(target_ip, "READ")
+
+    response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+    row_count = 0
+    finished = False
+    try:
+        await response.prepare(request)
+        columns = [d[0] for d in cursor.description or ()]
+        await response.write((dumps({
+            "strategy": strategy,
+            "target": target_ip,
+            "type": "READ",
+            "failed_backends": failed,
+            "columns": columns,
+        }) + "\n").encode())
+        while True:
+            batch = await cursor.fetchmany(STREAM_BATCH_ROWS)
+            if not batch:
+                break
+            row_count += len(batch)
+            await response.write((dumps({"rows": batch}) + "\n").encode())
+        await cursor.close()
+        finished = True
+        await response.write((dumps({
+            "done": True,
+            "row_count": row_count,
+            "duration_ms": round((time.time() - start) * 1000, 2)
+        }) + "\n").encode())
+    except (ConnectionResetError, asyncio.CancelledError):
+        raise
+    except Exception as e:
+        await response.write((dumps({"error": str(e), "row_count": row_count}) + "\n").encode())
+    finally:
+        counter.incr(-1)
+        if not finished or classify(sql).session:
+            conn.close()
+        pool.release(conn)
+    await response.write_eof()
+    return response
+
+
+async def query_batch(request):
+    with span("parse"):
+        try:
+            data = await request.json()
+        except ValueError:
+            data = {}
+    statements = data.get("queries")
+    mode = data.get("mode", "pipeline")
+    request["trace_forced"] = bool(data.get("timing"))
+
+    if not isinstance(statements, list) or not statements or not all(
+        isinstance(s, str) and s.strip() for s in statements
+    ):
+        return json_response({"error": "queries must be a non-empty list of SQL strings"}, 400)
+    if len(statements) > BATCH_MAX_STATEMENTS:
+        return json_response({"error": f"Batch exceeds {BATCH_MAX_STATEMENTS} statements"}, 400)
+    if mode not in BATCH_MODES:
+        return json_response({"error": f"Unknown mode {mode!r}, expected one of {list(BATCH_MODES)}"}, 400)
+
+    start = time.time()
+    response = {"strategy": current_strategy(), "mode": mode}
+
+    if mode == "parallel":
+        writes = [i for i, sql in enumerate(statements) if not is_read_query(sql)]
+        if writes:
+            return json_response({"error": "parallel mode only accepts reads", "write_indexes": writes}, 400)
+        results = await run_parallel(statements)
+    elif mode == "pipeline":
+        results = await run_pipeline(statements)
+    else:
+        results = []
+        try:
+            results, response["commit_ms"], token = await run_transaction(
+                statements, SESSION_CONSISTENCY or data.get("consistency") == "session"
+            )
+            if token:
+                response["session_token"] = token
+        except Overloaded as e:
+            return shed(e, mode=mode)
+        except QueryKilled as e:
+            return json_response({"error": str(e), "killed": e.reason, "mode": mode, "results": results}, 504)
+        except Exception as e:
+            response.update({
+                "error": f"Transaction rolled back: {e}",
+                "results": results,
+                "duration_ms": round((time.time() - start) * 1000, 2),
+            })
+            return json_response(response, 503 if is_backend_failure(e) else 500)
+
+    response.update({
+        "results": results,
+        "errors": sum(1 for r in results if "error" in r),
+        "duration_ms": round((time.time() - start) * 1000, 2),
+    })
+    return respond(request, response, data)
+
+
+async def get_strategy(request):
+    return json_response({"strategy": current_strategy(), "available": sorted(STRATEGIES), "latency": latency_stats(),
+                          "routing": routing_stats()})
+
+
+async def update_strategy(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        data = {}
+    try:
+        set_strategy(data.get("strategy"))
+    except ValueError as e:
+        return json_response({"error": str(e)}, 400)
+    print("Strategy switched to", current_strategy())
+    return json_response({"status": "ok", "strategy": current_strategy()})
+
+
+async def get_members(request):
+    return json_response({"members": members_stats(), "capacity": MAX_BACKENDS})
+
+
+async def post_member(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        data = {}
+    try:
+        member = add_member(data.get("host"), data.get("weight", 1.0))
+    except (TypeError, ValueError) as e:
+        return json_response({"error": str(e)}, 400)
+    return json_response({"host": member.ip, **member.stats()})
+
+
+async def drain(request):
+    return change_member(request.match_info["host"], remove=False)
+
+
+async def remove(request):
+    return change_member(request.match_info["host"], remove=True)
+
+
+def change_member(host, remove):
+    try:
+        member = drain_member(host, remove)
+    except LookupError as e:
+        return json_response({"error": str(e)}, 404)
+    except ValueError as e:
+        return json_response({"error": str(e)}, 400)
+    return json_response({"host": member.ip, **member.stats()}, 202)
+
+
+async def stats(request):
+    return json_response({**stats_snapshot(), "strategy": current_strategy(), "latency_ms": latency_summary(), "latency": latency_stats(),
+                          "health": health_stats(), "replication": replication_stats(), "routing": routing_stats(),
+                          "pools": pool_stats(),
+                          "cache": CACHE.stats(), "classifier": CLASSIFIER.stats(), "traces": TRACES.stats(),
+                          "watchdog": WATCHDOG.stats()})
+
+
+async def metrics(request):
+    return web.Response(
+        body=METRICS.prometheus("proxy_").encode(),
+        headers={"Content-Type": PROMETHEUS_CONTENT_TYPE},
+    )
+
+
+async def stats_pools(request):
+    return json_response(pool_stats())
+
+
+async def reset_stats(request):
+    reset_counters()
+    CACHE.reset_stats()
+    CLASSIFIER.reset_stats()
+    TRACES.clear()
+    WATCHDOG.reset_stats()
+    return json_response({"status": "ok"})
+
+
+async def traces(request):
+    def arg(name, default, cast):
+        try:
+            return cast(request.query.get(name, default))
+        except ValueError:
+            return default
+
+    return json_response({
+        **TRACES.stats(),
+        "traces": TRACES.recent(
+            limit=arg("limit", 50, int),
+            min_ms=arg("min_ms", 0.0, float),
+            request_id=request.query.get("request_id"),
+            name=request.query.get("name"),
+        ),
+    })
+
+# =========================
+# START
+# =========================
+async def on_startup(app):
+    for ip in proxy.BACKENDS:
+        try:
+            await get_pool(ip)
+        except Exception as e:
+            print(f"Pool {ip}: warm-up failed: {e}")
+    app["health_checks"] = [
+        asyncio.ensure_future(health_check_loop(ip)) for ip in list(proxy.BREAKERS)
+    ]
+    app["health_checks"].append(asyncio.ensure_future(membership_loop(app)))
+    if REPLICA_MONITOR:
+        app["health_checks"].append(asyncio.ensure_future(replication_monitor_loop()))
+
+
+async def on_cleanup(app):
+    for task in app["health_checks"]:
+        task.cancel()
+    for pool in POOLS.values():
+        pool.close()
+        await pool.wait_closed()
+
+
+def make_app():
+    app = web.Application(middlewares=[trace_requests])
+    app.router.add_post("/query", query)
+    app.router.add_post("/query/batch", query_batch)
+    app.router.add_get("/strategy", get_strategy)
+    app.router.add_post("/strategy", update_strategy)
+    app.router.add_get("/members", get_members)
+    app.router.add_post("/members", post_member)
+    app.router.add_post("/members/{host}/drain", drain)
+    app.router.add_delete("/members/{host}", remove)
+    app.router.add_get("/stats", stats)
+    app.router.add_get("/metrics", metrics)
+    app.router.add_get("/stats/pools", stats_pools)
+    app.router.add_post("/stats/reset", reset_stats)
+    app.router.add_get("/traces", traces)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+if __name__ == "__main__":
+    set_strategy(proxy.STRATEGY)
+    # Cancelling the handler when the client hangs up is what lets run_limited kill its query
+    web.run_app(make_app(), host="0.0.0.0", port=PROXY_PORT, backlog=4096, handler_cancellation=True)
@@ -0,0 +1,124 @@
+import json
+import os
+import platform
+import subprocess
+import time
+import uuid
+
+# Append-only store of benchmark runs, one JSON object per line. Each run keeps
+# the full result next to the metadata needed to compare like with like (git
+# commit, benchmark, strategy, mode, workload, concurrency, environment) and a
+# flat dict of headline metrics that compare.py works on.
+
+RESULTS_STORE = os.getenv("RESULTS_STORE", "benchmark_runs.jsonl")
+BENCH_ENV = os.getenv("BENCH_ENV", "ec2")  # the offline harness sets "offline"
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Headline metrics and whether a larger value is better
+METRIC_DIRECTIONS = {
+    "throughput_rps": True,
+    "knee_rps": True,
+    "tps": True,
+    "qps": True,
+    "error_rate": False,
+    "mean": False,
+    "p50": False,
+    "p90": False,
+    "p95": False,
+    "p99": False,
+    "p99.9": False,
+}
+
+
+def git(*args):
+    try:
+        return subprocess.run(
+            ["git", *args], cwd=REPO_DIR, capture_output=True, text=True, timeout=5
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def git_metadata():
+    # Uncommitted changes get their own "<sha>+dirty" label so a working tree
+    # can be compared against the clean commit it started from
+    commit = git("rev-parse", "--short", "HEAD") or None
+    dirty = bool(git("status", "--porcelain", "--untracked-files=no"))
+    return {
+        "commit": f"{commit}+dirty" if commit and dirty else commit,
+        "commit_time": git("log", "-1", "--format=%cI") or None,
+        "dirty": dirty,
+    }
+
+
+def phase_metrics(phase, summary):
+    # Flatten a loadgen summary into "phase.metric" keys
+    out = {}
+    requests_sent = summary.get("requests") or 0
+    for key in ("throughput_rps", "tps", "qps"):
+        if summary.get(key) is not None:
+            out[f"{phase}.{key}"] = summary[key]
+    if requests_sent:
+        out[f"{phase}.error_rate"] = round(summary.get("errors", 0) / requests_sent, 6)
+    for key, value in (summary.get("latency_ms") or {}).items():
+        if key in METRIC_DIRECTIONS and value is not None:
+            out[f"{phase}.{key}"] = value
+    return out
+
+
+def headline_metrics(result):
+    metrics = {}
+    for phase in ("read", "write", "blocked", "mixed"):
+        if isinstance(result.get(phase), dict):
+            metrics.update(phase_metrics(phase, result[phase]))
+    if "knee_rps" in result:
+        metrics["sweep.knee_rps"] = result["knee_rps"]
+        for run in result.get("runs", []):
+            metrics.update(phase_metrics(f"sweep@{run['target_rps']:g}", {
+                "latency_ms": run["latency_ms"],
+            }))
+    return metrics
+
+
+def record_run(benchmark, result, strategy=None, mode="closed", workload="select1", clients=None, path=None):
+    run = {
+        "run_id": uuid.uuid4().hex[:12],
+        "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        **git_metadata(),
+        "host": platform.node(),
+        "environment": BENCH_ENV,
+        "benchmark": benchmark,
+        "strategy": strategy,
+        "mode": mode,
+        "workload": workload,
+        "clients": clients,
+        "metrics": headline_metrics(result),
+        "result": result,
+    }
+    with open(path or RESULTS_STORE, "a") as f:
+        f.write(json.dumps(run, default=str) + "\n")
+    return run
+
+
+def load_runs(path=None):
+    path = path or RESULTS_STORE
+    if not os.path.exists(path):
+        return []
+    runs = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                run = json.loads(line)
+                # Older closed-loop runs without a mix were stored as "default"
+                if run.get("workload") == "default":
+                    run["workload"] = "select1"
+                runs.append(run)
+    return runs
+
+
+def series_key(run):
+    # Runs are only comparable when everything but the code is the same
+    return (run["environment"], run["benchmark"], run["mode"], run["workload"],
+            run.get("strategy") or "-", run.get("clients"))
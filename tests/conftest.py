@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+# The services are top-level scripts; proxy.py reads its backend list when
+# imported, so point it at a throwaway one (nothing connects to it)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+    f.write("10.0.0.1\n10.0.0.2\n10.0.0.3\n")
+os.environ.setdefault("INSTANCES_FILE", f.name)
+os.environ.setdefault("DB_HOSTS_FILE", f.name + ".missing")
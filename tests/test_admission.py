@@ -0,0 +1,147 @@
+import time
+
+import pytest
+
+import proxy
+from proxy import ADMISSION_BACKOFF, ADMISSION_MAX_QUEUE, ADMISSION_MIN_LIMIT, ConnectionPool, Overloaded
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(proxy.time, "time", clock)
+    return clock
+
+
+def new_pool():
+    return ConnectionPool("10.0.0.2", min_size=0, max_size=20)
+
+
+@pytest.fixture
+def pool(clock):
+    return new_pool()
+
+
+def complete(pool, clock, ms, in_use=None, gap_ms=None):
+    # One admitted checkout that took `ms`, checked in `gap_ms` after the previous one
+    clock.now += (ms if gap_ms is None else gap_ms) / 1000
+    conn = object()
+    pool.checked_out[id(conn)] = (clock.now - ms / 1000, int(pool.limit) if in_use is None else in_use)
+    with pool.cond:
+        pool._checkin(conn)
+
+
+def test_steady_service_time_keeps_the_limit(pool, clock):
+    for _ in range(200):
+        complete(pool, clock, 1.0)
+    assert pool.limit == 20
+    assert pool.baseline_ms == pytest.approx(1.0)
+
+
+def test_additive_increase_only_when_the_limit_held_us_back(pool, clock):
+    complete(pool, clock, 1.0)
+    pool.limit = 5.0
+    for _ in range(10):
+        complete(pool, clock, 1.0, in_use=1)
+    assert pool.limit == 5.0
+
+    path = []
+    for _ in range(40):
+        complete(pool, clock, 1.0)
+        path.append(pool.limit)
+    assert path == sorted(path)
+    # About one more slot per `limit` completions
+    assert path[4] == pytest.approx(6.0, abs=0.1)
+    assert 10 < path[-1] < 11
+    for _ in range(1000):
+        complete(pool, clock, 1.0)
+    assert pool.limit == 20
+
+
+def test_multiplicative_backoff_once_per_service_time(pool, clock):
+    for _ in range(20):
+        complete(pool, clock, 1.0)
+    complete(pool, clock, 10.0)
+    assert pool.service_ewma_ms > pool.baseline_ms * proxy.ADMISSION_TOLERANCE
+    assert pool.limit == pytest.approx(20 * ADMISSION_BACKOFF)
+    # Completions within one recent service time of the decrease don't compound it
+    complete(pool, clock, 10.0, gap_ms=0.5)
+    assert pool.limit == pytest.approx(20 * ADMISSION_BACKOFF)
+    complete(pool, clock, 10.0, gap_ms=50)
+    assert pool.limit == pytest.approx(20 * ADMISSION_BACKOFF ** 2)
+
+
+def test_backoff_stops_at_the_floor(pool, clock):
+    for _ in range(20):
+        complete(pool, clock, 1.0)
+    for _ in range(40):  # 4s, inside one baseline window
+        complete(pool, clock, 50.0, gap_ms=100)
+    assert pool.limit == ADMISSION_MIN_LIMIT
+
+
+def test_baseline_follows_a_workload_that_got_slower(pool, clock):
+    for _ in range(20):
+        complete(pool, clock, 1.0)
+    lowest = pool.limit
+    for _ in range(200):
+        complete(pool, clock, 50.0, gap_ms=100)
+        lowest = min(lowest, pool.limit)
+    # Two windows later the slow service time is the new normal and the limit recovers
+    assert lowest == ADMISSION_MIN_LIMIT
+    assert pool.baseline_ms > 40
+    assert pool.limit > 10
+
+
+def saturated(limit):
+    # Real clock: every slot under the limit checked out, none idle
+    pool = new_pool()
+    pool.limit = float(limit)
+    pool.size = limit
+    return pool
+
+
+def test_full_queue_sheds_with_429():
+    pool = saturated(4)
+    pool.waiting = ADMISSION_MAX_QUEUE
+    with pool.cond, pytest.raises(Overloaded) as shed:
+        pool._admit(time.time() + 10)
+    assert (shed.value.status, shed.value.reason) == (429, "queue_full")
+    assert pool.counters["shed_queue_full"] == 1
+
+
+def test_unmeetable_deadline_sheds_up_front_with_503():
+    pool = saturated(2)
+    pool.service_ewma_ms = 1000.0
+    pool.waiting = 3
+    with pool.cond, pytest.raises(Overloaded) as shed:
+        pool._admit(time.time() + 0.5)
+    assert (shed.value.status, shed.value.reason) == (503, "deadline")
+    assert shed.value.retry_after == 2
+    assert pool.counters["waits"] == 0
+
+
+def test_deadline_expiring_in_the_queue_sheds_with_503():
+    pool = saturated(2)
+    start = time.time()
+    with pool.cond, pytest.raises(Overloaded) as shed:
+        pool._admit(start + 0.05)
+    assert time.time() - start >= 0.05
+    assert (shed.value.status, shed.value.reason) == (503, "deadline")
+    assert pool.counters == {**pool._new_counters(), "waits": 1, "shed_deadline": 1}
+    assert pool.waiting == 0
+
+
+def test_admitted_when_below_the_limit():
+    pool = saturated(4)
+    pool.size = 3
+    with pool.cond:
+        pool._admit(time.time() - 1)  # an expired deadline is only checked when waiting
+    assert pool.counters["waits"] == 0
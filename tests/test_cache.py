@@ -0,0 +1,80 @@
+import time
+
+import pytest
+
+import proxy
+from proxy import ResultCache, replica_current
+
+MANAGER, REPLICA = "10.0.0.1", "10.0.0.2"
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = ResultCache(max_bytes=1024 * 1024, ttl=30)
+    monkeypatch.setattr(proxy, "CACHE", cache)
+    return cache
+
+
+def store(cache, key, tables, result=None):
+    cache.put(key, result or [{"id": 1}], frozenset(tables), cache.snapshot(tables))
+
+
+def test_write_invalidates_entries_of_its_tables(cache):
+    store(cache, "select * from actor", {"actor"})
+    store(cache, "select * from film", {"film"})
+    cache.invalidate({"actor"})
+    assert cache.get("select * from actor") is None
+    assert cache.get("select * from film") == [{"id": 1}]
+
+
+def test_unknown_write_tables_drop_everything(cache):
+    store(cache, "select * from actor", {"actor"})
+    cache.invalidate(None)
+    assert cache.get("select * from actor") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_result_read_before_a_write_is_not_stored(cache):
+    snapshot = cache.snapshot({"actor"})
+    cache.invalidate({"actor"})
+    cache.put("select * from actor", [{"id": 1}], frozenset({"actor"}), snapshot)
+    assert cache.get("select * from actor") is None
+
+
+def test_entries_expire(cache):
+    cache.ttl = -1
+    store(cache, "select * from actor", {"actor"})
+    assert cache.get("select * from actor") is None
+    assert cache.stats()["expirations"] == 1
+
+
+def test_unverified_results_are_not_stored(cache):
+    cache.put("select * from actor", [{"id": 1}], frozenset({"actor"}), cache.snapshot({"actor"}), verified=False)
+    assert cache.get("select * from actor") is None
+    assert cache.stats()["unverified"] == 1
+
+
+def test_manager_results_are_always_current(cache):
+    cache.invalidate({"actor"})
+    assert replica_current(MANAGER, {"actor"})
+
+
+def test_replica_not_seen_by_the_monitor_is_not_current(cache):
+    proxy.REPLICA_LAG[REPLICA].reset()
+    assert not replica_current(REPLICA, {"actor"})
+
+
+def test_replica_is_current_once_caught_up_after_the_write(cache):
+    lag = proxy.REPLICA_LAG[REPLICA]
+    lag.reset()
+    cache.invalidate({"actor"})
+    # Caught up with a manager state read before the write: still stale
+    lag.update(True, True, 0.0, 0, source_at=time.time() - 60)
+    assert not replica_current(REPLICA, {"actor"})
+    lag.update(True, True, 0.0, 0, source_at=time.time())
+    assert replica_current(REPLICA, {"actor"})
+    # A gap leaves the last caught-up time alone
+    cache.invalidate({"actor"})
+    lag.update(True, True, 0.0, 3, source_at=time.time())
+    assert not replica_current(REPLICA, {"actor"})
+    lag.reset()
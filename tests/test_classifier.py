@@ -0,0 +1,107 @@
+import pytest
+
+from classifier import ClassifierCache, classify_uncached
+
+
+def test_load_data_into_table_writes_that_table():
+    info = classify_uncached("LOAD DATA INFILE '/tmp/actors.csv' INTO TABLE actor FIELDS TERMINATED BY ','")
+    assert not info.read
+    assert info.write_tables == {"actor"}
+    assert classify_uncached("LOAD DATA LOCAL INFILE 'f' REPLACE INTO TABLE sakila.actor").write_tables == {"actor"}
+
+
+def test_insert_select_writes_its_target():
+    info = classify_uncached("INSERT INTO rental_archive SELECT * FROM rental WHERE return_date < '2005-06-01'")
+    assert not info.read and not info.cacheable
+    assert info.tables == {"rental_archive", "rental"}
+    assert "rental_archive" in info.write_tables
+
+
+@pytest.mark.parametrize("sql, tables", [
+    ("INSERT INTO actor (first_name) VALUES ('A')", {"actor"}),
+    ("INSERT actor VALUES (1)", {"actor"}),
+    ("REPLACE LOW_PRIORITY INTO `film_text` VALUES (1, 'x', 'y')", {"film_text"}),
+    ("UPDATE customer c JOIN address a ON a.address_id = c.address_id SET c.active = 0", {"customer", "address"}),
+    ("DELETE FROM payment WHERE amount = 0", {"payment"}),
+    ("TRUNCATE TABLE film_actor", {"film_actor"}),
+])
+def test_write_tables(sql, tables):
+    assert classify_uncached(sql).write_tables == tables
+
+
+def test_unknown_write_invalidates_everything():
+    assert classify_uncached("CALL refresh_everything()").write_tables is None
+
+
+def test_cte_names_are_not_tables():
+    info = classify_uncached(
+        "WITH recent AS (SELECT * FROM rental WHERE rental_date > '2005-08-01') "
+        "SELECT c.* FROM customer c JOIN recent r ON r.customer_id = c.customer_id"
+    )
+    assert info.read and info.cacheable
+    assert info.verb == "select"
+    assert info.tables == {"rental", "customer"}
+
+
+def test_cte_wrapped_write():
+    info = classify_uncached("WITH old AS (SELECT rental_id FROM rental) DELETE FROM payment WHERE rental_id IN (SELECT rental_id FROM old)")
+    assert info.verb == "delete"
+    assert not info.read
+    assert "payment" in info.write_tables and "old" not in info.tables
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM inventory WHERE inventory_id = 1 FOR UPDATE",
+    "SELECT * FROM inventory WHERE inventory_id = 1 FOR SHARE",
+    "SELECT * FROM inventory WHERE inventory_id = 1 LOCK IN SHARE MODE",
+])
+def test_locking_reads_go_to_the_manager(sql):
+    info = classify_uncached(sql)
+    assert not info.read and not info.cacheable
+    assert info.write_tables == {"inventory"}
+
+
+@pytest.mark.parametrize("sql, session", [
+    ("SELECT COUNT(*) INTO @n FROM rental", True),
+    ("SELECT * FROM actor INTO OUTFILE '/tmp/actors.txt'", False),
+    ("SELECT first_name INTO DUMPFILE '/tmp/a' FROM actor LIMIT 1", False),
+])
+def test_select_into_is_not_a_read(sql, session):
+    info = classify_uncached(sql)
+    assert not info.read and not info.cacheable
+    assert info.session == session
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT NOW(), first_name FROM actor",
+    "SELECT * FROM actor ORDER BY RAND() LIMIT 1",
+    "SELECT CURRENT_TIMESTAMP",
+    "SELECT * FROM actor WHERE actor_id = @id",
+])
+def test_non_deterministic_reads_are_not_cached(sql):
+    info = classify_uncached(sql)
+    assert info.read and not info.cacheable
+
+
+def test_side_effect_functions_are_writes():
+    assert not classify_uncached("SELECT GET_LOCK('job', 10)").read
+    assert not classify_uncached("SELECT LAST_INSERT_ID()").read
+
+
+def test_literals_and_comments_do_not_change_the_verb():
+    info = classify_uncached("/* DELETE FROM actor */ SELECT 'UPDATE actor SET x = 1' FROM dual")
+    assert info.read and info.tables == frozenset()
+
+
+def test_multi_statement():
+    info = classify_uncached("SELECT * FROM actor; UPDATE film SET rating = 'G'")
+    assert not info.read and not info.cacheable
+    assert info.write_tables == {"film"}
+    assert classify_uncached("SELECT 1; SELECT 2").read
+
+
+def test_cache_memoizes_per_fingerprint():
+    cache = ClassifierCache()
+    first = cache.classify("SELECT * FROM actor WHERE actor_id = 1")
+    assert cache.classify("SELECT * FROM actor WHERE actor_id = 42") is first
+    assert cache.stats()["hits"] == 1
@@ -0,0 +1,55 @@
+import pytest
+
+import gatekeeper
+from gatekeeper import ProxyEndpoints
+
+URLS = ["http://10.0.1.1:5000", "http://10.0.1.2:5000"]
+
+
+@pytest.fixture
+def ec2(monkeypatch):
+    calls = []
+    outcome = {"urls": URLS}
+
+    def discover():
+        calls.append(1)
+        if outcome["urls"] is None:
+            raise RuntimeError("EC2 API unavailable")
+        return outcome["urls"]
+
+    monkeypatch.setattr(gatekeeper, "discover_proxy_urls", discover)
+    return calls, outcome
+
+
+def test_outage_keeps_cached_urls_and_backs_off(ec2):
+    calls, outcome = ec2
+    proxies = ProxyEndpoints([])
+    assert proxies.next() in URLS
+    assert len(calls) == 1
+
+    outcome["urls"] = None
+    proxies.expires_at = 0.0
+    assert {proxies.next() for _ in range(20)} == set(URLS)
+    assert len(calls) == 2  # one describe_instances per backoff, not per request
+
+    proxies.expires_at = 0.0
+    outcome["urls"] = URLS[:1]
+    proxies.next()
+    assert proxies.urls == URLS[:1]
+
+
+def test_outage_without_cached_urls_fails_fast(ec2):
+    calls, outcome = ec2
+    outcome["urls"] = None
+    proxies = ProxyEndpoints([])
+    for _ in range(5):
+        with pytest.raises(RuntimeError):
+            proxies.next()
+    assert len(calls) == 1
+
+
+def test_static_urls_never_call_ec2(ec2):
+    calls, _ = ec2
+    proxies = ProxyEndpoints(["http://127.0.0.1:5000/query"])
+    assert proxies.next() == "http://127.0.0.1:5000"
+    assert calls == []
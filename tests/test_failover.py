@@ -0,0 +1,93 @@
+import pymysql
+import pytest
+
+import proxy
+from proxy import CircuitBreaker
+
+REPLICA, GONE = "10.0.0.2", "10.0.0.9"
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(proxy.time, "time", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def breaker(clock):
+    return CircuitBreaker(REPLICA, failure_threshold=3, reset_timeout=10)
+
+
+def trip(breaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+
+
+def test_breaker_opens_at_the_threshold(breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.available()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN and not breaker.available()
+    assert breaker.stats() == {"state": "open", "failures": 3, "trips": 1}
+
+
+def test_success_while_closed_clears_the_failure_count(breaker):
+    for _ in range(5):
+        breaker.record_failure()
+        breaker.record_failure()
+        breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.trips == 0
+
+
+def test_open_breaker_goes_half_open_after_the_reset_timeout(breaker, clock):
+    trip(breaker)
+    clock[0] += 9.9
+    assert not breaker.begin_trial()
+    assert breaker.state == CircuitBreaker.OPEN
+    clock[0] += 0.2
+    assert breaker.begin_trial()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.available()  # only the probe goes through
+
+
+def test_half_open_closes_on_a_successful_probe(breaker, clock):
+    trip(breaker)
+    clock[0] += 10
+    assert breaker.begin_trial()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.available()
+    assert breaker.failures == 0
+    # A fresh threshold's worth of failures is needed to open it again
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_reopens_on_a_failed_probe(breaker, clock):
+    trip(breaker)
+    clock[0] += 10
+    assert breaker.begin_trial()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.trips == 2
+    # ...and cools down for another full reset_timeout from the failed probe
+    clock[0] += 5
+    assert not breaker.begin_trial()
+    clock[0] += 5
+    assert breaker.begin_trial()
+
+
+def test_failover_from_a_member_removed_mid_query():
+    assert GONE not in proxy.BREAKERS
+
+    def fn(ip):
+        if ip == GONE:
+            raise pymysql.err.OperationalError(2013, "Lost connection to MySQL server during query")
+        return [{"ip": ip}]
+
+    failed = []
+    ip, rows = proxy.run_with_failover(GONE, True, "select", failed, fn, fallback=lambda failed: REPLICA)
+    assert (ip, rows) == (REPLICA, [{"ip": REPLICA}])
+    assert failed == [GONE]
@@ -0,0 +1,133 @@
+import json
+
+import pytest
+
+import gatekeeper
+from gatekeeper import DEFAULT_POLICY, Firewall
+
+
+@pytest.fixture
+def firewall():
+    return Firewall(DEFAULT_POLICY)
+
+
+def allowed(firewall, sql):
+    return firewall.evaluate(sql)[0]
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM actor WHERE actor_id = 1",
+    "UPDATE actor SET first_name = 'DROP TABLE actor' WHERE actor_id = 1",
+    "SELECT 'x; DROP TABLE actor' AS s",
+    'SELECT "a"";DELETE FROM actor" FROM dual',
+    "SELECT * FROM actor -- ; DROP TABLE actor",
+    "SELECT * FROM actor /* ; DELETE FROM actor */",
+    "SELECT `delete` FROM actor",
+    "INSERT INTO actor (first_name) VALUES ('it''s; TRUNCATE actor')",
+])
+def test_literals_and_comments_are_not_statements(firewall, sql):
+    assert allowed(firewall, sql)
+
+
+@pytest.mark.parametrize("sql", [
+    "DROP TABLE actor",
+    "/*!50000 DROP TABLE actor */",
+    "SELECT 1 /*!; DROP TABLE actor */",
+    "/*!DELETE*/ FROM actor",
+    "WITH doomed AS (SELECT actor_id FROM actor) DELETE FROM actor WHERE actor_id IN (SELECT actor_id FROM doomed)",
+    "WITH RECURSIVE a (n) AS (SELECT 1), b AS (SELECT 2) DELETE FROM actor",
+    "(DELETE FROM actor)",
+    "SELECT * FROM actor; DROP TABLE actor",
+    "SELECT 1;DELETE FROM actor;",
+    "SELECT ';' AS s; TRUNCATE actor",
+    "SELECT * FROM actor -- comment\n; ALTER TABLE actor ADD c INT",
+    "delete\tfrom actor",
+    "PREPARE s FROM 'DROP TABLE actor'",
+])
+def test_denied_statements_are_found(firewall, sql):
+    assert not allowed(firewall, sql)
+
+
+def test_read_only_needs_every_statement_to_read(firewall):
+    assert firewall.evaluate("SELECT 1; SELECT 2")[2]
+    assert not firewall.evaluate("SELECT 1; UPDATE actor SET a = 1")[2]
+    assert not firewall.evaluate("SELECT * FROM actor FOR UPDATE")[2]
+
+
+def test_table_rules_see_through_quoting_and_schemas():
+    firewall = Firewall({"default": "allow", "rules": [
+        {"action": "deny", "statements": ["update"], "tables": ["payment"]},
+    ]})
+    assert not allowed(firewall, "UPDATE `payment` SET amount = 0")
+    assert not allowed(firewall, "UPDATE sakila.payment SET amount = 0")
+    assert not allowed(firewall, "UPDATE actor a, payment p SET p.amount = 0")
+    assert allowed(firewall, "UPDATE actor SET first_name = 'payment'")
+
+
+def test_verdicts_are_memoized_per_fingerprint(firewall):
+    assert firewall.check("SELECT * FROM actor WHERE actor_id = 1")[0]
+    assert firewall.check("SELECT * FROM actor WHERE actor_id = 2")[0]
+    assert firewall.stats()["hits"] == 1
+
+
+@pytest.mark.parametrize("policy", [
+    {"default": "Deny", "rules": []},
+    {"default": "block", "rules": []},
+    {"default": "allow", "rules": [{"action": "deny", "statements": "drop"}]},
+    {"default": "allow", "rules": [{"action": "deny", "statements": ["drop", 1]}]},
+    {"default": "allow", "rules": [{"action": "deny", "statements": ["update"], "tables": "payment"}]},
+    {"default": "allow", "rules": [{"action": "Deny", "statements": ["drop"]}]},
+])
+def test_malformed_policies_are_rejected(policy):
+    with pytest.raises(ValueError):
+        Firewall(policy)
+
+
+def test_wildcards_and_empty_lists():
+    firewall = Firewall({"default": "deny", "rules": [
+        {"action": "allow", "statements": [], "tables": "*"},
+        {"action": "allow", "statements": "*", "tables": ["actor"]},
+    ]})
+    assert allowed(firewall, "SELECT * FROM actor")
+    assert not allowed(firewall, "SELECT * FROM film")
+
+
+def test_watch_loop_keeps_the_previous_policy_on_a_bad_file(tmp_path, monkeypatch):
+    config = tmp_path / "firewall.json"
+    config.write_text(json.dumps({"default": "Deny", "rules": [{"action": "deny", "statements": "drop"}]}))
+    previous = Firewall(DEFAULT_POLICY)
+    monkeypatch.setattr(gatekeeper, "FIREWALL_CONFIG", str(config))
+    monkeypatch.setattr(gatekeeper, "FIREWALL_MTIME", None)
+    monkeypatch.setattr(gatekeeper, "FIREWALL", previous)
+    ticks = []
+
+    def sleep(_):
+        if ticks:
+            raise StopIteration
+        ticks.append(1)
+
+    monkeypatch.setattr(gatekeeper.time, "sleep", sleep)
+    with pytest.raises(StopIteration):
+        gatekeeper.firewall_watch_loop()
+    assert gatekeeper.FIREWALL is previous
+    assert not allowed(gatekeeper.FIREWALL, "DROP TABLE actor")
+
+
+def test_watch_loop_loads_a_policy_created_after_startup(tmp_path, monkeypatch):
+    config = tmp_path / "firewall.json"
+    monkeypatch.setattr(gatekeeper, "FIREWALL_CONFIG", str(config))
+    monkeypatch.setattr(gatekeeper, "FIREWALL_MTIME", None)
+    monkeypatch.setattr(gatekeeper, "FIREWALL", Firewall(DEFAULT_POLICY))
+    ticks = []
+
+    def sleep(_):
+        if len(ticks) == 1:
+            config.write_text(json.dumps({"default": "deny", "rules": []}))
+        if len(ticks) == 3:
+            raise StopIteration
+        ticks.append(1)
+
+    monkeypatch.setattr(gatekeeper.time, "sleep", sleep)
+    with pytest.raises(StopIteration):
+        gatekeeper.firewall_watch_loop()
+    assert gatekeeper.FIREWALL.policy["default"] == "deny"
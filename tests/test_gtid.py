@@ -0,0 +1,73 @@
+import pytest
+
+from proxy import gtid_missing, gtid_subset, gtid_union, parse_gtid_set
+
+A = "3e11fa47-71ca-11e1-9e33-c80aa9429562"
+B = "8a94f357-aab4-11df-86ab-c80aa9429563"
+
+
+@pytest.mark.parametrize("text, parsed", [
+    ("", {}),
+    (f"{A}:1-5", {A: [(1, 5)]}),
+    (f"{A}:7", {A: [(7, 7)]}),
+    (f"{A.upper()}:1-5", {A: [(1, 5)]}),
+    (f"{A}:1-5:7-9", {A: [(1, 5), (7, 9)]}),
+    (f"{A}:1-5:6-9", {A: [(1, 9)]}),                 # adjacent intervals merge
+    (f"{A}:7-9:1-8", {A: [(1, 9)]}),                 # overlapping, out of order
+    (f"{A}:1-5:3", {A: [(1, 5)]}),
+    (f"{A}:1-5,{B}:1-3", {A: [(1, 5)], B: [(1, 3)]}),
+    (f"{A}:1-5,\n{B}:1-3,\n{A}:6-8", {A: [(1, 8)], B: [(1, 3)]}),  # multi-line output
+    (f"{A}:1-5,", {A: [(1, 5)]}),
+    (f"{A}:tag:1-5", {f"{A}:tag": [(1, 5)]}),
+    (f"{A}:1-5:tag_2:1-3:7", {A: [(1, 5)], f"{A}:tag_2": [(1, 3), (7, 7)]}),
+    (f"{A}:1-5:Tag:4,{A}:tag:5", {A: [(1, 5)], f"{A}:tag": [(4, 5)]}),
+])
+def test_parse_gtid_set(text, parsed):
+    assert parse_gtid_set(text) == parsed
+
+
+@pytest.mark.parametrize("text", [
+    None,
+    "garbage",
+    f"{A}",
+    f"{A}:",
+    ":1-5",
+    f"{A}:0",
+    f"{A}:5-3",
+    f"{A}:1-x",
+    f"{A}:1-5-7",
+    f"{A}:tag",
+    f"{A}:tag:other:1",
+    f"{A}:9tag:1",
+    f"{A}:{'t' * 33}:1",
+])
+def test_malformed_gtid_sets_are_rejected(text):
+    with pytest.raises(ValueError):
+        parse_gtid_set(text)
+
+
+@pytest.mark.parametrize("a, b, subset, missing", [
+    ("", f"{A}:1-5", True, 0),
+    (f"{A}:1-5", f"{A}:1-5", True, 0),
+    (f"{A}:2-4", f"{A}:1-5", True, 0),
+    (f"{A}:1-6", f"{A}:1-5", False, 1),
+    (f"{A}:1-10", f"{A}:1-3:7-8", False, 5),
+    (f"{A}:1-5", f"{A}:1-3,{A}:4-5", True, 0),       # merged, so one interval covers it
+    (f"{A}:1-5", "", False, 5),
+    (f"{A}:1-5,{B}:1", f"{A}:1-5", False, 1),
+    (f"{A}:tag:1-3", f"{A}:1-3", False, 3),           # tags are separate sources
+    (f"{A}:tag:1-3", f"{A}:1-9:tag:1-4", True, 0),
+])
+def test_subset_and_missing(a, b, subset, missing):
+    a, b = parse_gtid_set(a), parse_gtid_set(b)
+    assert gtid_subset(a, b) is subset
+    assert gtid_missing(a, b) == missing
+
+
+def test_union():
+    a = parse_gtid_set(f"{A}:1-5:9,{A}:tag:1")
+    b = parse_gtid_set(f"{A}:6-8,{B}:1-2")
+    union = gtid_union(a, b)
+    assert union == {A: [(1, 9)], f"{A}:tag": [(1, 1)], B: [(1, 2)]}
+    assert gtid_subset(a, union) and gtid_subset(b, union)
+    assert gtid_union(a, {}) == a
@@ -0,0 +1,120 @@
+import types
+
+import pytest
+import requests
+
+import loadgen
+from loadgen import Histogram, percentile, run_open_loop
+
+# sub_bucket_bits=7: a value is reported at most 1/64 above its true value
+PRECISION = 1 / 64
+
+
+def assert_close(reported, exact):
+    assert exact <= reported <= exact * (1 + PRECISION) + 0.001
+
+
+def test_histogram_percentiles_of_a_uniform_sequence():
+    hist = Histogram()
+    values = [float(ms) for ms in range(1, 1001)]
+    for ms in reversed(values):
+        hist.record(ms)
+    for p in (50, 75, 90, 99, 99.9):
+        assert_close(hist.value_at(p), percentile(values, p))
+    assert hist.value_at(100) == 1000.0
+    assert hist.to_dict()["min"] == 1.0
+    assert hist.to_dict()["mean"] == 500.5
+    assert hist.to_dict()["max"] == 1000.0
+
+
+def test_histogram_is_exact_below_the_first_power_of_two():
+    hist = Histogram()
+    for us in range(1, 101):
+        hist.record(us / 1000)
+    assert hist.value_at(50) == 0.05
+    assert hist.value_at(99) == 0.099
+
+
+def test_histogram_spans_magnitudes():
+    hist = Histogram()
+    hist.record(0.2, count=900)
+    hist.record(40.0, count=90)
+    hist.record(3000.0, count=10)
+    assert_close(hist.value_at(50), 0.2)
+    assert_close(hist.value_at(90), 0.2)
+    assert_close(hist.value_at(95), 40.0)
+    assert_close(hist.value_at(99), 40.0)
+    assert hist.value_at(99.9) == 3000.0
+    assert hist.total == 1000
+
+
+def test_histogram_merge_matches_a_single_histogram():
+    whole, left, right = Histogram(), Histogram(), Histogram()
+    for i, ms in enumerate([0.3, 7.5, 120.0, 45.25, 3.0, 999.0, 0.01, 18.0]):
+        whole.record(ms)
+        (left if i % 2 else right).record(ms)
+    left.merge(right)
+    assert left.to_dict() == whole.to_dict()
+    assert Histogram().to_dict()["p99"] is None
+
+
+class FakeClock:
+    # Deterministic time for one open-loop client: sleeping and serving a
+    # request both just move the clock forward
+    def __init__(self, service_ms):
+        self.now = 0.0
+        self.service_ms = service_ms
+        self.calls = 0
+
+    def perf_counter(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def request(self, session):
+        self.now += self.service_ms(self.calls) / 1000
+        self.calls += 1
+        return True
+
+
+@pytest.fixture
+def stall(monkeypatch):
+    # 100 req/s for 1s; the first request stalls for 500ms, the rest take 1ms
+    clock = FakeClock(lambda i: 500.0 if i == 0 else 1.0)
+    monkeypatch.setattr(loadgen, "time", types.SimpleNamespace(perf_counter=clock.perf_counter, sleep=clock.sleep))
+    return clock
+
+
+def test_open_loop_counts_time_queued_behind_a_stall(stall):
+    corrected, service, samples, elapsed, max_lag_ms = run_open_loop(stall.request, bool, 100, 1.0, 1)
+    assert len(samples) == 100 and all(ok for _, _, ok in samples)
+
+    # Request k was due at 10k ms but could only leave at 500 + (k - 1) ms, so
+    # its latency is 500 - 9k ms until the client catches up at k = 56
+    latencies = [latency for _, latency, _ in sorted(samples)]
+    expected = [500.0] + [500.0 - 9 * k for k in range(1, 56)] + [1.0] * 44
+    assert latencies == pytest.approx(expected)
+    assert max_lag_ms == pytest.approx(490.0)  # request 1: due at 10ms, sent at 500ms
+
+    exact = sorted(expected)
+    for p in (50, 75, 90, 99):
+        assert_close(corrected.value_at(p), percentile(exact, p))
+    assert corrected.value_at(99) > 400
+    # Service time alone hides the stall: 99 of 100 requests took 1ms
+    assert_close(service.value_at(99), 1.0)
+    assert service.value_at(99.9) == 500.0
+
+
+def test_open_loop_counts_transport_errors(monkeypatch):
+    clock = FakeClock(lambda i: 1.0)
+    monkeypatch.setattr(loadgen, "time", types.SimpleNamespace(perf_counter=clock.perf_counter, sleep=clock.sleep))
+
+    def request(session):
+        clock.request(session)
+        if clock.calls % 4 == 0:
+            raise requests.ConnectionError("reset")
+        return True
+
+    _, _, samples, _, _ = run_open_loop(request, bool, 100, 0.2, 1)
+    assert [ok for _, _, ok in samples].count(False) == 5
@@ -0,0 +1,34 @@
+from collections import Counter
+
+import pytest
+
+import proxy
+
+FAST, SLOW = "10.0.0.2", "10.0.0.3"
+
+
+@pytest.fixture
+def pings(monkeypatch):
+    def set_pings(**ms):
+        for ip, ewma in ((FAST, ms["fast"]), (SLOW, ms["slow"])):
+            monkeypatch.setattr(proxy.MEMBERS[ip].latency, "ewma_ms", ewma)
+            monkeypatch.setattr(proxy.MEMBERS[ip].outstanding, "value", 0)
+    return set_pings
+
+
+def test_fastest_spreads_reads_over_near_equal_pings(pings):
+    pings(fast=1.0, slow=1.1)
+    picks = Counter(proxy.pick_fastest() for _ in range(200))
+    assert set(picks) == {FAST, SLOW}
+    assert min(picks.values()) > 50
+
+
+def test_fastest_prefers_a_clearly_faster_worker(pings):
+    pings(fast=1.0, slow=5.0)
+    assert {proxy.pick_fastest() for _ in range(50)} == {FAST}
+
+
+def test_fastest_accounts_for_outstanding_requests(pings, monkeypatch):
+    pings(fast=1.0, slow=2.0)
+    monkeypatch.setattr(proxy.MEMBERS[FAST].outstanding, "value", 4)
+    assert {proxy.pick_fastest() for _ in range(50)} == {SLOW}
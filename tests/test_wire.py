@@ -0,0 +1,119 @@
+import datetime
+import decimal
+import gzip
+
+import pytest
+
+from wire import accepts_gzip, from_columnar, pack, to_columnar, unpack, wants_msgpack
+
+pytest.importorskip("msgpack")
+
+
+def roundtrip(rows):
+    return from_columnar(to_columnar(rows))
+
+
+def test_int64_and_float64_columns_are_packed_little_endian():
+    rows = [{"id": 1, "score": 0.5}, {"id": -2, "score": -1e300}, {"id": 2 ** 63 - 1, "score": 3.0}]
+    result = to_columnar(rows)
+    assert result["types"] == ["int64", "float64"]
+    assert result["data"][0][:8] == (1).to_bytes(8, "little")
+    assert len(result["data"][1]) == 24
+    assert from_columnar(result) == rows
+
+
+@pytest.mark.parametrize("values, kind", [
+    ([1, None, 3], "int"),
+    ([0.5, None], "float"),
+    ([None, None], "null"),
+    (["a", None], "str"),
+    ([b"\x00\xff", None], "bytes"),
+    ([1, "a"], "mixed"),
+    ([True, False], "mixed"),
+])
+def test_columns_with_nulls_or_mixed_types_stay_lists(values, kind):
+    rows = [{"v": v} for v in values]
+    result = to_columnar(rows)
+    assert result["types"] == [kind]
+    assert result["data"] == [values]
+    assert roundtrip(rows) == rows
+
+
+def test_bigint_unsigned_beyond_int64_falls_back_to_a_list():
+    rows = [{"id": 2 ** 64 - 1}, {"id": 1}]
+    result = to_columnar(rows)
+    assert result["types"] == ["int"]
+    assert result["data"] == [[2 ** 64 - 1, 1]]
+    assert roundtrip(rows) == rows
+
+
+@pytest.mark.parametrize("value, kind, text", [
+    (decimal.Decimal("12.50"), "decimal", "12.50"),
+    (datetime.datetime(2006, 2, 15, 4, 34, 33), "datetime", "2006-02-15T04:34:33"),
+    (datetime.date(2006, 2, 15), "date", "2006-02-15"),
+    (datetime.time(4, 34, 33), "time", "04:34:33"),
+    (datetime.timedelta(hours=-1, seconds=1.5), "timedelta", -3598.5),
+])
+def test_text_types(value, kind, text):
+    result = to_columnar([{"v": value}, {"v": None}])
+    assert result["types"] == [kind]
+    assert result["data"] == [[text, None]]
+
+
+def test_empty_result():
+    assert to_columnar([]) == {"columns": [], "types": [], "data": [], "row_count": 0}
+    assert from_columnar(to_columnar([])) == []
+
+
+def test_column_order_is_kept():
+    rows = [{"z": 1, "a": "x", "m": None}]
+    assert list(roundtrip(rows)[0]) == ["z", "a", "m"]
+
+
+@pytest.mark.parametrize("accept, expected", [
+    ("application/msgpack", True),
+    ("application/x-msgpack", True),
+    ("application/vnd.msgpack", True),
+    ("APPLICATION/MSGPACK", True),
+    ("application/json", False),
+    ("*/*", False),
+    ("", False),
+    (None, False),
+    ("application/msgpack, application/json", True),
+    ("application/json;q=0.9, application/msgpack", True),
+    ("application/msgpack;q=0.5, application/json", False),
+    ("application/msgpack;q=0.5, */*;q=0.1", True),
+    ("application/msgpack;q=0.5, application/*;q=0.8", False),
+    ("application/msgpack;q=0", False),
+    ("application/msgpack;q=bogus", True),
+])
+def test_wants_msgpack(accept, expected):
+    assert wants_msgpack(accept) is expected
+
+
+@pytest.mark.parametrize("accept_encoding, expected", [
+    ("gzip", True),
+    ("gzip, deflate, br", True),
+    ("gzip;q=0", False),
+    ("*", True),
+    ("identity", False),
+    (None, False),
+])
+def test_accepts_gzip(accept_encoding, expected):
+    assert accepts_gzip(accept_encoding) is expected
+
+
+def test_pack_and_unpack_a_batch():
+    payload = {"results": [
+        {"result": [{"id": i, "name": f"row-{i}"} for i in range(500)]},
+        {"error": "Table 'sakila.nope' doesn't exist"},
+        {"result": {"rows_affected": 1}},
+    ], "errors": 1}
+    body, headers = pack(payload, "gzip")
+    assert headers["Content-Encoding"] == "gzip"
+    assert unpack(gzip.decompress(body)) == payload
+
+    small = {"result": [{"id": 1}], "cached": False}
+    body, headers = pack(small, "gzip")
+    assert "Content-Encoding" not in headers
+    assert unpack(body) == small
@@ -0,0 +1,182 @@
+import contextvars
+import os
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+# Shared by gatekeeper.py, proxy.py and proxy_async.py: a per-request trace
+# that times named stages, travels between hops as X-Request-ID, is reported
+# back in a Server-Timing header, and is sampled into a ring buffer.
+# Stage times are exclusive: a stage nested in another is subtracted from its
+# parent, so the stages of one hop add up to (almost) its total.
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "250"))  # always kept at or above this
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "1000"))
+
+REQUEST_ID_HEADER = "X-Request-ID"
+DEADLINE_HEADER = "X-Request-Deadline-Ms"  # remaining budget, set by the gatekeeper
+
+CURRENT = contextvars.ContextVar("trace", default=None)
+
+
+def new_request_id():
+    return uuid.uuid4().hex[:16]
+
+
+class Trace:
+    def __init__(self, request_id=None, name=""):
+        self.request_id = request_id or new_request_id()
+        self.name = name
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.stages = {}  # stage -> ms, in first-seen order
+        self.children = []  # time spent in nested spans, one slot per open span
+        self.attrs = {}
+        self.total_ms = None
+
+    def add(self, stage, ms):
+        self.stages[stage] = self.stages.get(stage, 0.0) + ms
+
+    def merge(self, prefix, stages):
+        # Stages reported by the next hop (already exclusive on its side)
+        for stage, ms in stages.items():
+            self.add(f"{prefix}.{stage}", ms)
+
+    def finish(self):
+        if self.total_ms is None:
+            self.total_ms = (time.perf_counter() - self.start) * 1000
+        return self.total_ms
+
+    def elapsed_ms(self):
+        return self.total_ms if self.total_ms is not None else (time.perf_counter() - self.start) * 1000
+
+    def breakdown(self):
+        out = {stage: round(ms, 3) for stage, ms in self.stages.items()}
+        out["total"] = round(self.elapsed_ms(), 3)
+        return out
+
+    def server_timing(self):
+        return ", ".join(f"{stage};dur={ms:.3f}" for stage, ms in self.breakdown().items())
+
+    def to_dict(self):
+        return {
+            "request_id": self.request_id,
+            "name": self.name,
+            "started_at": round(self.started_at, 6),
+            "timing_ms": self.breakdown(),
+            **self.attrs,
+        }
+
+
+def begin_trace(request_id=None, name=""):
+    trace = Trace(request_id, name)
+    CURRENT.set(trace)
+    return trace
+
+
+def end_trace():
+    CURRENT.set(None)
+
+
+def current_trace():
+    return CURRENT.get()
+
+
+@contextmanager
+def span(stage):
+    trace = CURRENT.get()
+    if trace is None:
+        yield
+        return
+    trace.children.append(0.0)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = (time.perf_counter() - start) * 1000
+        trace.add(stage, elapsed - trace.children.pop())
+        if trace.children:
+            trace.children[-1] += elapsed
+
+
+def annotate(**attrs):
+    trace = CURRENT.get()
+    if trace is not None:
+        trace.attrs.update(attrs)
+
+
+def parse_server_timing(header):
+    """'execute;dur=1.2, total;dur=3' -> {"execute": 1.2, "total": 3.0}"""
+    stages = {}
+    for entry in (header or "").split(","):
+        name, _, params = entry.strip().partition(";")
+        if not name:
+            continue
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "dur":
+                try:
+                    stages[name] = float(value)
+                except ValueError:
+                    pass
+    return stages
+
+
+class TraceBuffer:
+    """Last TRACE_BUFFER_SIZE sampled traces. A trace is kept with probability
+    sample_rate, or always when it took at least slow_ms, or when the caller
+    asked for it (force)."""
+
+    def __init__(self, capacity=TRACE_BUFFER_SIZE, sample_rate=TRACE_SAMPLE_RATE, slow_ms=TRACE_SLOW_MS):
+        self.traces = deque(maxlen=capacity)
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.lock = threading.Lock()
+        self.offered = 0
+        self.kept = 0
+
+    def offer(self, trace, force=False):
+        total = trace.finish()
+        keep = force or total >= self.slow_ms or random.random() < self.sample_rate
+        with self.lock:
+            self.offered += 1
+            if keep:
+                self.kept += 1
+                self.traces.append(trace.to_dict())
+        return keep
+
+    def recent(self, limit=50, min_ms=0.0, request_id=None, name=None):
+        with self.lock:
+            traces = list(self.traces)
+        out = []
+        for t in reversed(traces):
+            if request_id and t["request_id"] != request_id:
+                continue
+            if name and t["name"] != name:
+                continue
+            if t["timing_ms"]["total"] < min_ms:
+                continue
+            out.append(t)
+            if len(out) >= limit:
+                break
+        return out
+
+    def stats(self):
+        with self.lock:
+            return {
+                "offered": self.offered,
+                "kept": self.kept,
+                "buffered": len(self.traces),
+                "capacity": self.traces.maxlen,
+                "sample_rate": self.sample_rate,
+                "slow_ms": self.slow_ms,
+            }
+
+    def clear(self):
+        with self.lock:
+            self.traces.clear()
+            self.offered = self.kept = 0
@@ -0,0 +1,194 @@
+import datetime
+import decimal
+import gzip
+import os
+import sys
+from array import array
+
+from flask.json.provider import DefaultJSONProvider
+
+# Shared by gatekeeper.py, proxy.py and proxy_async.py: response formats.
+# JSON stays the default. A client that sends "Accept: application/msgpack"
+# gets a MessagePack body whose result sets are columnar: the column names
+# once, then one array per column, numeric columns without NULLs packed as
+# little-endian int64/float64 bytes. The gatekeeper relays it untouched.
+# Both msgpack and orjson are optional; without them every response is JSON
+# from Flask's own encoder.
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_TYPE = "application/json"
+MSGPACK_TYPE = "application/msgpack"
+MSGPACK_ALIASES = {MSGPACK_TYPE, "application/x-msgpack", "application/vnd.msgpack"}
+
+# gzip only pays for itself on larger bodies; level 1 keeps the CPU cost low
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "2048"))
+COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", "1"))
+
+# Values of these types travel as ISO strings (timedelta as seconds)
+TEXT_TYPES = {
+    datetime.datetime: "datetime",
+    datetime.date: "date",
+    datetime.time: "time",
+    decimal.Decimal: "decimal",
+}
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask's JSON output (sorted keys, HTTP dates, Decimal as str) written
+    by orjson. Install with app.json = FastJSONProvider(app)."""
+
+    OPTIONS = (orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS) if orjson else 0
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self.OPTIONS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+def install_json(app):
+    if orjson is not None:
+        app.json = FastJSONProvider(app)
+
+
+def parse_accept(header):
+    # "a/b;q=0.5, c/d" -> {"a/b": 0.5, "c/d": 1.0}
+    prefs = {}
+    for part in (header or "").split(","):
+        media, *params = [p.strip() for p in part.split(";")]
+        if not media:
+            continue
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    pass
+        prefs[media.lower()] = q
+    return prefs
+
+
+def wants_msgpack(accept):
+    # Only when asked for by name, and not ranked below JSON
+    if msgpack is None:
+        return False
+    prefs = parse_accept(accept)
+    packed = max((prefs.get(media, 0.0) for media in MSGPACK_ALIASES), default=0.0)
+    plain = max(prefs.get(JSON_TYPE, 0.0), prefs.get("application/*", 0.0), prefs.get("*/*", 0.0))
+    return packed > 0 and packed >= plain
+
+
+def accepts_gzip(accept_encoding):
+    prefs = parse_accept(accept_encoding)
+    return prefs.get("gzip", prefs.get("*", 0.0)) > 0
+
+
+def column_type(values):
+    kinds = {type(v) for v in values}
+    kinds.discard(type(None))
+    if not kinds:
+        return "null"
+    if len(kinds) > 1:
+        return "mixed"
+    kind = kinds.pop()
+    nullable = None in values
+    if kind is int:
+        return "int" if nullable else "int64"
+    if kind is float:
+        return "float" if nullable else "float64"
+    if kind is str:
+        return "str"
+    if kind in (bytes, bytearray):
+        return "bytes"
+    if kind is datetime.timedelta:
+        return "timedelta"
+    return TEXT_TYPES.get(kind, "mixed")
+
+
+def encode_column(kind, values):
+    if kind in ("int64", "float64"):
+        try:
+            packed = array("q" if kind == "int64" else "d", values)
+        except OverflowError:  # BIGINT UNSIGNED beyond int64
+            return "int", values
+        if sys.byteorder != "little":
+            packed.byteswap()
+        return kind, packed.tobytes()
+    if kind in ("datetime", "date", "time", "decimal"):
+        return kind, [None if v is None else (str(v) if kind == "decimal" else v.isoformat()) for v in values]
+    if kind == "timedelta":
+        return kind, [None if v is None else v.total_seconds() for v in values]
+    if kind == "mixed":
+        return kind, [v if v is None or isinstance(v, (int, float, str, bytes)) else str(v) for v in values]
+    return kind, values
+
+
+def to_columnar(rows):
+    """[{col: value}, ...] -> {"columns", "types", "data", "row_count"}"""
+    columns = list(rows[0]) if rows else []
+    types, data = [], []
+    for column in columns:
+        values = [row[column] for row in rows]
+        kind, values = encode_column(column_type(values), values)
+        types.append(kind)
+        data.append(values)
+    return {"columns": columns, "types": types, "data": data, "row_count": len(rows)}
+
+
+def from_columnar(result):
+    """Inverse of to_columnar, for clients: back to a list of row dicts. Text
+    types stay strings."""
+    data = []
+    for kind, values in zip(result["types"], result["data"]):
+        if kind in ("int64", "float64"):
+            unpacked = array("q" if kind == "int64" else "d")
+            unpacked.frombytes(values)
+            if sys.byteorder != "little":
+                unpacked.byteswap()
+            values = unpacked.tolist()
+        data.append(values)
+    return [dict(zip(result["columns"], row)) for row in zip(*data)]
+
+
+def columnar_payload(payload):
+    # Row lists become columnar: "result" of /query, and each batch entry's
+    if isinstance(payload.get("result"), list):
+        payload = {**payload, "result": to_columnar(payload["result"])}
+    if isinstance(payload.get("results"), list):
+        payload = {**payload, "results": [
+            {**r, "result": to_columnar(r["result"])} if isinstance(r.get("result"), list) else r
+            for r in payload["results"]
+        ]}
+    return payload
+
+
+def pack(payload, accept_encoding=None):
+    # -> (body, headers) for a columnar MessagePack response
+    body = msgpack.packb(columnar_payload(payload), use_bin_type=True)
+    headers = {"Content-Type": MSGPACK_TYPE, "Vary": "Accept, Accept-Encoding"}
+    if len(body) >= COMPRESS_MIN_BYTES and accepts_gzip(accept_encoding):
+        body = gzip.compress(body, COMPRESS_LEVEL, mtime=0)
+        headers["Content-Encoding"] = "gzip"
+    return body, headers
+
+
+def unpack(body):
+    """Client side: a MessagePack response body (already un-gzipped) with its
+    result sets turned back into row dicts."""
+    payload = msgpack.unpackb(body, raw=False)
+    if isinstance(payload.get("result"), dict) and "columns" in payload["result"]:
+        payload["result"] = from_columnar(payload["result"])
+    for entry in payload.get("results") or ():
+        if isinstance(entry.get("result"), dict) and "columns" in entry["result"]:
+            entry["result"] = from_columnar(entry["result"])
+    return payload
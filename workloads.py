@@ -0,0 +1,471 @@
+import json
+import os
+import random
+import threading
+import time
+from collections import namedtuple
+
+import pymysql
+import requests
+
+from loadgen import percentile, run_load, run_phase
+
+# Named OLTP mixes against the sakila schema. A mix is a weighted list of
+# operations; each operation is one or more SQL templates run as a single
+# statement, a transaction, or a parallel read batch, with keys drawn from a
+# uniform or zipfian distribution. The same mix runs through the proxy, the
+# gatekeeper or straight against MySQL, and reports tps/qps like sysbench.
+#
+#   WORKLOAD=oltp_read_write WORKLOAD_TARGET=direct MYSQL_HOST=10.0.0.5 python workloads.py
+
+# =========================
+# CONFIG
+# =========================
+WORKLOAD = os.getenv("WORKLOAD", "select1")
+WORKLOAD_TARGET = os.getenv("WORKLOAD_TARGET", "proxy")  # proxy | gatekeeper | direct
+WORKLOAD_READ_RATIO = os.getenv("WORKLOAD_READ_RATIO", "")  # overrides the mix's own split
+WORKLOAD_DISTRIBUTION = os.getenv("WORKLOAD_DISTRIBUTION", "zipfian")  # uniform | zipfian
+WORKLOAD_REQUESTS = int(os.getenv("WORKLOAD_REQUESTS", "2000"))
+WORKLOAD_DURATION = float(os.getenv("WORKLOAD_DURATION", "0"))  # seconds, replaces the request count
+WORKLOAD_SEED = os.getenv("WORKLOAD_SEED", "")
+ZIPF_THETA = float(os.getenv("ZIPF_THETA", "0.99"))
+
+TARGET_URL = os.getenv("TARGET_URL", "http://127.0.0.1:5000")
+GATEKEEPER_TOKEN = os.getenv("GATEKEEPER_TOKEN", "estelle")
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "5"))
+CLIENTS = int(os.getenv("CLIENTS", "16"))
+WARMUP_REQUESTS = int(os.getenv("WARMUP_REQUESTS", "100"))
+
+MYSQL_HOST = os.getenv("MYSQL_HOST", "127.0.0.1")  # host or host:port
+MYSQL_USER = os.getenv("MYSQL_USER", "estelle")
+MYSQL_PASSWORD = os.getenv("MYSQL_PASSWORD", "estelle")
+MYSQL_DB = os.getenv("MYSQL_DB", "sakila")
+
+# Row counts of the stock sakila sample database
+KEY_RANGES = {
+    "actor": (1, 200),
+    "film": (1, 1000),
+    "customer": (1, 599),
+    "inventory": (1, 4581),
+    "rental": (1, 16049),
+    "store": (1, 2),
+    "staff": (1, 2),
+}
+CATEGORIES = (
+    "Action", "Animation", "Children", "Classics", "Comedy", "Documentary", "Drama", "Family",
+    "Foreign", "Games", "Horror", "Music", "New", "Sci-Fi", "Sports", "Travel",
+)
+
+# =========================
+# KEY DISTRIBUTIONS
+# =========================
+class Uniform:
+    def __init__(self, low, high):
+        self.low, self.high = low, high
+
+    def __call__(self, rng):
+        return rng.randint(self.low, self.high)
+
+
+class Zipfian:
+    """YCSB's zipfian generator (Gray et al.) over [low, high]. Ranks are
+    scrambled through a fixed permutation so hot keys are spread over the
+    table instead of all sitting at the lowest ids."""
+
+    def __init__(self, low, high, theta=ZIPF_THETA, seed=42):
+        self.low = low
+        self.n = n = high - low + 1
+        self.theta = theta
+        self.zetan = sum(1 / i ** theta for i in range(1, n + 1))
+        self.half_pow_theta = 0.5 ** theta
+        self.alpha = 1 / (1 - theta)
+        self.eta = (1 - (2 / n) ** (1 - theta)) / (1 - (1 + self.half_pow_theta) / self.zetan) if n > 1 else 1
+        self.permutation = list(range(n))
+        random.Random(seed).shuffle(self.permutation)
+
+    def rank(self, rng):
+        u = rng.random()
+        uz = u * self.zetan
+        if uz < 1:
+            return 0
+        if uz < 1 + self.half_pow_theta:
+            return 1
+        return min(self.n - 1, int(self.n * (self.eta * u - self.eta + 1) ** self.alpha))
+
+    def __call__(self, rng):
+        return self.low + self.permutation[self.rank(rng)]
+
+
+def key_generators(distribution):
+    # Skew only makes sense over more than a couple of keys (store, staff)
+    make = Zipfian if distribution == "zipfian" else Uniform
+    keys = {
+        name: (make if high - low > 1 else Uniform)(low, high)
+        for name, (low, high) in KEY_RANGES.items()
+    }
+    keys["category"] = lambda rng: rng.choice(CATEGORIES)
+    keys["amount"] = lambda rng: f"{rng.uniform(0.99, 11.99):.2f}"
+    keys["title_prefix"] = lambda rng: rng.choice("ABCDEFGHIJKLMNOPRSTUVWY")
+    return keys
+
+# =========================
+# MIXES
+# =========================
+# shape: "single" runs one statement, "transaction" wraps the statements in
+# BEGIN/COMMIT on the manager, "parallel" fans reads out as one batch
+Operation = namedtuple("Operation", "name kind weight shape statements")
+
+
+def read(name, weight, *statements, shape="single"):
+    return Operation(name, "read", weight, shape, statements)
+
+
+def write(name, weight, *statements, shape="single"):
+    return Operation(name, "write", weight, shape, statements)
+
+
+FILM_BY_ID = read(
+    "film_by_id", 30,
+    "SELECT film_id, title, description, release_year, rental_rate, length, rating FROM film WHERE film_id = {film}",
+)
+FILMS_BY_CATEGORY = read(
+    "films_by_category", 15,
+    "SELECT f.film_id, f.title, f.rental_rate FROM film f "
+    "JOIN film_category fc ON fc.film_id = f.film_id "
+    "JOIN category c ON c.category_id = fc.category_id "
+    "WHERE c.name = '{category}' ORDER BY f.title LIMIT 20",
+)
+FILM_SEARCH = read(
+    "film_search", 10,
+    "SELECT film_id, title, rating FROM film WHERE title LIKE '{title_prefix}%' ORDER BY title LIMIT 25",
+)
+FILM_ACTORS = read(
+    "film_actors", 10,
+    "SELECT a.actor_id, a.first_name, a.last_name FROM actor a "
+    "JOIN film_actor fa ON fa.actor_id = a.actor_id WHERE fa.film_id = {film}",
+)
+CUSTOMER_RENTALS = read(
+    "customer_rentals", 20,
+    "SELECT r.rental_id, r.rental_date, r.return_date, f.title FROM rental r "
+    "JOIN inventory i ON i.inventory_id = r.inventory_id "
+    "JOIN film f ON f.film_id = i.film_id "
+    "WHERE r.customer_id = {customer} ORDER BY r.rental_date DESC LIMIT 10",
+)
+AVAILABLE_INVENTORY = read(
+    "available_inventory", 10,
+    "SELECT i.inventory_id FROM inventory i "
+    "LEFT JOIN rental r ON r.inventory_id = i.inventory_id AND r.return_date IS NULL "
+    "WHERE i.film_id = {film} AND i.store_id = {store} AND r.rental_id IS NULL",
+)
+CUSTOMER_DASHBOARD = read(
+    "customer_dashboard", 5,
+    "SELECT customer_id, first_name, last_name, email, active FROM customer WHERE customer_id = {customer}",
+    "SELECT COUNT(*) AS rentals, SUM(return_date IS NULL) AS open_rentals FROM rental WHERE customer_id = {customer}",
+    "SELECT SUM(amount) AS total_paid FROM payment WHERE customer_id = {customer}",
+    shape="parallel",
+)
+REVENUE_BY_CATEGORY = read(
+    "revenue_by_category", 5,
+    "SELECT c.name, SUM(p.amount) AS revenue FROM payment p "
+    "JOIN rental r ON r.rental_id = p.rental_id "
+    "JOIN inventory i ON i.inventory_id = r.inventory_id "
+    "JOIN film_category fc ON fc.film_id = i.film_id "
+    "JOIN category c ON c.category_id = fc.category_id "
+    "GROUP BY c.name ORDER BY revenue DESC",
+)
+TOP_RENTED_FILMS = read(
+    "top_rented_films", 5,
+    "SELECT f.title, COUNT(*) AS rentals FROM rental r "
+    "JOIN inventory i ON i.inventory_id = r.inventory_id "
+    "JOIN film f ON f.film_id = i.film_id "
+    "WHERE i.store_id = {store} GROUP BY f.film_id, f.title ORDER BY rentals DESC LIMIT 10",
+)
+
+PAYMENT_INSERT = write(
+    "payment_insert", 10,
+    "INSERT INTO payment (customer_id, staff_id, rental_id, amount, payment_date) "
+    "VALUES ({customer}, {staff}, NULL, {amount}, NOW())",
+)
+INVENTORY_UPDATE = write(
+    "inventory_update", 5,
+    "UPDATE inventory SET last_update = NOW() WHERE inventory_id = {inventory}",
+)
+CUSTOMER_UPDATE = write(
+    "customer_update", 5,
+    "UPDATE customer SET last_update = NOW() WHERE customer_id = {customer}",
+)
+RENTAL_CHECKOUT = write(
+    "rental_checkout", 10,
+    "INSERT INTO rental (rental_date, inventory_id, customer_id, staff_id) "
+    "VALUES (NOW(6), {inventory}, {customer}, {staff})",
+    "INSERT INTO payment (customer_id, staff_id, rental_id, amount, payment_date) "
+    "VALUES ({customer}, {staff}, LAST_INSERT_ID(), {amount}, NOW())",
+    shape="transaction",
+)
+RENTAL_RETURN = write(
+    "rental_return", 5,
+    "UPDATE rental SET return_date = NOW() WHERE rental_id = {rental} AND return_date IS NULL",
+)
+
+Mix = namedtuple("Mix", "description read_ratio operations")
+
+MIXES = {
+    # The original benchmark queries, kept so old results stay comparable
+    "select1": Mix("SELECT 1 and a single actor insert", 0.5, (
+        read("select_one", 1, "SELECT 1"),
+        write("actor_insert", 1, "INSERT INTO actor (first_name, last_name) VALUES ('Bench', 'Mark')"),
+    )),
+    "oltp_read_only": Mix("Storefront reads: film lookups, search, rentals", 1.0, (
+        FILM_BY_ID, FILMS_BY_CATEGORY, FILM_SEARCH, FILM_ACTORS, CUSTOMER_RENTALS,
+        AVAILABLE_INVENTORY, CUSTOMER_DASHBOARD,
+    )),
+    "oltp_read_write": Mix("Storefront reads with payments, rentals and inventory updates", 0.8, (
+        FILM_BY_ID, FILMS_BY_CATEGORY, FILM_SEARCH, FILM_ACTORS, CUSTOMER_RENTALS,
+        AVAILABLE_INVENTORY, CUSTOMER_DASHBOARD,
+        PAYMENT_INSERT, INVENTORY_UPDATE, CUSTOMER_UPDATE, RENTAL_CHECKOUT, RENTAL_RETURN,
+    )),
+    "oltp_write_only": Mix("Payments, rentals, returns and row updates", 0.0, (
+        PAYMENT_INSERT, INVENTORY_UPDATE, CUSTOMER_UPDATE, RENTAL_CHECKOUT, RENTAL_RETURN,
+    )),
+    "rental_counter": Mix("Checkout desk: availability checks, checkouts and returns", 0.6, (
+        AVAILABLE_INVENTORY, CUSTOMER_RENTALS, FILM_BY_ID, RENTAL_CHECKOUT, RENTAL_RETURN,
+    )),
+    "reporting": Mix("Aggregations over payments and rentals", 1.0, (
+        REVENUE_BY_CATEGORY, TOP_RENTED_FILMS, CUSTOMER_DASHBOARD,
+    )),
+}
+
+# =========================
+# TARGETS
+# =========================
+class HttpTarget:
+    """The proxy's /query and /query/batch, optionally through the gatekeeper
+    (token set). Reads skip the proxy result cache so MySQL does the work."""
+
+    def __init__(self, base_url, token=None, cache=False):
+        self.base_url = base_url.rstrip("/")
+        self.headers = {"Authorization": f"Bearer {token}"} if token else {}
+        self.cache = cache
+
+    def execute(self, session, operation, statements):
+        if operation.shape == "single":
+            resp = session.post(
+                f"{self.base_url}/query",
+                json={"query": statements[0], "cache": self.cache},
+                headers=self.headers,
+                timeout=REQUEST_TIMEOUT,
+            )
+        else:
+            resp = session.post(
+                f"{self.base_url}/query/batch",
+                json={"queries": list(statements), "mode": operation.shape},
+                headers=self.headers,
+                timeout=REQUEST_TIMEOUT,
+            )
+        if resp.status_code != 200:
+            return False
+        # A batch answers 200 even when some of its statements failed
+        return operation.shape == "single" or not any("error" in r for r in resp.json().get("results", []))
+
+
+class DirectTarget:
+    # One connection per client thread, straight to MySQL
+    def __init__(self, address=MYSQL_HOST):
+        host, _, port = address.partition(":")
+        self.host, self.port = host, int(port) if port else 3306
+        self.local = threading.local()
+
+    def connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.local.conn = pymysql.connect(
+                host=self.host, port=self.port, user=MYSQL_USER, password=MYSQL_PASSWORD,
+                database=MYSQL_DB, connect_timeout=3, autocommit=True,
+            )
+        return conn
+
+    def execute(self, session, operation, statements):
+        conn = self.connection()
+        try:
+            with conn.cursor() as cursor:
+                if operation.shape == "transaction":
+                    conn.begin()
+                for sql in statements:
+                    cursor.execute(sql)
+                    cursor.fetchall()
+                if operation.shape == "transaction":
+                    conn.commit()
+            return True
+        except pymysql.OperationalError:
+            # Connection is likely gone; reconnect on the next request
+            self.local.conn = None
+            try:
+                conn.close()
+            except pymysql.MySQLError:
+                pass
+            raise
+        except pymysql.MySQLError:
+            if operation.shape == "transaction":
+                conn.rollback()
+            raise
+
+
+def make_target(kind, url=TARGET_URL):
+    if kind == "direct":
+        return DirectTarget()
+    if kind == "gatekeeper":
+        return HttpTarget(url, GATEKEEPER_TOKEN)
+    return HttpTarget(url)
+
+# =========================
+# WORKLOAD
+# =========================
+class Workload:
+    """Picks a weighted operation per request, fills in its keys and runs it
+    against the target, keeping per-operation latencies for the report."""
+
+    def __init__(self, name, target, read_ratio=None, distribution=WORKLOAD_DISTRIBUTION, seed=None):
+        if name not in MIXES:
+            raise ValueError(f"Unknown workload {name!r}, expected one of {sorted(MIXES)}")
+        mix = MIXES[name]
+        self.name = name
+        self.mix = mix
+        self.target = target
+        self.distribution = distribution
+        self.read_ratio = mix.read_ratio if read_ratio is None else read_ratio
+        self.keys = key_generators(distribution)
+        self.operations = list(mix.operations)
+        self.weights = self.split_weights(self.read_ratio)
+        self.seed = seed
+        self.seeds = random.Random(seed)
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.samples = {}  # operation -> [(latency_ms, ok), ...]
+
+    def split_weights(self, read_ratio):
+        # Scale reads and writes so they add up to read_ratio / 1 - read_ratio
+        totals = {"read": 0, "write": 0}
+        for op in self.operations:
+            totals[op.kind] += op.weight
+        share = {"read": read_ratio, "write": 1 - read_ratio}
+        return [
+            share[op.kind] * op.weight / totals[op.kind] if totals[op.kind] else 0
+            for op in self.operations
+        ]
+
+    def rng(self):
+        rng = getattr(self.local, "rng", None)
+        if rng is None:
+            with self.lock:
+                rng = self.local.rng = random.Random(self.seeds.random())
+        return rng
+
+    def render(self, operation, rng):
+        params = {}
+        statements = []
+        for template in operation.statements:
+            for name in self.keys:
+                if "{" + name + "}" in template and name not in params:
+                    params[name] = self.keys[name](rng)
+            statements.append(template.format(**params))
+        return statements
+
+    def request(self, session):
+        rng = self.rng()
+        operation = rng.choices(self.operations, self.weights)[0]
+        statements = self.render(operation, rng)
+        start = time.perf_counter()
+        try:
+            ok = self.target.execute(session, operation, statements)
+        except (requests.RequestException, pymysql.MySQLError):
+            ok = False
+        latency_ms = (time.perf_counter() - start) * 1000
+        with self.lock:
+            self.samples.setdefault(operation, []).append((latency_ms, ok))
+        return ok
+
+    def reset(self):
+        with self.lock:
+            self.samples = {}
+
+    def describe(self):
+        return {
+            "name": self.name,
+            "description": self.mix.description,
+            "read_ratio": self.read_ratio,
+            "distribution": self.distribution,
+            "seed": self.seed,
+            "operations": {
+                op.name: {"kind": op.kind, "shape": op.shape, "statements": len(op.statements), "weight": round(w, 4)}
+                for op, w in zip(self.operations, self.weights)
+            },
+        }
+
+    def report(self, elapsed):
+        # sysbench-style counters plus per-operation percentiles
+        with self.lock:
+            samples = dict(self.samples)
+        operations = {}
+        statements = {"read": 0, "write": 0}
+        transactions = errors = 0
+        for op, entries in samples.items():
+            latencies = sorted(e[0] for e in entries)
+            op_errors = sum(1 for e in entries if not e[1])
+            transactions += len(entries) - op_errors
+            errors += op_errors
+            statements[op.kind] += (len(entries) - op_errors) * len(op.statements)
+            operations[op.name] = {
+                "requests": len(entries),
+                "errors": op_errors,
+                "p50": round(percentile(latencies, 50), 3),
+                "p95": round(percentile(latencies, 95), 3),
+                "p99": round(percentile(latencies, 99), 3),
+            }
+        return {
+            "tps": round(transactions / elapsed, 2) if elapsed > 0 else None,
+            "qps": round((statements["read"] + statements["write"]) / elapsed, 2) if elapsed > 0 else None,
+            "read_statements": statements["read"],
+            "write_statements": statements["write"],
+            "operations": operations,
+        }
+
+
+def run_workload(workload, clients, requests_total=None, duration=None, warmup_requests=0):
+    """Warm-up, then a measured mixed phase; returns the loadgen summary with
+    the workload description and tps/qps/per-operation figures merged in,
+    plus the raw samples like run_load."""
+    if warmup_requests:
+        run_phase(workload.request, bool, clients, warmup_requests)
+    workload.reset()
+    summary, samples = run_load(workload.name, workload.request, bool, clients, requests_total, duration)
+    summary.update(workload.report(summary["elapsed_sec"]))
+    summary["workload"] = workload.describe()
+    print(f"{workload.name}: {summary['tps']} tps, {summary['qps']} qps")
+    return summary, samples
+
+
+def workload_from_env(target):
+    read_ratio = float(WORKLOAD_READ_RATIO) if WORKLOAD_READ_RATIO else None
+    seed = int(WORKLOAD_SEED) if WORKLOAD_SEED else None
+    return Workload(WORKLOAD, target, read_ratio, WORKLOAD_DISTRIBUTION, seed)
+
+# =========================
+# MAIN
+# =========================
+if __name__ == "__main__":
+    from results_store import record_run
+
+    workload = workload_from_env(make_target(WORKLOAD_TARGET))
+    print(f"=== Workload {workload.name} via {WORKLOAD_TARGET} ===")
+    summary, _ = run_workload(
+        workload, CLIENTS,
+        None if WORKLOAD_DURATION else WORKLOAD_REQUESTS,
+        WORKLOAD_DURATION or None,
+        WARMUP_REQUESTS,
+    )
+
+    filename = f"results_workload_{workload.name}_{WORKLOAD_TARGET}.json"
+    with open(filename, "w") as f:
+        json.dump({"target": WORKLOAD_TARGET, "clients": CLIENTS, "mixed": summary}, f, indent=2)
+    record_run(WORKLOAD_TARGET, {"mixed": summary}, mode="workload", workload=workload.name, clients=CLIENTS)
+    print(f"Results written to {filename}")